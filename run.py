@@ -1,32 +1,98 @@
 import os
 import json
 import logging
+import time
 
 from datetime import datetime
 
+from src.metrics import (
+    profile_samples,
+    read_profile_report,
+    read_textfile_value,
+    stage_details,
+    write_textfile,
+)
+from src.profiling import profile_report_path
 from src.utils import breakout_DTD_filename
 
 
 LOG_DIR = os.getenv("DIR_LOG")
 ATOC_DIR = os.getenv("DIR_DATA_EXTERNAL_ATOC")
 OUT_DIR = os.getenv("DIR_OUTPUTS")
-
-
-def main():
-
+METRICS_DIR = os.getenv("DIR_OUTPUTS_METRICS")
+
+
+def run_step(step, command, samples):
+    """
+    Runs one step of the process as a shell command, adding its duration and
+    whether it exited cleanly to the metric `samples`.
+    """
+    start = time.perf_counter()
+    status = os.system(command)
+    samples.append(
+        ("step_duration_seconds", {"step": step}, time.perf_counter() - start)
+    )
+    samples.append(("step_success", {"step": step}, int(status == 0)))
+    return status == 0
+
+
+def record_report(script, output_path, started, samples):
+    """
+    Adds the stage metrics of this run of `script` to `samples` from its
+    `--profile` report beside `output_path`, and returns the report, or None
+    if the step wrote none.
+    """
+    report = read_profile_report(
+        profile_report_path(output_path, script), since=started
+    )
+    if report is not None:
+        samples.extend(profile_samples(script, report))
+    return report
+
+
+def publish(directory, started, samples):
+    """
+    Runs the publish step over `directory`, adding the bytes published in
+    each encoding to the metric `samples`. Returns whether it succeeded.
+    """
+    published = run_step("publish", f"python ./src/publish.py {directory}", samples)
+    report = read_profile_report(
+        os.path.join(directory, "publish_report.json"), since=started
+    )
+    if report is not None:
+        for encoding, size in report["total_bytes"].items():
+            samples.append(("published_bytes", {"encoding": encoding}, size))
+    return published
+
+
+def run_process(samples, started):
+    """
+    Fetches the latest feed and, if it is new, builds the timetable and
+    visualisations from it, and publishes them, adding metrics of each step
+    to `samples`.
+    Returns whether every step succeeded.
+    """
     logger = logging.getLogger(__name__)
-    logger.info(" ------------------------------------------------------- ")
-    logger.info("Running full process")
-
-    # Fetch latest files
-    os.system(f"python ./src/fetch_feeds.py timetable {ATOC_DIR}")
 
-    with open("progress.json", "r") as f:
-        prog = json.load(f)
+    # steps are profiled for time and resident memory only, as tracing
+    # memory (--trace_memory) slows them down
 
-        if not prog["new_files"]:
-            logger.info("No new feed data has been found, exiting.")
-            return None
+    # Fetch latest files
+    fetched = run_step(
+        "fetch_feeds",
+        f"python ./src/fetch_feeds.py timetable {ATOC_DIR} --profile",
+        samples,
+    )
+    fetch_report = record_report(
+        "fetch_feeds", os.path.join(ATOC_DIR, "timetable"), started, samples
+    )
+    if fetch_report is not None:
+        downloads = stage_details(fetch_report, "download", "bytes")
+        samples.append(("downloaded_files", {}, len(downloads)))
+        samples.append(("downloaded_bytes", {}, sum(downloads)))
+    if not fetched:
+        logger.info("Fetching feeds failed, exiting.")
+        return False
 
     # Find all ATOC zips for FULL data
     files = [
@@ -37,19 +103,99 @@ def main():
 
     logger.info(f"Found {len(files)} files")
 
-    # Order list by production number, pop latest (highest number)
+    # Order list by production number, latest (highest number) last
     files.sort(key=lambda d: d["number"])
+    if files:
+        samples.append(("latest_feed_number", {}, files[-1]["number"]))
+
+    with open("progress.json", "r") as f:
+        prog = json.load(f)
+
+        if not prog["new_files"]:
+            logger.info("No new feed data has been found, exiting.")
+            return True
+
     latest = files.pop()
     logger.info(f"Latest file: {latest['name']}")
 
+    # the day build_timetable.py starts on by default, which names the outputs
+    date = datetime.now().date().strftime("%Y%m%d")
+    output_name = f"full_uk_disruption_summary_multiday_start_{date}_30days"
+
     # Produce statistics from that file
-    os.system(
+    built = run_step(
+        "build_timetable",
         "python ./src/build_timetable.py "
-        + f"{latest['name']} {ATOC_DIR} {OUT_DIR} --no_days 30"
+        + f"{latest['name']} {ATOC_DIR} {OUT_DIR} --no_days 30 --hourly_profile "
+        + "--profile",
+        samples,
+    )
+    build_report = record_report(
+        "build_timetable",
+        os.path.join(OUT_DIR, date, f"{output_name}.parquet"),
+        started,
+        samples,
     )
+    if build_report is not None:
+        parse_rows = {"cif_records_parsed": "rows_in", "schedule_rows": "rows_out"}
+        for name, key in parse_rows.items():
+            samples.append((name, {}, sum(stage_details(build_report, "parse", key))))
+        for key in ["stations", "days"]:
+            for value in stage_details(build_report, "export", key):
+                samples.append((f"{key}_emitted", {}, value))
 
     # Produce visualisation from those statistics
-    os.system("python ./src/make_visualisations.py --no_days 30")
+    visualised = run_step(
+        "make_visualisations",
+        "python ./src/make_visualisations.py --no_days 30 "
+        + f"--working_directory {os.path.join(OUT_DIR, date)} --profile",
+        samples,
+    )
+    record_report(
+        "make_visualisations",
+        os.path.join(OUT_DIR, date, f"{output_name}.html"),
+        started,
+        samples,
+    )
+
+    # Minify and precompress the visualisations for static hosting
+    published = visualised and publish(os.path.join(OUT_DIR, date), started, samples)
+
+    return built and visualised and published
+
+
+def main():
+
+    logger = logging.getLogger(__name__)
+    logger.info(" ------------------------------------------------------- ")
+    logger.info("Running full process")
+
+    started = time.time()
+    samples = []
+    success = False
+    try:
+        success = run_process(samples, started)
+    finally:
+        # node-exporter textfile metrics, so monitoring can alert on failed,
+        # slow or stale runs
+        if METRICS_DIR is None:
+            logger.info("DIR_OUTPUTS_METRICS not set, not writing metrics.")
+        else:
+            metrics_filepath = os.path.join(METRICS_DIR, "rail_reporter.prom")
+            finished = time.time()
+            last_success = (
+                finished
+                if success
+                else read_textfile_value(
+                    metrics_filepath, "last_success_timestamp_seconds"
+                )
+            )
+            samples.append(("last_run_success", {}, int(success)))
+            samples.append(("last_run_timestamp_seconds", {}, finished))
+            if last_success is not None:
+                samples.append(("last_success_timestamp_seconds", {}, last_success))
+            write_textfile(metrics_filepath, samples)
+            logger.info(f"Metrics written to {metrics_filepath}")
 
 
 if __name__ == "__main__":
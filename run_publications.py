@@ -42,6 +42,10 @@ def main():
     # Build a single (current-day) visualisation
     os.system("python ./src/make_publications.py")
 
+    # Minify and precompress it for static hosting
+    today = datetime.now().date().strftime("%Y%m%d")
+    os.system(f"python ./src/publish.py {os.path.join(OUT_DIR, today)}")
+
     # --------------------------------------------------------------------------
     # EXAMPLE SCRIPTING FOR SPECIFIC DATES/CONFIGS FOLLOW
     # --------------------------------------------------------------------------
@@ -61,27 +65,35 @@ def main():
     # # build single day visual for 20220806
     # os.system(
     #     f"python ./src/make_publications.py --working_directory {OUT_DIR}"
-    #     "/20220806 --csv_input_filename "
-    #     "full_uk_disruption_summary_multiday_start_20220806_30days.csv  "
+    #     "/20220806 --input_filename "
+    #     "full_uk_disruption_summary_multiday_start_20220806_30days.parquet  "
     #     "--start_date 06082022"
     # )
 
     # # build single day visual for 20220813
     # os.system(
     #     f"python ./src/make_publications.py --working_directory {OUT_DIR}"
-    #     "/20220811 --csv_input_filename "
-    #     "full_uk_disruption_summary_multiday_start_20220811_30days.csv  "
+    #     "/20220811 --input_filename "
+    #     "full_uk_disruption_summary_multiday_start_20220811_30days.parquet  "
     #     "--start_date 13082022"
     # )
 
     # # build timeseries visual for 20220811 to 20220831
     # os.system(
     #     f"python ./src/make_publications.py --working_directory {OUT_DIR}"
-    #     "/20220811 --csv_input_filename "
-    #     "full_uk_disruption_summary_multiday_start_20220811_30days.csv  "
+    #     "/20220811 --input_filename "
+    #     "full_uk_disruption_summary_multiday_start_20220811_30days.parquet  "
     #     "--start_date 11082022 --end_date 31082022"
     # )
 
+    # # build all of the above visuals for 20220811 in one run
+    # os.system(
+    #     f"python ./src/make_publications.py --working_directory {OUT_DIR}"
+    #     "/20220811 --input_filename "
+    #     "full_uk_disruption_summary_multiday_start_20220811_30days.parquet  "
+    #     "--batch 13082022 --batch 11082022-31082022"
+    # )
+
     # build timetable for merge checking
     # os.system(
     #     f"python ./src/build_timetable.py RJTTF469.zip {ATOC_DIR} {OUT_DIR} "
@@ -91,16 +103,16 @@ def main():
     # # build single day visual to check merge
     # os.system(
     #     f"python ./src/make_publications.py --working_directory {OUT_DIR}"
-    #     "/20220817 --csv_input_filename "
-    #     "full_uk_disruption_summary_multiday_start_20220817_30days.csv  "
+    #     "/20220817 --input_filename "
+    #     "full_uk_disruption_summary_multiday_start_20220817_30days.parquet  "
     #     "--start_date 17082022"
     # )
 
     # # build timeseries visual to check merge
     # os.system(
     #     f"python ./src/make_publications.py --working_directory {OUT_DIR}"
-    #     "/20220817 --csv_input_filename "
-    #     "full_uk_disruption_summary_multiday_start_20220817_30days.csv  "
+    #     "/20220817 --input_filename "
+    #     "full_uk_disruption_summary_multiday_start_20220817_30days.parquet  "
     #     "--start_date 17082022 --end_date 31082022"
     # )
 
@@ -0,0 +1,370 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from zipfile import BadZipFile
+
+import click
+
+import build_timetable
+from history_store import HistoryStore
+from profiling import rss_mb
+from utils import (
+    breakout_DTD_filename,
+    download_big_file,
+    read_disruption_summary,
+    read_dump_date,
+)
+
+# how often a worker's resident memory is checked against its limit
+MEMORY_POLL_SECONDS = 0.5
+
+# kept in the store folder, where the "_" prefix hides it from dataset reads
+LEDGER_NAME = "_backfill_ledger.jsonl"
+
+
+def discover_feeds(data_directory):
+    """
+    Returns the full timetable feeds (RJTTF*.ZIP) in `data_directory`, by
+    feed number, with the date each was dumped, read from its header.
+    """
+    logger = logging.getLogger(__name__)
+
+    feeds = []
+    for file in os.listdir(data_directory):
+        if not (file.startswith("RJTTF") and file.endswith(".ZIP")):
+            continue
+        try:
+            dump_date = read_dump_date(os.path.join(data_directory, file))
+        except (BadZipFile, ValueError):
+            dump_date = None
+        if dump_date is None:
+            logger.warning(f"No dump date could be read from {file}, skipping it.")
+            continue
+        feeds.append(
+            {
+                "zip_name": file,
+                "feed_number": breakout_DTD_filename(file)["number"],
+                "dump_date": dump_date,
+            }
+        )
+
+    return sorted(feeds, key=lambda feed: feed["feed_number"])
+
+
+def feed_key(feed):
+    """Returns how a feed is keyed in the ledger and the store manifest."""
+    return feed["feed_number"], str(feed["dump_date"])
+
+
+def read_ledger(ledger_path):
+    """
+    Returns the latest ledger entry of each feed, keyed by `feed_key`.
+    """
+    entries = {}
+    if not os.path.exists(ledger_path):
+        return entries
+    with open(ledger_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by an interrupted run
+                continue
+            entries[feed_key(entry)] = entry
+    return entries
+
+
+def append_ledger(ledger_path, entry):
+    """
+    Appends an entry to the ledger, flushed to disk before returning so it
+    survives the run being interrupted.
+    """
+    with open(ledger_path, "a+") as f:
+        # start a fresh line after one cut short by an interrupted run
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                f.write("\n")
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def pending_feeds(feeds, ledger, store):
+    """
+    Returns the `feeds` not yet backfilled, either recorded as done in the
+    `ledger` or already in the `store` (such as by `build_timetable.py
+    --history_directory`). Feeds that failed before are tried again.
+    """
+    stored = {feed_key(feed) for feed in store.feeds()}
+    return [
+        feed
+        for feed in feeds
+        if feed_key(feed) not in stored
+        and ledger.get(feed_key(feed), {}).get("status") != "done"
+    ]
+
+
+def raise_memory_error(signum, frame):
+    """Fails whatever a worker is running, as `watch_memory` signals."""
+    raise MemoryError("Worker exceeded its memory limit.")
+
+
+def watch_memory(memory_limit_mb, poll_seconds=MEMORY_POLL_SECONDS):
+    """
+    Polls the resident memory of the process, signalling its main thread
+    (which `raise_memory_error` on SIGUSR1) when it goes over
+    `memory_limit_mb`. Signals once per excursion, so the limit is checked
+    again only after memory falls back below it.
+    """
+    armed = True
+    while True:
+        over_limit = rss_mb() > memory_limit_mb
+        if armed and over_limit:
+            os.kill(os.getpid(), signal.SIGUSR1)
+        armed = not over_limit
+        time.sleep(poll_seconds)
+
+
+def init_worker(memory_limit_mb):
+    """
+    Sets up logging in a worker process, and caps its resident memory at
+    `memory_limit_mb` where the OS allows, so a feed too big for the host
+    fails with a MemoryError rather than taking down the others.
+
+    The cap is soft: memory is polled by a background thread, and the
+    MemoryError is raised in the main thread at its next Python bytecode,
+    so a worker may briefly go over it inside a long running call into
+    pandas or numpy. Capping the address space instead (RLIMIT_AS) would
+    fail workers whose libraries reserve more than they use, as numba and
+    pyarrow do.
+    """
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    if memory_limit_mb is None:
+        return
+    if not hasattr(signal, "SIGUSR1") or rss_mb() is None:
+        logging.getLogger(__name__).warning(
+            "Could not cap the memory of backfill workers on this OS."
+        )
+        return
+    signal.signal(signal.SIGUSR1, raise_memory_error)
+    threading.Thread(target=watch_memory, args=(memory_limit_mb,), daemon=True).start()
+
+
+def build_feed(
+    feed,
+    data_directory,
+    no_days,
+    low_memory,
+    memory_budget_mb,
+    scratch_directory,
+    start_date=None,
+    engine="legacy",
+):
+    """
+    Runs `build_timetable.py` for one feed over `no_days` from `start_date`,
+    by default the day after it was dumped as the daily run does, counting
+    with `engine` (see `build_timetable.DAY_COUNTERS`), in a scratch folder
+    of its own so that jobs never share unpacked files.
+    Returns a ledger entry for the job, and the summary built, or None if it
+    failed.
+    """
+    logger = logging.getLogger(__name__)
+
+    started = time.perf_counter()
+    dump_date = f"{feed['dump_date']:%d%m%Y}"
+    if start_date is None:
+        start_date = feed["dump_date"] + timedelta(days=1)
+    entry = {
+        "zip_name": feed["zip_name"],
+        "feed_number": feed["feed_number"],
+        "dump_date": str(feed["dump_date"]),
+    }
+
+    with tempfile.TemporaryDirectory(
+        prefix="rail_reporter_backfill_", dir=scratch_directory
+    ) as tmp_dir:
+        for file in [feed["zip_name"], "Stops.csv"]:
+            os.symlink(
+                os.path.abspath(os.path.join(data_directory, file)),
+                os.path.join(tmp_dir, file),
+            )
+
+        args = [feed["zip_name"], tmp_dir, tmp_dir, "--dump_date", dump_date]
+        args += ["--start_date", f"{start_date:%d%m%Y}", "--no_days", str(no_days)]
+        if low_memory:
+            args += ["--low_memory", "--memory_budget_mb", str(memory_budget_mb)]
+            args += ["--spill_directory", tmp_dir]
+        if engine != "legacy":
+            args += ["--engine", engine]
+
+        try:
+            build_timetable.main.main(args, standalone_mode=False)
+            out_df = read_disruption_summary(
+                os.path.join(
+                    tmp_dir,
+                    f"{start_date:%Y%m%d}",
+                    "full_uk_disruption_summary_multiday_start_"
+                    f"{start_date:%Y%m%d}_{no_days}days.parquet",
+                )
+            )
+        except Exception as e:
+            logger.exception(f"Building {feed['zip_name']} failed.")
+            out_df = None
+            entry["error"] = repr(e)
+
+    entry["status"] = "failed" if out_df is None else "built"
+    entry["seconds"] = round(time.perf_counter() - started, 2)
+    return entry, out_df
+
+
+@click.command()
+@click.argument("data_directory")
+@click.argument("history_directory")
+@click.option("--no_days", default=30, type=int)
+@click.option("--workers", default=2, type=int)
+@click.option("--memory_limit_mb", default=None, type=int)
+@click.option(
+    "--low_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--memory_budget_mb", default=512, type=int)
+@click.option("--scratch_directory", default=None, type=str)
+@click.option("--ledger_path", default=None, type=str)
+@click.option(
+    "--engine",
+    default="legacy",
+    type=click.Choice(["legacy", *build_timetable.DAY_COUNTERS]),
+)
+def main(
+    data_directory: str,
+    history_directory: str,
+    no_days: int,
+    workers: int,
+    memory_limit_mb: int,
+    low_memory: bool,
+    memory_budget_mb: int,
+    scratch_directory: str,
+    ledger_path: str,
+    engine: str,
+):
+    """
+    Builds the historical store from every archived ATOC feed, running
+    `build_timetable.py` for each feed not yet backfilled across a pool of
+    worker processes, and adding each summary to the store as it finishes.
+    Interrupted runs resume where they left off.
+
+    Parameters
+    ----------
+    data_directory :
+        Directory containing the archived ATOC zip files (RJTTF*.ZIP)
+    history_directory :
+        Directory of the historical store (see `history_store.py`)
+    no_days: int
+        Number of days from the day after each feed was dumped to summarise
+    workers: int
+        Number of feeds built at once, each in its own process
+    memory_limit_mb: int
+        Optional soft cap on the resident memory of each worker process, so
+        a feed that exceeds it fails alone, where the OS allows (see
+        `init_worker`)
+    low_memory: bool
+        Build each feed in low memory mode (see `chunked.py`), to keep jobs
+        within `memory_limit_mb`
+    memory_budget_mb: int
+        Memory that parsed rows may take in low memory mode
+    scratch_directory: str
+        Where each job unpacks its feed and writes its outputs before they
+        are added to the store, defaults to the system temporary directory
+    ledger_path: str
+        JSON lines record of each feed built or failed, used to resume,
+        defaults to `_backfill_ledger.jsonl` in `history_directory`
+    engine: str
+        How each feed's station journeys are counted (see `build_timetable.py
+        --engine`)
+    """
+    logger = logging.getLogger(__name__)
+
+    store = HistoryStore(history_directory)
+    if ledger_path is None:
+        ledger_path = os.path.join(history_directory, LEDGER_NAME)
+
+    # fetched once up front, rather than by each job at the same time
+    download_big_file(os.getenv("URL_STOPS"), "Stops.csv", data_directory)
+
+    feeds = discover_feeds(data_directory)
+    pending = pending_feeds(feeds, read_ledger(ledger_path), store)
+    logger.info(
+        f"Found {len(feeds)} feeds in {data_directory}, "
+        f"{len(feeds) - len(pending)} already backfilled."
+    )
+
+    # a fresh process per feed, so memory is handed back between feeds
+    with multiprocessing.get_context("spawn").Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(memory_limit_mb,),
+        maxtasksperchild=1,
+    ) as pool:
+        for entry, out_df in pool.imap_unordered(
+            partial(
+                build_feed,
+                data_directory=data_directory,
+                no_days=no_days,
+                low_memory=low_memory,
+                memory_budget_mb=memory_budget_mb,
+                scratch_directory=scratch_directory,
+                engine=engine,
+            ),
+            pending,
+        ):
+            # added here, one feed at a time, as the store takes one writer
+            if out_df is not None:
+                entry["rows"] = store.append(
+                    out_df,
+                    feed_number=entry["feed_number"],
+                    dump_date=datetime.strptime(entry["dump_date"], "%Y-%m-%d").date(),
+                )
+                entry["status"] = "done"
+            entry["finished_at"] = datetime.now().isoformat(timespec="seconds")
+            append_ledger(ledger_path, entry)
+            logger.info(
+                f"Backfill of {entry['zip_name']} {entry['status']} "
+                f"in {entry['seconds']}s."
+            )
+
+    failed = [
+        entry
+        for entry in read_ledger(ledger_path).values()
+        if entry["status"] == "failed"
+    ]
+    logger.info(f"Backfill finished, {len(failed)} feeds failed.")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
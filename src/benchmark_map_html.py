@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+import pandas as pd
+from pyprojroot import here
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+
+from map_features import build_compact_features, build_features
+from map_layers import add_timestamped_geojson
+from utils import build_base_map, read_disruption_summary, scale_col
+
+
+def make_synthetic_summary(no_stations: int, no_days: int, seed: int = 0):
+    """
+    Builds a table shaped like the `build_timetable.py` output, with random
+    station locations and service counts, for benchmarking map outputs.
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(2022, 8, 1).date()
+
+    stations = pd.DataFrame(
+        {
+            "TIPLOC": [f"STN{i:04d}" for i in range(no_stations)],
+            "Station_Name": [f"Station {i}" for i in range(no_stations)],
+            "Latitude": rng.uniform(50.0, 58.5, no_stations),
+            "Longitude": rng.uniform(-5.5, 1.7, no_stations),
+            "journeys_timetabled": rng.integers(1, 1500, no_stations),
+        }
+    )
+
+    days = []
+    for i in range(no_days):
+        day = stations.copy()
+        day["journeys_scheduled"] = np.floor(
+            day["journeys_timetabled"] * rng.uniform(0, 1.1, no_stations)
+        )
+        day["date"] = (start + timedelta(days=i)).strftime("%Y-%m-%d")
+        days.append(day)
+
+    df = pd.concat(days, ignore_index=True)
+    df["pct_timetabled_services_running"] = np.round(
+        df["journeys_scheduled"] / df["journeys_timetabled"] * 100, 2
+    )
+    return df
+
+
+def measure_page_load(filepath: str, timeout: int = 300):
+    """
+    Opens a saved map in headless firefox and returns the time in ms from
+    navigation start to the end of the page load event.
+    """
+    options = webdriver.firefox.options.Options()
+    options.add_argument("--headless")
+    driver = webdriver.Firefox(options=options)
+
+    try:
+        driver.get("file:///{path}".format(path=filepath))
+        WebDriverWait(driver, timeout).until(
+            lambda d: d.execute_script(
+                "var t = performance.getEntriesByType('navigation')[0];"
+                "return t !== undefined && t.loadEventEnd > 0;"
+            )
+        )
+        load_ms = driver.execute_script(
+            "return performance.getEntriesByType('navigation')[0].loadEventEnd;"
+        )
+    finally:
+        driver.quit()
+
+    return float(load_ms)
+
+
+def benchmark_variant(df, compact: bool, folder_path: str, page_load: bool):
+    """
+    Builds and saves one map from `df`, returning build/save times, file size
+    and optionally the browser load time.
+    """
+    name = "compact" if compact else "embedded_html"
+
+    t0 = time.perf_counter()
+    if compact:
+        features = build_compact_features(df)
+    else:
+        features = build_features(df)
+    m = build_base_map(True, True, True, True)
+    m = add_timestamped_geojson(m, features, compact=compact)
+    build_s = time.perf_counter() - t0
+
+    filepath = os.path.join(folder_path, f"{name}.html")
+    t0 = time.perf_counter()
+    m.save(filepath)
+    save_s = time.perf_counter() - t0
+
+    result = {
+        "variant": name,
+        "features": len(features),
+        "build_s": round(build_s, 3),
+        "save_s": round(save_s, 3),
+        "html_bytes": os.path.getsize(filepath),
+    }
+    if page_load:
+        result["page_load_ms"] = measure_page_load(filepath)
+
+    return result
+
+
+@click.command()
+@click.option("--csv_input_filename", default=None, type=str)
+@click.option("--no_stations", default=2500, type=int)
+@click.option("--no_days", default=30, type=int)
+@click.option("--page_load/--no_page_load", default=True)
+@click.option("--output_directory", default=None, type=str)
+def main(
+    csv_input_filename: str,
+    no_stations: int,
+    no_days: int,
+    page_load: bool,
+    output_directory: str,
+):
+    """
+    Compares the size and browser load time of the timeseries map when each
+    feature embeds its own tooltip HTML, against compact features rendered
+    from a shared client-side template.
+
+    Args:
+        csv_input_filename (str): Optional `build_timetable.py` output to use,
+            otherwise a synthetic table is generated
+        no_stations (int): Number of synthetic stations
+        no_days (int): Number of synthetic days
+        page_load (bool): Whether to time page loads in headless firefox
+        output_directory (str): Where to append results, defaults to
+            ./outputs/benchmarks/
+    """
+    logger = logging.getLogger(__name__)
+
+    if output_directory is None:
+        output_directory = os.path.join(here(), "outputs", "benchmarks")
+    os.makedirs(output_directory, exist_ok=True)
+
+    if csv_input_filename is None:
+        df = make_synthetic_summary(no_stations, no_days)
+        source = f"synthetic_{no_stations}stations_{no_days}days"
+    else:
+        df = read_disruption_summary(csv_input_filename)
+        source = os.path.basename(csv_input_filename)
+    logger.info(f"Benchmarking map html with {len(df)} rows from {source}")
+
+    df["radius"] = scale_col(df, "journeys_timetabled", 2, 12)
+    df = df[~df["pct_timetabled_services_running"].isna()]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            benchmark_variant(df, compact, tmp_dir, page_load)
+            for compact in [False, True]
+        ]
+
+    run = {
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "source": source,
+        "rows": len(df),
+        "results": results,
+    }
+    for result in results:
+        logger.info(f"{result}")
+        print(json.dumps(result))
+
+    results_filepath = os.path.join(output_directory, "map_html_benchmark.json")
+    history = []
+    if os.path.exists(results_filepath):
+        with open(results_filepath, "r") as f:
+            history = json.load(f)
+    history.append(run)
+    with open(results_filepath, "w") as f:
+        json.dump(history, f, indent=2)
+    logger.info(f"Results appended to {results_filepath}")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+        filemode="a",
+    )
+
+    main()
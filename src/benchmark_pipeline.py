@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+import pandas as pd
+from pyprojroot import here
+
+from build_timetable import summarise_day
+from generate_synthetic_feed import generate_feed
+from map_features import build_compact_features, build_features
+from map_layers import add_timestamped_geojson
+from profiling import StageProfiler
+from utils import (
+    build_base_map,
+    create_perm_and_new_df,
+    cut_mca_to_size,
+    filter_to_date,
+    filter_to_date_cancellations,
+    filter_to_dft_time,
+    find_station_tiplocs,
+    scale_col,
+    unpack_atoc_data,
+)
+
+
+def code_version():
+    """
+    Returns the current git commit of the repository, to tell results from
+    different versions apart, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=here(),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_feed(
+    data_directory,
+    zip_name,
+    dump_date,
+    start_date,
+    no_days,
+    trace_memory,
+    folder_path,
+):
+    """
+    Runs each stage of the pipeline once over a feed in `data_directory`,
+    returning the `StageProfiler` records of every stage.
+    """
+    profiler = StageProfiler(trace_memory)
+
+    with profiler.stage("find_station_tiplocs") as record:
+        station_tiplocs = find_station_tiplocs(
+            os.path.join(data_directory, "Stops.csv")
+        )
+        record["rows_out"] = len(station_tiplocs)
+
+    with profiler.stage("unpack_atoc_data"):
+        unpack_atoc_data(data_directory, zip_name, dump_date)
+
+    try:
+        with profiler.stage("cut_mca_to_size") as record:
+            timetable = cut_mca_to_size(
+                data_directory, zip_name.replace(".ZIP", ""), dump_date
+            )
+            record["rows_out"] = len(timetable)
+    finally:
+        shutil.rmtree(os.path.join(data_directory, f"atoc_{dump_date}"))
+
+    with profiler.stage("create_perm_and_new_df", rows_in=len(timetable)) as record:
+        calendar_df, cancelled_df = create_perm_and_new_df(timetable)
+        record["rows_out"] = len(calendar_df) + len(cancelled_df)
+    del timetable
+    calendar_df = calendar_df[calendar_df["TIPLOC_type"] != "F"]
+
+    # the filters on their own, for the first day
+    date = int(start_date.strftime("%y%m%d"))
+    with profiler.stage("filter_to_date", rows_in=len(calendar_df)) as record:
+        cal_today = filter_to_date(calendar_df, date=date)
+        canc_today = filter_to_date(cancelled_df, date=date, cancellations=True)
+        record["rows_out"] = len(cal_today) + len(canc_today)
+
+    with profiler.stage("filter_to_dft_time", rows_in=len(cal_today)) as record:
+        cal_times_today = filter_to_dft_time(cal_today)
+        record["rows_out"] = len(cal_times_today)
+
+    with profiler.stage(
+        "filter_to_date_cancellations", rows_in=len(canc_today)
+    ) as record:
+        canc_today = filter_to_date_cancellations(
+            cal_times_today, canc_today, date=date
+        )
+        record["rows_out"] = len(canc_today)
+
+    with profiler.stage("day_loop", rows_in=len(calendar_df), days=no_days) as record:
+        out_df = pd.concat(
+            [
+                summarise_day(
+                    calendar_df,
+                    cancelled_df,
+                    station_tiplocs,
+                    start_date + timedelta(days=i),
+                )[3]
+                for i in range(no_days)
+            ],
+            ignore_index=True,
+        )
+        record["rows_out"] = len(out_df)
+
+    out_df["radius"] = scale_col(out_df, "journeys_timetabled", 2, 12)
+    out_df = out_df[~out_df["pct_timetabled_services_running"].isna()]
+
+    with profiler.stage("build_features", rows_in=len(out_df)) as record:
+        features = build_features(out_df)
+        record["rows_out"] = len(features)
+
+    with profiler.stage("build_compact_features", rows_in=len(out_df)) as record:
+        features = build_compact_features(out_df)
+        record["rows_out"] = len(features)
+
+    with profiler.stage("html_save", rows_in=len(features)) as record:
+        m = build_base_map(True, True, True, True)
+        m = add_timestamped_geojson(m, features, compact=True)
+        filepath = os.path.join(folder_path, "map.html")
+        m.save(filepath)
+        record["html_bytes"] = os.path.getsize(filepath)
+
+    return profiler.stages
+
+
+@click.command()
+@click.option("--no_schedules", default=[1000, 10000, 50000], multiple=True, type=int)
+@click.option("--no_stations", default=None, type=int)
+@click.option("--no_days", default=7, type=int)
+@click.option("--zip_name", default=None, type=str)
+@click.option("--data_directory", default=None, type=str)
+@click.option("--dump_date", default=None, type=str)
+@click.option("--trace_memory/--no_trace_memory", default=True)
+@click.option("--output_directory", default=None, type=str)
+def main(
+    no_schedules: tuple,
+    no_stations: int,
+    no_days: int,
+    zip_name: str,
+    data_directory: str,
+    dump_date: str,
+    trace_memory: bool,
+    output_directory: str,
+):
+    """
+    Times each stage of the timetable pipeline, from parsing the feed to
+    saving the map, over synthetic feeds of increasing size or a real feed,
+    and appends the results to a JSON history.
+
+    Args:
+        no_schedules (tuple): Sizes of synthetic feed to benchmark, in
+            schedules, repeat the option for each size
+        no_stations (int): Stations in each synthetic feed, defaults to one
+            per 20 schedules, between 50 and 2600
+        no_days (int): Number of days in the day loop
+        zip_name (str): Optional real ATOC zip to benchmark instead, in
+            `data_directory` with its Stops.csv
+        data_directory (str): Directory of `zip_name`
+        dump_date (str): Dump date of `zip_name` in DDMMYYYY format, the day
+            loop starts on this day
+        trace_memory (bool): Whether to record peak memory per stage, which
+            slows some stages down
+        output_directory (str): Where to append results, defaults to
+            ./outputs/benchmarks/
+    """
+    logger = logging.getLogger(__name__)
+
+    if output_directory is None:
+        output_directory = os.path.join(here(), "outputs", "benchmarks")
+    os.makedirs(output_directory, exist_ok=True)
+
+    run = {
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "version": code_version(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "trace_memory": trace_memory,
+        "no_days": no_days,
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if zip_name is not None:
+            feeds = [(zip_name, data_directory, dump_date, zip_name)]
+        else:
+            feeds = []
+            for size in no_schedules:
+                feed_directory = os.path.join(tmp_dir, f"feed_{size}")
+                summary = generate_feed(
+                    feed_directory,
+                    no_schedules=size,
+                    no_stations=no_stations or min(2600, max(50, size // 20)),
+                    start_date=datetime(2022, 8, 1).date(),
+                )
+                logger.info(f"Generated synthetic feed: {summary}")
+                feeds.append(
+                    (
+                        os.path.basename(summary["zip_path"]),
+                        feed_directory,
+                        summary["dump_date"],
+                        f"synthetic_{size}schedules_{summary['stations']}stations",
+                    )
+                )
+
+        for feed_zip, feed_directory, feed_dump_date, source in feeds:
+            logger.info(f"Benchmarking pipeline stages on {source}")
+            stages = benchmark_feed(
+                feed_directory,
+                feed_zip,
+                feed_dump_date,
+                datetime.strptime(feed_dump_date, "%d%m%Y").date(),
+                no_days,
+                trace_memory,
+                tmp_dir,
+            )
+            for record in stages:
+                logger.info(f"{source}: {record}")
+                print(json.dumps({"source": source, **record}))
+            run["results"].append({"source": source, "stages": stages})
+
+    results_filepath = os.path.join(output_directory, "pipeline_benchmark.json")
+    history = []
+    if os.path.exists(results_filepath):
+        with open(results_filepath, "r") as f:
+            history = json.load(f)
+    history.append(run)
+    with open(results_filepath, "w") as f:
+        json.dump(history, f, indent=2)
+    logger.info(f"Results appended to {results_filepath}")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+        filemode="a",
+    )
+
+    main()
@@ -9,122 +9,110 @@ import numpy as np
 from pathlib import Path
 
 
+from chunked import summarise_low_memory
+from history_store import HistoryStore
+from kernels import count_day_journeys_jit
+from network import StationGraph, station_graph_path
+from profiling import StageProfiler, profile_report_path
 from utils import (
+    breakout_DTD_filename,
+    build_edge_summary,
+    build_operator_summary,
+    build_operator_totals,
+    count_day_journeys,
+    count_station_edges,
+    count_station_hours,
+    count_station_operators,
     create_perm_and_new_df,
     cut_mca_to_size,
+    encode_operators,
     filter_to_date,
     filter_to_date_cancellations,
     filter_to_dft_time,
     find_station_tiplocs,
+    hourly_profile_path,
+    station_edges_path,
+    summarise_day_journeys,
     unpack_atoc_data,
     download_big_file,
+    write_disruption_summary,
+    write_hourly_profile,
+    write_breakdown_summary,
 )
 
+# faster ways `summarise_days` can count the journeys at each station, by
+# engine name, with the same counts as the legacy day loop (see
+# `compare_engines.py`)
+DAY_COUNTERS = {"vectorised": count_day_journeys, "jit": count_day_journeys_jit}
 
-@click.command()
-@click.argument("zip_name")
-@click.argument("data_directory")
-@click.argument("output_directory")
-@click.option("--dump_date", default=None, type=str)
-@click.option("--start_date", default=None, type=str)
-@click.option("--no_days", default=30, type=int)
-def main(
-    zip_name: str,
-    data_directory: str,
-    output_directory: str,
-    dump_date: str,
-    start_date: str,
-    no_days: int,
-):
-    """
-    Handles building and saving timetable data for a daily ATOC feed
 
-    Parameters
-    ----------
-    zip_name :
-        Name of the ATOC zip file to build off (with .zip file extension).
-    data_directory :
-        Directory containing the ATOC data file
-    output_directory :
-        Directory to write results to
-    dump_date : str
-        Date string corresponding to the date the ATOC zip file was "dumped"
-        in DDMMYYYY format.
-    start_date : str
-        Date string corresponding to the date from which to produce visuals
-        in DDMMYYYY format.
-    no_days: int
-        Number of days into the future from the start_date for which to produce
-        the visuals
+def load_schedules(data_directory, zip_name, dump_date, profiler=None):
+    """
+    Unpacks and parses an ATOC zip into long format DataFrames of scheduled
+    station stops (flybys removed) and of planned cancellations. The unzip
+    and parse stages are recorded by `profiler` (a `StageProfiler`) if given.
     """
     logger = logging.getLogger(__name__)
-
-    # set to today if no dump_date is provided
-    if dump_date is None:
-        dump_date = datetime.now().date().strftime("%d%m%Y")
-        logger.info(
-            f'Setting `dump_date` to "{dump_date}" (today) automatically'
-            " since the optional argument was not set."
-        )
-
-    if start_date is None:
-        # add one day so pipeline starts one day after dump day
-        start_date = datetime.now().date()
-        logger.info(
-            f"Setting `start_date` to {start_date} (today+1) automatically since the"
-            "optional argument was not set."
-        )
-    else:
-        start_date = datetime.strptime(start_date, "%d%m%Y").date()
-
-    # print inputs to logger for records
-    logger.info(
-        f'Using inputs ATOC zip:"{zip_name}", dump_date:"{dump_date}",'
-        f" start_date:{start_date}, no_days:{no_days}."
-    )
-
-    # build a list of days to run over
-    dates = []
-    for i in range(0, no_days):
-        dates.append(start_date + timedelta(days=i))
-    logger.info(f"Days to analyse = {dates}")
-
-    # Download file if not already exists
-    download_big_file(os.getenv("URL_STOPS"), "Stops.csv", data_directory)
-    station_tiplocs = find_station_tiplocs(os.path.join(data_directory, "Stops.csv"))
-    logger.info("Tiplocs retrieved from Stops.csv/tiploc file...")
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
 
     # unpack the atoc data
-    unpack_atoc_data(data_directory, zip_name, dump_date)
+    with profiler.stage("unzip"):
+        unpack_atoc_data(data_directory, zip_name, dump_date)
     logger.info(f'"{zip_name}" unziped.')
 
     # remove header rows (non-timetable data)
-    df = cut_mca_to_size(
-        data_directory,
-        zip_name.replace(".zip", "").replace(".ZIP", ""),
-        dump_date,
-    )
+    with profiler.stage("cut") as record:
+        df = cut_mca_to_size(
+            data_directory,
+            zip_name.replace(".zip", "").replace(".ZIP", ""),
+            dump_date,
+        )
+        record["rows_out"] = len(df)
     logger.info("MCA cut to size.")
 
     # filter journey data and cancellation data
     logger.info("Creating calendar and cancelled dataframes... (~30s)")
-    calendar_df, cancelled_df = create_perm_and_new_df(df)
+    with profiler.stage("parse", rows_in=len(df)) as record:
+        calendar_df, cancelled_df = create_perm_and_new_df(df)
 
-    # include only rows for actual station stops i.e. not flybys
-    calendar_df = calendar_df[calendar_df["TIPLOC_type"] != "F"]
+        # include only rows for actual station stops i.e. not flybys
+        calendar_df = calendar_df[calendar_df["TIPLOC_type"] != "F"]
+        record["rows_out"] = len(calendar_df) + len(cancelled_df)
     logger.info("Created calendar and cancelled dataframes and removed flybys.")
 
-    for run_num, date_datetime in enumerate(dates):
+    return calendar_df, cancelled_df
 
-        # get the date in the required int format
-        date = int(date_datetime.strftime("%y%m%d"))
 
-        # calculate the day from `date`
-        day = datetime.strptime(str(date), "%y%m%d").strftime("%A")
+def summarise_day(
+    calendar_df, cancelled_df, station_tiplocs, date_datetime, profiler=None
+):
+    """
+    Resolves the services running on one DfT day from the parsed schedules
+    (see `load_schedules`), and summarises journeys timetabled and scheduled
+    at each station. The filter and merge stages are recorded by `profiler`
+    (a `StageProfiler`) if given.
+
+    Returns the permanent (timetabled) rows for the day, the rows running at
+    stations in schedule order, the same joined to station names and
+    locations, and the station summary for the day.
+    """
+    logger = logging.getLogger(__name__)
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
 
-        logger.info(f"*** Running with date: {date}, day: {day} ***")
+    # get the date in the required int format
+    date = int(date_datetime.strftime("%y%m%d"))
 
-        logger.info(f"Filtering to {date}...")
+    # calculate the day from `date`
+    day = datetime.strptime(str(date), "%y%m%d").strftime("%A")
+
+    logger.info(f"*** Running with date: {date}, day: {day} ***")
+
+    logger.info(f"Filtering to {date}...")
+    with profiler.stage(
+        "filter", date=date_datetime, rows_in=len(calendar_df)
+    ) as record:
         cal_today = filter_to_date(calendar_df, date=date)
         canc_today = filter_to_date(cancelled_df, date=date, cancellations=True)
         cal_times_today = filter_to_dft_time(cal_today)
@@ -132,14 +120,15 @@ def main(
         canc_today = filter_to_date_cancellations(
             cal_times_today, canc_today, date=date
         )
+        record["rows_out"] = len(cal_times_today)
 
+    with profiler.stage(
+        "merge", date=date_datetime, rows_in=len(cal_times_today)
+    ) as record:
         # filter permanent timetabled journeys attributed to this date
         # (i.e. before any cancellations or exceptions)
-        timetabled = (
-            cal_times_today["TIPLOC"][cal_times_today["Flag"] == "P"]
-            .value_counts()
-            .reset_index()
-        )
+        timetabled_rows = cal_times_today[cal_times_today["Flag"] == "P"]
+        timetabled = timetabled_rows["TIPLOC"].value_counts().reset_index()
         timetabled.columns = ["TIPLOC", "journeys_timetabled"]
         timetabled["journeys_timetabled"] = timetabled["journeys_timetabled"].astype(
             "int"
@@ -181,7 +170,8 @@ def main(
         scheduled.columns = ["TIPLOC", "journeys_scheduled"]
 
         merged = pd.merge(scheduled, timetabled, on="TIPLOC", how="outer")
-        merged["journeys_scheduled"].fillna(0, inplace=True)
+        # stations with every service cancelled have no scheduled count
+        merged["journeys_scheduled"] = merged["journeys_scheduled"].fillna(0)
         merged["pct_timetabled_services_running"] = np.round(
             merged["journeys_scheduled"] / merged["journeys_timetabled"] * 100, 2
         )
@@ -196,18 +186,459 @@ def main(
         output.loc[:, "date"] = datetime.strftime(date_datetime, "%Y-%m-%d")
 
         logger.info(f"Full disruption summary for {date}.")
+        record["rows_out"] = len(output)
+
+    return timetabled_rows, stations_df, final_df, output
+
+
+def add_day_breakdowns(
+    breakdowns, day, timetabled_rows, stations_df, final_df, station_codes
+):
+    """
+    Fills in the `breakdowns` (see `summarise_days`) of the `day`th date from
+    its rows from `summarise_day`.
+    """
+    if "hourly" in breakdowns:
+        hourly_timetabled, hourly_scheduled = breakdowns["hourly"]
+        hourly_timetabled[day] = count_station_hours(timetabled_rows, station_codes)
+        hourly_scheduled[day] = count_station_hours(final_df, station_codes)
+
+    if "edges" in breakdowns:
+        edges_timetabled, edges_scheduled = breakdowns["edges"]
+        edges_timetabled.append(count_station_edges(timetabled_rows, station_codes))
+        # `stations_df` is from before the merge with station locations,
+        # which does not keep the stops in order
+        edges_scheduled.append(count_station_edges(stations_df, station_codes))
+
+    if "graphs" in breakdowns:
+        breakdowns["graphs"].append(
+            StationGraph.from_schedule(stations_df, station_codes)
+        )
 
-        if run_num == 0:
-            out_df = output.copy()
-            logger.info(f"Run number {run_num}: Creating out_df")
-        else:
-            out_df = pd.concat([out_df, output], ignore_index=True)
-            logger.info(f"Run number {run_num}: Concated output onto out_df")
+    if "operators" in breakdowns:
+        operator_codes, operator_timetabled, operator_scheduled = breakdowns[
+            "operators"
+        ]
+        operator_timetabled[day] = count_station_operators(
+            timetabled_rows, station_codes, len(operator_codes)
+        )
+        operator_scheduled[day] = count_station_operators(
+            final_df, station_codes, len(operator_codes)
+        )
+
+
+def count_days(
+    calendar_df, cancelled_df, station_tiplocs, dates, engine, profiler=None
+):
+    """
+    Summarises each of `dates` as `summarise_day` does, but with the
+    journeys at each station counted for every day at once by `engine` (see
+    `DAY_COUNTERS`), returning the station summaries of every day in one
+    DataFrame. The count stage is recorded by `profiler` (a `StageProfiler`)
+    if given.
+    """
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    with profiler.stage("count", rows_in=len(calendar_df)) as record:
+        tiplocs, timetabled, scheduled = DAY_COUNTERS[engine](
+            calendar_df, cancelled_df, dates
+        )
+        out_df = summarise_day_journeys(
+            tiplocs, timetabled, scheduled, station_tiplocs, dates
+        )
+        record["rows_out"] = len(out_df)
+
+    return out_df
+
+
+def summarise_days(
+    calendar_df,
+    cancelled_df,
+    station_tiplocs,
+    dates,
+    station_codes,
+    hourly_profile=False,
+    station_pairs=False,
+    operator_breakdown=False,
+    station_graphs=False,
+    profiler=None,
+    engine="legacy",
+):
+    """
+    Summarises each of `dates` with `summarise_day`, and breaks the journeys
+    down further alongside. Returns the station summaries of every day in
+    one DataFrame, and a dict of the breakdowns asked for, for `main` to
+    export: station x hour, station pair (edge) and station x operator
+    counts per day, and a station graph of each day.
+
+    Engines other than "legacy" count the station summaries with
+    `count_days` instead, and give no breakdowns.
+    """
+    logger = logging.getLogger(__name__)
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+    no_days = len(dates)
+
+    if engine != "legacy":
+        if hourly_profile or station_pairs or operator_breakdown or station_graphs:
+            raise ValueError(f"the {engine} engine gives no breakdowns")
+        out_df = count_days(
+            calendar_df, cancelled_df, station_tiplocs, dates, engine, profiler
+        )
+        return out_df, {}
+
+    # filled in day by day by `add_day_breakdowns`
+    breakdowns = {}
+    if hourly_profile:
+        # station x day x hour counts
+        hourly_shape = (no_days, len(station_codes), 24)
+        breakdowns["hourly"] = (
+            np.zeros(hourly_shape, dtype="int64"),
+            np.zeros(hourly_shape, dtype="int64"),
+        )
+    if station_pairs:
+        # station pair (edge) counts per day, from consecutive station stops
+        breakdowns["edges"] = ([], [])
+    if station_graphs:
+        breakdowns["graphs"] = []
+
+    if operator_breakdown:
+        # station x operator x day counts, keyed on integer operator codes
+        calendar_df, operator_codes = encode_operators(calendar_df)
+        operators_shape = (no_days, len(station_codes), len(operator_codes))
+        breakdowns["operators"] = (
+            operator_codes,
+            np.zeros(operators_shape, dtype="int64"),
+            np.zeros(operators_shape, dtype="int64"),
+        )
+        logger.info(f"Encoded {len(operator_codes)} operators.")
+
+    outputs = []
+    for run_num, date_datetime in enumerate(dates):
+
+        timetabled_rows, stations_df, final_df, output = summarise_day(
+            calendar_df, cancelled_df, station_tiplocs, date_datetime, profiler
+        )
+
+        with profiler.stage("breakdowns", date=date_datetime, rows_in=len(final_df)):
+            add_day_breakdowns(
+                breakdowns,
+                run_num,
+                timetabled_rows,
+                stations_df,
+                final_df,
+                station_codes,
+            )
+
+        # concatenated once at the end, rather than copied on every day
+        outputs.append(output)
+        logger.info(f"Run number {run_num}: Added output to out_df")
+
+    return pd.concat(outputs, ignore_index=True), breakdowns
+
+
+def export_breakdowns(
+    breakdowns, station_codes, dates, output_folder, output_file_name
+):
+    """
+    Writes each of the `breakdowns` from `summarise_days` beside the summary
+    `<output_file_name>.parquet` in `output_folder`: the hourly profile, the
+    station pair counts, the station graphs of each day and the operator
+    breakdown with its national and operator totals.
+    """
+    logger = logging.getLogger(__name__)
+
+    parquet_filepath = os.path.join(output_folder, f"{output_file_name}.parquet")
+
+    if "hourly" in breakdowns:
+        hourly_filepath = hourly_profile_path(parquet_filepath)
+        write_hourly_profile(
+            hourly_filepath, station_codes, dates, *breakdowns["hourly"]
+        )
+        logger.info(f"Hourly profile exported to {hourly_filepath}")
+
+    if "edges" in breakdowns:
+        edges_filepath = station_edges_path(parquet_filepath)
+        write_breakdown_summary(
+            build_edge_summary(station_codes, dates, *breakdowns["edges"]),
+            edges_filepath,
+            ["from_TIPLOC", "to_TIPLOC"],
+        )
+        logger.info(f"Station pair counts exported to {edges_filepath}")
+
+    if "graphs" in breakdowns:
+        graph_directory = os.path.join(output_folder, f"{output_file_name}_network")
+        Path(graph_directory).mkdir(parents=True, exist_ok=True)
+        for date_datetime, graph in zip(dates, breakdowns["graphs"]):
+            graph.save(station_graph_path(graph_directory, date_datetime))
+        logger.info(f"Station graphs exported to {graph_directory}")
+
+    if "operators" in breakdowns:
+        operator_codes, operator_timetabled, operator_scheduled = breakdowns[
+            "operators"
+        ]
+        operator_df = build_operator_summary(
+            station_codes,
+            operator_codes,
+            dates,
+            operator_timetabled,
+            operator_scheduled,
+        )
+        operator_filepath = os.path.join(
+            output_folder, f"{output_file_name}_operators.parquet"
+        )
+        write_breakdown_summary(operator_df, operator_filepath, ["TIPLOC", "Operator"])
+        logger.info(f"Operator breakdown exported to {operator_filepath}")
+
+        totals_filepath = os.path.join(
+            output_folder, f"{output_file_name}_operator_totals.csv"
+        )
+        build_operator_totals(operator_df).to_csv(totals_filepath, index=False)
+        logger.info(f"National and operator totals exported to {totals_filepath}")
+
+
+def check_counting_options(low_memory, engine, breakdown_flags):
+    """
+    Raises a `click.BadParameter` if the breakdowns asked for, by their
+    `breakdown_flags`, cannot be built in low memory mode or by `engine`, or
+    if both low memory mode and an engine other than legacy are asked for.
+    """
+    asked = [flag for flag, value in breakdown_flags.items() if value]
+    if low_memory and asked:
+        raise click.BadParameter(
+            f"{', '.join(asked)} need the whole feed in memory, so "
+            "cannot be used with --low_memory"
+        )
+    if engine != "legacy" and (low_memory or asked):
+        raise click.BadParameter(
+            f"the {engine} engine gives no breakdowns, and --low_memory counts "
+            "with its own, so it can only be used without them"
+        )
+
+
+@click.command()
+@click.argument("zip_name")
+@click.argument("data_directory")
+@click.argument("output_directory")
+@click.option("--dump_date", default=None, type=str)
+@click.option("--start_date", default=None, type=str)
+@click.option("--no_days", default=30, type=int)
+@click.option(
+    "--csv_export", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--history_directory", default=None, type=str)
+@click.option(
+    "--hourly_profile", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option(
+    "--station_pairs", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option(
+    "--operator_breakdown", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option(
+    "--station_graphs", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option(
+    "--engine",
+    default="legacy",
+    type=click.Choice(["legacy", *DAY_COUNTERS]),
+)
+@click.option("--profile", is_flag=True, show_default=False, default=False, type=bool)
+@click.option(
+    "--trace_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--profile_stage", default=None, type=str)
+@click.option(
+    "--low_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--memory_budget_mb", default=512, type=int)
+@click.option("--chunk_size", default=5000, type=int)
+@click.option("--spill_directory", default=None, type=str)
+def main(
+    zip_name: str,
+    data_directory: str,
+    output_directory: str,
+    dump_date: str,
+    start_date: str,
+    no_days: int,
+    csv_export: bool,
+    history_directory: str,
+    hourly_profile: bool,
+    station_pairs: bool,
+    operator_breakdown: bool,
+    station_graphs: bool,
+    engine: str,
+    profile: bool,
+    trace_memory: bool,
+    profile_stage: str,
+    low_memory: bool,
+    memory_budget_mb: int,
+    chunk_size: int,
+    spill_directory: str,
+):
+    """
+    Handles building and saving timetable data for a daily ATOC feed
+
+    Parameters
+    ----------
+    zip_name :
+        Name of the ATOC zip file to build off (with .zip file extension).
+    data_directory :
+        Directory containing the ATOC data file
+    output_directory :
+        Directory to write results to
+    dump_date : str
+        Date string corresponding to the date the ATOC zip file was "dumped"
+        in DDMMYYYY format.
+    start_date : str
+        Date string corresponding to the date from which to produce visuals
+        in DDMMYYYY format.
+    no_days: int
+        Number of days into the future from the start_date for which to produce
+        the visuals
+    csv_export: bool
+        Also export the results as a csv, alongside the date partitioned
+        parquet dataset
+    history_directory: str
+        Optional historical store (see `history_store.py`) to also add the
+        results to, keyed by the feed number of `zip_name` and `dump_date`
+    hourly_profile: bool
+        Also export journeys timetabled and scheduled per station and hour of
+        each day, charted in the map tooltips
+    station_pairs: bool
+        Also export journeys timetabled and scheduled between each pair of
+        consecutive station stops each day, for the map edge layer
+    operator_breakdown: bool
+        Also export journeys timetabled and scheduled per station, operator
+        and day, and daily totals nationally and per operator
+    station_graphs: bool
+        Also export a graph of the services running between stations for each
+        day, for connectivity queries (see `network.py`)
+    engine: str
+        How to count the journeys at each station, "legacy" for the day by
+        day filters, or "vectorised" or "jit" for the faster engines with the
+        same counts (see `compare_engines.py`), which give no breakdowns
+    profile: bool
+        Also export the time, resident memory and rows in and out of each
+        stage of the run to a JSON report (see `profiling.py`)
+    trace_memory: bool
+        Also record the peak memory Python allocates in each stage, with
+        tracemalloc, which slows the run down, implies `profile`
+    profile_stage: str
+        Also export cProfile stats of every run of the named stage (e.g.
+        "parse" or "filter") alongside the report, implies `profile`
+    low_memory: bool
+        Parse the feed a chunk of schedules at a time, spilling parsed rows
+        to disk past `memory_budget_mb`, for hosts without the memory for
+        the whole feed (see `chunked.py`). Gives the same station counts,
+        but cannot be combined with the breakdowns
+    memory_budget_mb: int
+        Memory that parsed rows may take before being spilled to disk, and
+        that each group of them counted at once may take, in low memory mode
+    chunk_size: int
+        Number of schedules parsed at a time in low memory mode
+    spill_directory: str
+        Where to spill parsed rows to in low memory mode, defaults to the
+        system temporary directory
+    """
+    logger = logging.getLogger(__name__)
+
+    check_counting_options(
+        low_memory,
+        engine,
+        {
+            "--hourly_profile": hourly_profile,
+            "--station_pairs": station_pairs,
+            "--operator_breakdown": operator_breakdown,
+            "--station_graphs": station_graphs,
+        },
+    )
+
+    # set to today if no dump_date is provided
+    if dump_date is None:
+        dump_date = datetime.now().date().strftime("%d%m%Y")
+        logger.info(
+            f'Setting `dump_date` to "{dump_date}" (today) automatically'
+            " since the optional argument was not set."
+        )
+
+    if start_date is None:
+        # add one day so pipeline starts one day after dump day
+        start_date = datetime.now().date()
+        logger.info(
+            f"Setting `start_date` to {start_date} (today+1) automatically since the"
+            "optional argument was not set."
+        )
+    else:
+        start_date = datetime.strptime(start_date, "%d%m%Y").date()
+
+    # print inputs to logger for records
+    logger.info(
+        f'Using inputs ATOC zip:"{zip_name}", dump_date:"{dump_date}",'
+        f" start_date:{start_date}, no_days:{no_days}."
+    )
+
+    # build a list of days to run over
+    dates = []
+    for i in range(0, no_days):
+        dates.append(start_date + timedelta(days=i))
+    logger.info(f"Days to analyse = {dates}")
+
+    profiler = StageProfiler(
+        trace_memory=trace_memory,
+        enabled=profile or trace_memory or profile_stage is not None,
+        profile_stage=profile_stage,
+    )
+
+    # Download file if not already exists
+    with profiler.stage("stops") as record:
+        download_big_file(os.getenv("URL_STOPS"), "Stops.csv", data_directory)
+        station_tiplocs = find_station_tiplocs(
+            os.path.join(data_directory, "Stops.csv")
+        )
+        record["rows_out"] = len(station_tiplocs)
+    logger.info("Tiplocs retrieved from Stops.csv/tiploc file...")
+
+    # the breakdowns are keyed on the sorted station TIPLOCs
+    station_codes = np.sort(station_tiplocs["TIPLOC"].unique())
+
+    if low_memory:
+        out_df = summarise_low_memory(
+            data_directory,
+            zip_name,
+            dump_date,
+            station_tiplocs,
+            dates,
+            chunk_size,
+            memory_budget_mb,
+            spill_directory,
+            profiler,
+        )
+        breakdowns = {}
+    else:
+        calendar_df, cancelled_df = load_schedules(
+            data_directory, zip_name, dump_date, profiler
+        )
+        out_df, breakdowns = summarise_days(
+            calendar_df,
+            cancelled_df,
+            station_tiplocs,
+            dates,
+            station_codes,
+            hourly_profile=hourly_profile,
+            station_pairs=station_pairs,
+            operator_breakdown=operator_breakdown,
+            station_graphs=station_graphs,
+            profiler=profiler,
+            engine=engine,
+        )
 
     logger.info("Exporting out_df...")
     output_file_name = (
         f"full_uk_disruption_summary_multiday_start_"
-        f'{str(start_date).replace("-","")}_{no_days}days.csv'
+        f'{str(start_date).replace("-","")}_{no_days}days'
     )
 
     # create a dedicated folder inside the outputs dir
@@ -217,17 +648,55 @@ def main(
         parents=True, exist_ok=True
     )
 
-    # save to csv in the dedicated directory
-    csv_filepath = os.path.join(
-        output_directory, dedicated_output_folder_name, output_file_name
+    # save to parquet, partitioned by date, in the dedicated directory
+    parquet_filepath = os.path.join(
+        output_directory, dedicated_output_folder_name, f"{output_file_name}.parquet"
     )
-    out_df.to_csv(csv_filepath)
-    logger.info(f"out_df exported to {csv_filepath}")
+    with profiler.stage(
+        "export",
+        rows_in=len(out_df),
+        stations=out_df["TIPLOC"].nunique(),
+        days=out_df["date"].nunique(),
+    ):
+        write_disruption_summary(out_df, parquet_filepath)
+        logger.info(f"out_df exported to {parquet_filepath}")
+
+        export_breakdowns(
+            breakdowns,
+            station_codes,
+            dates,
+            os.path.join(output_directory, dedicated_output_folder_name),
+            output_file_name,
+        )
+
+        if csv_export:
+            csv_filepath = os.path.join(
+                output_directory,
+                dedicated_output_folder_name,
+                f"{output_file_name}.csv",
+            )
+            out_df.to_csv(csv_filepath, index=False)
+            logger.info(f"out_df exported to {csv_filepath}")
+
+        if history_directory is not None:
+            HistoryStore(history_directory).append(
+                out_df,
+                feed_number=breakout_DTD_filename(zip_name)["number"],
+                dump_date=datetime.strptime(dump_date, "%d%m%Y").date(),
+            )
+            logger.info(f"out_df added to history store {history_directory}")
 
     # tidyup - remove unzipped atoc folder
     shutil.rmtree(os.path.join(data_directory, f"atoc_{dump_date}"))
     logger.info(f"Tidy up: removed atoc_{dump_date} folder.")
 
+    profiler.write_report(
+        profile_report_path(parquet_filepath, "build_timetable"),
+        zip_name=zip_name,
+        start_date=start_date,
+        no_days=no_days,
+    )
+
     return None
 
 
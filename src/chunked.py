@@ -0,0 +1,266 @@
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from profiling import StageProfiler
+from utils import (
+    count_day_journeys,
+    create_perm_and_new_df,
+    mca_file_path,
+    summarise_day_journeys,
+    unpack_atoc_data,
+)
+
+
+def iter_schedule_chunks(mca_filepath, chunk_size):
+    """
+    Reads an .MCA file line by line, yielding its records from the first
+    schedule onwards (as `cut_mca_to_size` does) in lists of at most
+    `chunk_size` whole schedules, so the file is never held in memory.
+    """
+    chunk = []
+    no_schedules = 0
+    with open(mca_filepath, "r") as f:
+        for line in f:
+            if line[:2] == "BS":
+                if no_schedules == chunk_size:
+                    yield chunk
+                    chunk = []
+                    no_schedules = 0
+                no_schedules += 1
+            if no_schedules:
+                chunk.append(line)
+    if chunk:
+        yield chunk
+
+
+def identifier_buckets(identifiers, no_buckets):
+    """
+    Returns the bucket, from 0 to `no_buckets` - 1, of each Identifier, from a
+    hash that is stable between runs.
+    """
+    hashes = pd.util.hash_pandas_object(identifiers, index=False).to_numpy()
+    return (hashes % no_buckets).astype("int64")
+
+
+class SpillStore:
+    """
+    Holds parsed schedule rows (calendar and cancelled, see
+    `create_perm_and_new_df`) in memory until they take more than
+    `memory_budget_mb`, then spills them to one parquet file per table and
+    bucket under `directory`, splitting rows into `no_buckets` buckets by
+    their Identifier.
+
+    Rows only affect the counts of rows with the same Identifier, which always
+    share a bucket, so `groups` can return whole buckets a few at a time,
+    each group within the budget, and their counts be added up.
+    """
+
+    def __init__(self, directory, memory_budget_mb=512, no_buckets=64):
+        self.directory = directory
+        self.memory_budget = memory_budget_mb * 2**20
+        self.no_buckets = no_buckets
+        self.pending = {"calendar": [], "cancelled": []}
+        self.pending_bytes = 0
+        self.empty = {}
+        self.writers = {}
+        self.bucket_bytes = np.zeros(no_buckets, dtype="int64")
+        self.rows = {"calendar": 0, "cancelled": 0}
+        self.no_spills = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, calendar_df, cancelled_df):
+        """
+        Adds a chunk of parsed rows, spilling every chunk held so far to disk
+        if they now take more than the memory budget.
+        """
+        for table, df in [("calendar", calendar_df), ("cancelled", cancelled_df)]:
+            self.empty.setdefault(table, df.iloc[:0])
+            if len(df):
+                self.pending[table].append(df)
+                self.pending_bytes += df.memory_usage(deep=True).sum()
+                self.rows[table] += len(df)
+
+        if self.pending_bytes > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """
+        Appends the chunks held in memory to the bucket files, as one parquet
+        row group per chunk and bucket.
+        """
+        for table, frames in self.pending.items():
+            for df in frames:
+                row_bytes = df.memory_usage(deep=True).sum() / len(df)
+
+                # converted once, sorted by bucket, then sliced without copying
+                buckets = identifier_buckets(df["Identifier"], self.no_buckets)
+                order = np.argsort(buckets, kind="stable")
+                arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+                arrow_table = arrow_table.take(order)
+                bounds = np.searchsorted(buckets[order], np.arange(self.no_buckets + 1))
+                for bucket in np.flatnonzero(np.diff(bounds)):
+                    part = arrow_table.slice(
+                        bounds[bucket], bounds[bucket + 1] - bounds[bucket]
+                    )
+                    self.write(table, bucket, part)
+                    self.bucket_bytes[bucket] += round(row_bytes * part.num_rows)
+
+        self.pending = {"calendar": [], "cancelled": []}
+        self.pending_bytes = 0
+        self.no_spills += 1
+
+    def write(self, table, bucket, arrow_table):
+        if (table, bucket) not in self.writers:
+            self.writers[(table, bucket)] = pq.ParquetWriter(
+                self.bucket_path(table, bucket), arrow_table.schema
+            )
+        writer = self.writers[(table, bucket)]
+        writer.write_table(arrow_table.cast(writer.schema))
+
+    def bucket_path(self, table, bucket):
+        return os.path.join(self.directory, f"{table}_{bucket:04d}.parquet")
+
+    def read(self, table, buckets):
+        frames = [
+            pq.read_table(self.bucket_path(table, bucket)).to_pandas()
+            for bucket in buckets
+            if (table, bucket) in self.writers
+        ]
+        if not frames:
+            return self.empty[table]
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def groups(self):
+        """
+        Yields the rows added, as (calendar_df, cancelled_df) pairs of whole
+        buckets, together taking at most the memory budget where buckets
+        allow. Rows that were never spilled are yielded as they are, at once.
+        """
+        if not self.no_spills:
+            yield tuple(
+                pd.concat(frames, ignore_index=True) if frames else self.empty[table]
+                for table, frames in self.pending.items()
+            )
+            return
+
+        self.spill()
+        self.close()
+        group = []
+        group_bytes = 0
+        for bucket, bucket_bytes in enumerate(self.bucket_bytes):
+            if group and group_bytes + bucket_bytes > self.memory_budget:
+                yield self.read("calendar", group), self.read("cancelled", group)
+                group = []
+                group_bytes = 0
+            group.append(bucket)
+            group_bytes += bucket_bytes
+        yield self.read("calendar", group), self.read("cancelled", group)
+
+
+def load_schedules_chunked(
+    data_directory, zip_name, dump_date, store, chunk_size=5000, profiler=None
+):
+    """
+    Unpacks and parses an ATOC zip into `store` (a `SpillStore`), as
+    `build_timetable.load_schedules` does, but `chunk_size` schedules at a
+    time. The unzip stage, and parse stage of each chunk, are recorded by
+    `profiler` (a `StageProfiler`) if given.
+    """
+    logger = logging.getLogger(__name__)
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    with profiler.stage("unzip"):
+        unpack_atoc_data(data_directory, zip_name, dump_date)
+    logger.info(f'"{zip_name}" unziped.')
+
+    mca_filepath = mca_file_path(
+        data_directory, zip_name.replace(".zip", "").replace(".ZIP", ""), dump_date
+    )
+    for chunk in iter_schedule_chunks(mca_filepath, chunk_size):
+        with profiler.stage("parse", rows_in=len(chunk)) as record:
+            calendar_df, cancelled_df = create_perm_and_new_df(chunk)
+
+            # include only rows for actual station stops i.e. not flybys
+            calendar_df = calendar_df[calendar_df["TIPLOC_type"] != "F"]
+            store.add(calendar_df, cancelled_df)
+            record["rows_out"] = len(calendar_df) + len(cancelled_df)
+
+    logger.info(
+        f"Parsed {store.rows['calendar']} calendar and {store.rows['cancelled']}"
+        f" cancelled rows, spilling them to disk {store.no_spills} times."
+    )
+
+
+def summarise_store(store, station_tiplocs, dates, profiler=None):
+    """
+    Counts the journeys timetabled and scheduled at each station on each of
+    `dates` over each group of buckets in `store` (see `SpillStore.groups`),
+    and returns their station summaries, as `summarise_day` builds them, for
+    every day in one DataFrame. The count stage of each group is recorded by
+    `profiler` (a `StageProfiler`) if given.
+    """
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    counts = []
+    for calendar_df, cancelled_df in store.groups():
+        with profiler.stage("count", rows_in=len(calendar_df)):
+            counts.append(count_day_journeys(calendar_df, cancelled_df, dates))
+        del calendar_df, cancelled_df
+
+    tiplocs = pd.unique(
+        np.concatenate([group_tiplocs for group_tiplocs, _, _ in counts])
+    )
+    timetabled = np.zeros((len(dates), len(tiplocs)), dtype="int64")
+    scheduled = np.zeros((len(dates), len(tiplocs)), dtype="int64")
+    for group_tiplocs, group_timetabled, group_scheduled in counts:
+        idx = pd.Index(tiplocs).get_indexer(group_tiplocs)
+        timetabled[:, idx] += group_timetabled
+        scheduled[:, idx] += group_scheduled
+
+    return summarise_day_journeys(
+        tiplocs, timetabled, scheduled, station_tiplocs, dates
+    )
+
+
+def summarise_low_memory(
+    data_directory,
+    zip_name,
+    dump_date,
+    station_tiplocs,
+    dates,
+    chunk_size=5000,
+    memory_budget_mb=512,
+    spill_directory=None,
+    profiler=None,
+):
+    """
+    Parses an ATOC zip and summarises each of `dates` from it, with the same
+    station counts as `load_schedules` then `summarise_day`, while holding at
+    most about `memory_budget_mb` of parsed rows in memory, spilling the rest
+    to a temporary folder in `spill_directory` (the system default if None)
+    that is removed afterwards.
+    """
+    with tempfile.TemporaryDirectory(
+        prefix="rail_reporter_spill_", dir=spill_directory
+    ) as tmp_dir, SpillStore(tmp_dir, memory_budget_mb) as store:
+        load_schedules_chunked(
+            data_directory, zip_name, dump_date, store, chunk_size, profiler
+        )
+        return summarise_store(store, station_tiplocs, dates, profiler)
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from pyprojroot import here
+
+from build_timetable import load_schedules
+from engines import ENGINES
+from generate_synthetic_feed import generate_feed
+from kernels import JIT_AVAILABLE
+from utils import find_station_tiplocs
+
+COUNT_COLUMNS = [
+    "journeys_timetabled",
+    "journeys_scheduled",
+    "pct_timetabled_services_running",
+]
+
+
+def station_day_counts(output):
+    """
+    Returns the per station, per day counts of an engine's output in a
+    comparable form: one row per TIPLOC and date (stations listed twice in
+    Stops.csv give identical rows), sorted.
+    """
+    counts = (
+        output[["TIPLOC", "date", *COUNT_COLUMNS]]
+        .drop_duplicates(["TIPLOC", "date"])
+        .astype({"date": str})
+    )
+    return counts.sort_values(["date", "TIPLOC"]).reset_index(drop=True)
+
+
+def diff_station_days(expected, actual):
+    """
+    Compares the `station_day_counts` of two engines, returning a row for
+    each station and day missing from either or with any differing count,
+    with both sets of counts side by side. NaN counts are equal to each
+    other.
+    """
+    merged = expected.merge(
+        actual,
+        on=["TIPLOC", "date"],
+        how="outer",
+        suffixes=("_expected", "_actual"),
+        indicator=True,
+    )
+    mismatched = merged["_merge"] != "both"
+    for col in COUNT_COLUMNS:
+        left = merged[f"{col}_expected"].to_numpy(dtype="float64")
+        right = merged[f"{col}_actual"].to_numpy(dtype="float64")
+        mismatched |= ~((left == right) | (np.isnan(left) & np.isnan(right)))
+
+    merged["_merge"] = merged["_merge"].map(
+        {"both": "both", "left_only": "expected_only", "right_only": "actual_only"}
+    )
+    return merged[mismatched].rename(columns={"_merge": "found_in"})
+
+
+def run_engine(engine, calendar_df, cancelled_df, station_tiplocs, dates, repeats=1):
+    """
+    Runs `engine` `repeats` times over copies of the parsed schedules, as the
+    legacy filters change their column types in place, returning its output
+    and the seconds the fastest run took, which leaves out one-off costs
+    such as compiling the JIT kernels.
+    """
+    times = []
+    for _ in range(repeats):
+        calendar_copy = calendar_df.copy()
+        cancelled_copy = cancelled_df.copy()
+        start = time.perf_counter()
+        output = engine(calendar_copy, cancelled_copy, station_tiplocs, dates)
+        times.append(time.perf_counter() - start)
+    return output, min(times)
+
+
+@click.command()
+@click.option("--engine", "engines", default=None, multiple=True, type=str)
+@click.option("--zip_name", default=None, type=str)
+@click.option("--data_directory", default=None, type=str)
+@click.option("--dump_date", default=None, type=str)
+@click.option("--start_date", default=None, type=str)
+@click.option("--no_days", default=7, type=int)
+@click.option("--no_schedules", default=5000, type=int)
+@click.option("--repeats", default=1, type=int)
+@click.option("--output_directory", default=None, type=str)
+def main(
+    engines: tuple,
+    zip_name: str,
+    data_directory: str,
+    dump_date: str,
+    start_date: str,
+    no_days: int,
+    no_schedules: int,
+    repeats: int,
+    output_directory: str,
+):
+    """
+    Runs the legacy parse and day loop, and alternative engines, over the
+    same feed, and reports any station and day whose counts differ, and the
+    speedup of each engine. Exits with an error if any counts differ.
+
+    Args:
+        engines (tuple): Names of engines (see `engines.ENGINES`) to compare
+            with the legacy one, repeat the option for each, defaults to all
+        zip_name (str): Optional real ATOC zip to compare on, in
+            `data_directory` with its Stops.csv, defaults to a synthetic feed
+        data_directory (str): Directory of `zip_name`
+        dump_date (str): Dump date of `zip_name` in DDMMYYYY format
+        start_date (str): First day to compare in DDMMYYYY format, defaults
+            to the dump date
+        no_days (int): Number of days to compare
+        no_schedules (int): Size of the synthetic feed, in schedules
+        repeats (int): Times to run each engine, reporting the fastest
+        output_directory (str): Where to write the report and mismatches,
+            defaults to ./outputs/engine_comparisons/
+    """
+    logger = logging.getLogger(__name__)
+
+    engines = engines or [name for name in ENGINES if name != "legacy"]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        raise click.BadParameter(f"unknown engines {sorted(unknown)}")
+
+    if output_directory is None:
+        output_directory = os.path.join(here(), "outputs", "engine_comparisons")
+    os.makedirs(output_directory, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if zip_name is None:
+            summary = generate_feed(
+                tmp_dir,
+                no_schedules=no_schedules,
+                no_stations=min(2600, max(50, no_schedules // 20)),
+            )
+            logger.info(f"Generated synthetic feed: {summary}")
+            zip_name = os.path.basename(summary["zip_path"])
+            data_directory = tmp_dir
+            dump_date = summary["dump_date"]
+            source = f"synthetic_{no_schedules}schedules"
+        else:
+            source = zip_name
+
+        station_tiplocs = find_station_tiplocs(
+            os.path.join(data_directory, "Stops.csv")
+        )
+        try:
+            calendar_df, cancelled_df = load_schedules(
+                data_directory, zip_name, dump_date
+            )
+        finally:
+            shutil.rmtree(
+                os.path.join(data_directory, f"atoc_{dump_date}"), ignore_errors=True
+            )
+
+    start_date = datetime.strptime(start_date or dump_date, "%d%m%Y").date()
+    dates = [start_date + timedelta(days=i) for i in range(no_days)]
+    logger.info(f"Comparing engines on {source} over {dates}")
+
+    legacy_output, legacy_seconds = run_engine(
+        ENGINES["legacy"], calendar_df, cancelled_df, station_tiplocs, dates, repeats
+    )
+    expected = station_day_counts(legacy_output)
+
+    report = {
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "source": source,
+        "start_date": str(start_date),
+        "no_days": no_days,
+        "station_days": len(expected),
+        "repeats": repeats,
+        "jit_available": JIT_AVAILABLE,
+        "legacy_s": round(legacy_seconds, 4),
+        "engines": {},
+    }
+    all_match = True
+    for name in engines:
+        output, seconds = run_engine(
+            ENGINES[name], calendar_df, cancelled_df, station_tiplocs, dates, repeats
+        )
+        mismatches = diff_station_days(expected, station_day_counts(output))
+        report["engines"][name] = {
+            "seconds": round(seconds, 4),
+            "speedup": round(legacy_seconds / seconds, 2),
+            "mismatches": len(mismatches),
+        }
+        logger.info(f"{name}: {report['engines'][name]}")
+
+        if len(mismatches):
+            all_match = False
+            mismatches_filepath = os.path.join(
+                output_directory, f"{source}_{name}_mismatches.csv"
+            )
+            mismatches.to_csv(mismatches_filepath, index=False)
+            logger.info(f"{name} mismatches written to {mismatches_filepath}")
+
+    report_filepath = os.path.join(output_directory, f"{source}_comparison.json")
+    with open(report_filepath, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Comparison written to {report_filepath}")
+    click.echo(json.dumps(report, indent=2))
+
+    if not all_match:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
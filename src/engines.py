@@ -0,0 +1,74 @@
+import tempfile
+
+import pandas as pd
+
+from build_timetable import count_days, summarise_day
+from chunked import SpillStore, summarise_store
+
+
+def legacy_engine(calendar_df, cancelled_df, station_tiplocs, dates):
+    """
+    Summarises each of `dates` with `summarise_day`, as `build_timetable.py`
+    does, returning the station summaries of every day in one DataFrame.
+    """
+    return pd.concat(
+        [
+            summarise_day(calendar_df, cancelled_df, station_tiplocs, date)[3]
+            for date in dates
+        ],
+        ignore_index=True,
+    )
+
+
+def vectorised_engine(calendar_df, cancelled_df, station_tiplocs, dates):
+    """
+    Produces the same station summaries as `legacy_engine`, resolving each
+    day with boolean masks over integer coded rows (see
+    `count_day_journeys`), as `build_timetable.py --engine vectorised` does.
+    """
+    return count_days(calendar_df, cancelled_df, station_tiplocs, dates, "vectorised")
+
+
+def jit_engine(calendar_df, cancelled_df, station_tiplocs, dates):
+    """
+    Produces the same station summaries as `legacy_engine`, resolving the
+    days with the Numba compiled kernel in `kernels.py`, or the same NumPy
+    masks as `vectorised_engine` if Numba is not installed, as
+    `build_timetable.py --engine jit` does.
+    """
+    return count_days(calendar_df, cancelled_df, station_tiplocs, dates, "jit")
+
+
+def chunked_engine(
+    calendar_df,
+    cancelled_df,
+    station_tiplocs,
+    dates,
+    chunk_rows=50000,
+    memory_budget_mb=16,
+):
+    """
+    Produces the same station summaries as `legacy_engine` as
+    `build_timetable.py --low_memory` does, adding the parsed schedules to a
+    `SpillStore` `chunk_rows` at a time, with a memory budget small enough
+    that all but the smallest feeds are spilled to disk and counted a group
+    of buckets at a time.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, SpillStore(
+        tmp_dir, memory_budget_mb
+    ) as store:
+        for start in range(0, max(len(calendar_df), len(cancelled_df)), chunk_rows):
+            store.add(
+                calendar_df.iloc[start : start + chunk_rows],
+                cancelled_df.iloc[start : start + chunk_rows],
+            )
+        return summarise_store(store, station_tiplocs, dates)
+
+
+# engines that can be compared with `compare_engines.py`, by name
+ENGINES = {
+    "legacy": legacy_engine,
+    "vectorised": vectorised_engine,
+    "chunked": chunked_engine,
+    "jit": jit_engine,
+}
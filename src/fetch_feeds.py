@@ -6,11 +6,23 @@ import paramiko
 
 from datetime import datetime
 
+from profiling import StageProfiler, profile_report_path
+
 
 @click.command()
 @click.argument("feed_type")
 @click.argument("data_directory")
-def main(feed_type: str, data_directory: str, latest_only=True):
+@click.option("--profile", is_flag=True, show_default=False, default=False, type=bool)
+@click.option(
+    "--trace_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+def main(
+    feed_type: str,
+    data_directory: str,
+    profile: bool,
+    trace_memory: bool,
+    latest_only=True,
+):
     """
     Handles connecting to DTD SFTP rail data feed, and fetching latest, or all
     available.
@@ -18,24 +30,37 @@ def main(feed_type: str, data_directory: str, latest_only=True):
     Arguments:
         feed_type -- Name of feed/directory to download from, on SFTP server
         data_directory -- Directory to save files to (must already exist)
+
+    Options:
+        --profile -- Also write the time, resident memory and bytes of each
+            stage to a JSON report in `data_directory` (see `profiling.py`)
+        --trace_memory -- Also record the peak memory Python allocates in
+            each stage, with tracemalloc, implies --profile
     """
     logger = logging.getLogger(__name__)
     logger.info(f"Fetching {feed_type}")
     logger.info(os.getenv("RAIL_FEED_HOST"))
 
-    # Open a transport
-    transport = paramiko.Transport(
-        (os.getenv("RAIL_FEED_HOST"), int(os.getenv("RAIL_FEED_PORT")))
-    )
+    profiler = StageProfiler(trace_memory=trace_memory, enabled=profile or trace_memory)
 
-    # Authorise
-    transport.connect(None, os.getenv("RAIL_FEED_USER"), os.getenv("RAIL_FEED_PASS"))
+    with profiler.stage("connect"):
+        # Open a transport
+        transport = paramiko.Transport(
+            (os.getenv("RAIL_FEED_HOST"), int(os.getenv("RAIL_FEED_PORT")))
+        )
 
-    # Connect
-    sftp = paramiko.SFTPClient.from_transport(transport)
+        # Authorise
+        transport.connect(
+            None, os.getenv("RAIL_FEED_USER"), os.getenv("RAIL_FEED_PASS")
+        )
+
+        # Connect
+        sftp = paramiko.SFTPClient.from_transport(transport)
 
     # Detect remote files available
-    remote_rail_files = sftp.listdir(f"./{feed_type}")
+    with profiler.stage("list") as record:
+        remote_rail_files = sftp.listdir(f"./{feed_type}")
+        record["rows_out"] = len(remote_rail_files)
 
     if latest_only:
         # Filter to FULL data format only (rather than CHANGE format)
@@ -60,10 +85,12 @@ def main(feed_type: str, data_directory: str, latest_only=True):
 
     if len(to_download) > 0:
         for file in to_download:
-            sftp.get(
-                os.path.join(f"./{feed_type}", file),
-                os.path.join(data_directory, file),
-            )
+            with profiler.stage("download", file=file) as record:
+                sftp.get(
+                    os.path.join(f"./{feed_type}", file),
+                    os.path.join(data_directory, file),
+                )
+                record["bytes"] = os.path.getsize(os.path.join(data_directory, file))
             logger.info(f"Retrieved {file}")
         logger.info(f"Retrieved {len(to_download)} files")
 
@@ -73,6 +100,11 @@ def main(feed_type: str, data_directory: str, latest_only=True):
     if transport:
         transport.close()
 
+    profiler.write_report(
+        profile_report_path(os.path.join(data_directory, feed_type), "fetch_feeds"),
+        feed_type=feed_type,
+    )
+
     # Return what happened
     if len(to_download) > 0:
         # Report via json
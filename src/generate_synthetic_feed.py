@@ -0,0 +1,486 @@
+import io
+import json
+import logging
+import math
+import os
+import random
+from datetime import datetime, timedelta
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import click
+import numpy as np
+import pandas as pd
+
+# rough British National Grid centres that synthetic stations cluster around
+GB_CENTRES = [
+    (530000, 180000),  # London
+    (407000, 287000),  # Birmingham
+    (384000, 398000),  # Manchester
+    (430000, 433000),  # Leeds
+    (334000, 390000),  # Liverpool
+    (435000, 387000),  # Sheffield
+    (425000, 564000),  # Newcastle
+    (259000, 665000),  # Glasgow
+    (325000, 673000),  # Edinburgh
+    (394000, 806000),  # Aberdeen
+    (318000, 176000),  # Cardiff
+    (359000, 173000),  # Bristol
+    (442000, 112000),  # Southampton
+    (248000, 54000),  # Plymouth
+    (623000, 308000),  # Norwich
+]
+
+OPERATORS = ["GW", "SE", "VT", "XC", "NT", "SR", "LM", "GR", "SW", "TP", "SN", "EM"]
+
+# days run patterns for permanent schedules, and how often each is used
+DAY_PATTERNS = ["1111100", "0000010", "0000001", "1111111", "1111110"]
+DAY_WEIGHTS = [0.5, 0.15, 0.15, 0.1, 0.1]
+
+DEFAULT_STP_MIX = "P=0.7,N=0.05,O=0.15,C=0.1"
+
+
+def parse_stp_mix(stp_mix: str):
+    """
+    Parses a `P=0.7,N=0.05,O=0.15,C=0.1` STP mix into normalised
+    {indicator: share} weights.
+    """
+    weights = {}
+    for entry in stp_mix.split(","):
+        flag, share = entry.split("=")
+        if flag not in "PNOC" or len(flag) != 1:
+            raise ValueError(f"unknown STP indicator {flag}")
+        weights[flag] = float(share)
+    total = sum(weights.values())
+    return {flag: share / total for flag, share in weights.items()}
+
+
+def cif_record(*fields):
+    """Joins `fields` into one fixed width 80 character CIF record."""
+    return "".join(fields).ljust(80)[:80] + "\n"
+
+
+def hhmm(minutes: int):
+    """Formats minutes from midnight as a HHMM CIF time, wrapping at 24h."""
+    minutes = minutes % 1440
+    return f"{minutes // 60:02d}{minutes % 60:02d}"
+
+
+def build_stations(no_stations: int, no_junctions: int, seed: int = 0):
+    """
+    Returns a frame of synthetic station and junction TIPLOCs with British
+    National Grid eastings and northings, clustered around `GB_CENTRES`.
+    Junctions are timing points that services pass but do not call at, so
+    are not in the stations file.
+    """
+    rng = np.random.default_rng(seed)
+    no_locations = no_stations + no_junctions
+
+    centres = np.array(GB_CENTRES, dtype="float64")[
+        rng.integers(0, len(GB_CENTRES), no_locations)
+    ]
+    coords = centres + rng.normal(0, 25000, (no_locations, 2))
+
+    return pd.DataFrame(
+        {
+            "TIPLOC": [f"ST{i:05d}" for i in range(no_stations)]
+            + [f"JN{i:05d}" for i in range(no_junctions)],
+            "is_station": np.arange(no_locations) < no_stations,
+            "Easting": np.round(coords[:, 0]).astype("int64"),
+            "Northing": np.round(coords[:, 1]).astype("int64"),
+        }
+    )
+
+
+def build_routes(locations: pd.DataFrame, no_routes: int, seed: int = 0):
+    """
+    Returns `no_routes` routes, each a list of location positions visited in
+    order, by walking from a random station to nearby unvisited locations.
+    Every route starts and ends at a station.
+    """
+    rng = np.random.default_rng(seed)
+    coords = locations[["Easting", "Northing"]].to_numpy(dtype="float64")
+    is_station = locations["is_station"].to_numpy()
+    stations = np.flatnonzero(is_station)
+
+    routes = []
+    for _ in range(no_routes):
+        length = int(rng.integers(2, 21))
+        route = [int(rng.choice(stations))]
+        heading = rng.normal(0, 1, 2)
+        for _ in range(length - 1):
+            # nearest few locations roughly ahead of the last one
+            offsets = coords - coords[route[-1]]
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            distances[route] = np.inf
+            distances[offsets @ heading < 0] *= 4
+            nearest = np.argpartition(distances, 5)[:5]
+            route.append(int(rng.choice(nearest)))
+        while not is_station[route[-1]] and len(route) > 2:
+            route.pop()
+        if is_station[route[-1]] and len(route) > 1:
+            routes.append(route)
+
+    return routes
+
+
+def schedule_records(uid, flag, valid_from, valid_to, days, operator, stops):
+    """
+    Returns the BS, BX, LO, LI and LT records of one schedule. `stops` is a
+    list of (TIPLOC, minutes, calls) tuples, with `calls` False for passes.
+    """
+    records = [
+        cif_record(
+            "BSN",
+            uid,
+            f"{valid_from:%y%m%d}",
+            f"{valid_to:%y%m%d}",
+            days,
+            " ",  # bank holiday running
+            "P",  # train status
+            "OO",  # category
+            "1A00",  # train identity
+            "    ",  # headcode
+            "1",  # course indicator
+            "21700001",  # service code
+            " ",  # portion id
+            "EMU",  # power type
+            "    ",  # timing load
+            "100",  # speed
+            "      ",  # operating characteristics
+            "S",  # seating class
+            " " * 11,  # sleepers, reservations, connection, catering, branding
+            " ",  # spare
+            flag,  # STP indicator
+        )
+    ]
+    if flag == "C":
+        return records
+
+    records.append(cif_record("BX", "    ", "     ", operator, "Y", " " * 8, " "))
+    for pos, (tiploc, minutes, calls) in enumerate(stops):
+        location = tiploc.ljust(8)
+        time = hhmm(minutes)
+        if pos == 0:
+            records.append(cif_record("LO", location, time, " ", time, "1  ", "   "))
+        elif pos == len(stops) - 1:
+            records.append(cif_record("LT", location, time, " ", time, "1  ", "   "))
+        elif calls:
+            dep = hhmm(minutes + 1)
+            records.append(
+                cif_record("LI", location, time, " ", dep, " ", "     ", time, dep)
+            )
+        else:
+            records.append(
+                cif_record("LI", location, "     ", "     ", time, " ", "0000", "0000")
+            )
+    return records
+
+
+def base_schedule(
+    rng, number, flag, routes, start_date, validity_days, small_hours_share
+):
+    """
+    Draws a permanent (P) or new STP (N) schedule along one of `routes`, as
+    (uid, valid_from, valid_to, days, route, first_minutes), starting in the
+    small hours for `small_hours_share` of schedules.
+    """
+    uid = f"{chr(65 + number // 100000 % 26)}{number % 100000:05d}"
+    route = rng.choice(routes)
+    if rng.random() < 0.5:
+        route = route[::-1]
+    if rng.random() < small_hours_share:
+        first_minutes = rng.randint(0, 119)
+    else:
+        first_minutes = rng.randint(120, 1439)
+    if flag == "P":
+        valid_from = start_date - timedelta(days=rng.randint(0, validity_days))
+        valid_to = start_date + timedelta(days=rng.randint(0, validity_days))
+    else:
+        valid_from = start_date + timedelta(days=rng.randint(0, validity_days // 2))
+        valid_to = valid_from + timedelta(days=rng.randint(0, 14))
+    days = rng.choices(DAY_PATTERNS, DAY_WEIGHTS)[0]
+    return uid, valid_from, valid_to, days, route, first_minutes
+
+
+def overlay_schedule(rng, flag, permanent, is_station):
+    """
+    Draws an overlay (O) or cancellation (C) of one of the `permanent`
+    schedules for part of its validity, as `base_schedule` returns them.
+    Overlays are retimed, and sometimes cut short at a station.
+    """
+    uid, base_from, base_to, days, route, first_minutes = rng.choice(permanent)
+    valid_from = base_from + timedelta(
+        days=rng.randint(0, max(0, (base_to - base_from).days))
+    )
+    valid_to = min(base_to, valid_from + timedelta(days=rng.randint(0, 7)))
+    if flag == "O":
+        first_minutes = (first_minutes + rng.randint(-30, 30)) % 1440
+        if len(route) > 2 and rng.random() < 0.3:
+            route = route[: rng.randint(2, len(route))]
+            while not is_station[route[-1]] and len(route) > 2:
+                route = route[:-1]
+    return uid, valid_from, valid_to, days, route, first_minutes
+
+
+def route_stops(rng, route, first_minutes, locations):
+    """
+    Returns the (TIPLOC, minutes, calls) stops of a service along `route`
+    from `first_minutes`, running time growing with distance, and calling
+    at most stations it passes, as `schedule_records` takes them.
+    """
+    tiplocs, is_station, eastings, northings = locations
+    stops = []
+    minutes = first_minutes
+    for pos, location in enumerate(route):
+        if pos:
+            distance = math.hypot(
+                eastings[location] - eastings[route[pos - 1]],
+                northings[location] - northings[route[pos - 1]],
+            )
+            minutes += 2 + int(distance / 1200)
+        calls = (
+            pos in (0, len(route) - 1) or is_station[location] and rng.random() < 0.85
+        )
+        stops.append((tiplocs[location], minutes, calls))
+        if calls and 0 < pos < len(route) - 1:
+            minutes += 1
+    return stops
+
+
+def generate_schedules(
+    locations,
+    routes,
+    no_schedules,
+    start_date,
+    validity_days,
+    stp_mix,
+    small_hours_share,
+    seed=0,
+):
+    """
+    Yields the STP indicator and records of `no_schedules` schedules, one
+    schedule at a time, so feeds larger than memory can be written. Permanent
+    (P) and new STP (N) schedules run along `routes`; overlays (O) and
+    cancellations (C) reuse the UID of an earlier permanent schedule for part
+    of its validity, as in real feeds.
+    """
+    rng = random.Random(seed)
+    columns = tuple(
+        locations[col].tolist()
+        for col in ["TIPLOC", "is_station", "Easting", "Northing"]
+    )
+    flags = list(stp_mix)
+    weights = list(stp_mix.values())
+
+    permanent = []  # schedules as `base_schedule` returns them
+
+    for number in range(no_schedules):
+        flag = rng.choices(flags, weights)[0]
+        if flag in "OC" and not permanent:
+            flag = "P"
+
+        if flag in "PN":
+            schedule = base_schedule(
+                rng, number, flag, routes, start_date, validity_days, small_hours_share
+            )
+            if flag == "P":
+                permanent.append(schedule)
+        else:
+            schedule = overlay_schedule(rng, flag, permanent, columns[1])
+
+        uid, valid_from, valid_to, days, route, first_minutes = schedule
+        stops = route_stops(rng, route, first_minutes, columns)
+        yield flag, schedule_records(
+            uid,
+            flag,
+            valid_from,
+            valid_to,
+            days,
+            rng.choice(OPERATORS),
+            stops,
+        )
+
+
+def write_stops_file(locations, stops_path):
+    """
+    Writes the stations in `locations` as a NaPTAN style stops csv, read by
+    `utils.find_station_tiplocs`, with a few bus stops and an inactive
+    station that should be filtered out.
+    """
+    stations = locations[locations["is_station"]]
+    stops = pd.DataFrame(
+        {
+            "ATCOCode": "9100" + stations["TIPLOC"],
+            "CommonName": [f"Synthetic Station {i}" for i in range(len(stations))],
+            "Status": "active",
+            "StopType": "RLY",
+            "Easting": stations["Easting"],
+            "Northing": stations["Northing"],
+        }
+    )
+    extras = pd.DataFrame(
+        {
+            "ATCOCode": ["0100BUS00001", "0100BUS00002", "9100CLOSED1"],
+            "CommonName": ["Bus Stop 1", "Bus Stop 2", "Closed Station"],
+            "Status": ["active", "active", "inactive"],
+            "StopType": ["BCT", "BCT", "RLY"],
+            "Easting": [530000, 407000, 384000],
+            "Northing": [180000, 287000, 398000],
+        }
+    )
+    pd.concat([stops, extras], ignore_index=True).to_csv(stops_path, index=False)
+
+
+def generate_feed(
+    output_directory,
+    feed_number=1,
+    no_schedules=1000,
+    no_stations=200,
+    start_date=None,
+    validity_days=90,
+    stp_mix=DEFAULT_STP_MIX,
+    small_hours_share=0.05,
+    seed=0,
+):
+    """
+    Writes a synthetic `RJTTF<feed_number>.ZIP` feed, holding a `.MCA` of
+    `no_schedules` schedules over `no_stations` stations, and a matching
+    `Stops.csv`, to `output_directory`. The feed is dumped on `start_date`
+    (default today), with permanent schedules valid up to `validity_days`
+    either side of it. Returns a summary of what was written.
+    """
+    if start_date is None:
+        start_date = datetime.now().date()
+    stp_mix = parse_stp_mix(stp_mix)
+    os.makedirs(output_directory, exist_ok=True)
+
+    locations = build_stations(no_stations, max(1, no_stations // 4), seed)
+    routes = build_routes(locations, max(10, no_schedules // 40), seed)
+
+    zip_name = f"RJTTF{feed_number:03d}.ZIP"
+    zip_path = os.path.join(output_directory, zip_name)
+    no_records = 0
+    with ZipFile(zip_path, "w", compression=ZIP_DEFLATED) as zip:
+        with zip.open(zip_name.replace(".ZIP", ".MCA"), "w") as raw:
+            mca = io.TextIOWrapper(raw, encoding="ascii", newline="")
+
+            # header, tiploc inserts and associations, skipped by the parser
+            mca.write(
+                cif_record(
+                    "HDTPS.UDFROC1.PD",
+                    f"{start_date:%y%m%d}",
+                    f"{start_date:%d%m%y}",
+                    "0000",
+                    f"DFROC{feed_number % 10}A",
+                    f"DFROC{(feed_number - 1) % 10}A",
+                    "F",
+                    "A",
+                    f"{start_date:%d%m%y}",
+                    f"{start_date + timedelta(days=365):%d%m%y}",
+                )
+            )
+            for tiploc in locations["TIPLOC"]:
+                mca.write(cif_record("TI", tiploc.ljust(7), "00", "000000"))
+            mca.write(cif_record("AAN", "A00000", "A00001", f"{start_date:%y%m%d}"))
+            no_records += len(locations) + 2
+
+            # written in batches, to keep memory flat however large the feed
+            written = {flag: 0 for flag in "PNOC"}
+            batch = []
+            for flag, records in generate_schedules(
+                locations,
+                routes,
+                no_schedules,
+                start_date,
+                validity_days,
+                stp_mix,
+                small_hours_share,
+                seed,
+            ):
+                written[flag] += 1
+                batch.extend(records)
+                if len(batch) >= 10000:
+                    mca.write("".join(batch))
+                    no_records += len(batch)
+                    batch = []
+            mca.write("".join(batch) + cif_record("ZZ"))
+            no_records += len(batch) + 1
+            mca.flush()
+            mca.detach()
+
+    stops_path = os.path.join(output_directory, "Stops.csv")
+    write_stops_file(locations, stops_path)
+
+    return {
+        "zip_path": zip_path,
+        "stops_path": stops_path,
+        "dump_date": f"{start_date:%d%m%Y}",
+        "schedules": written,
+        "records": no_records,
+        "stations": no_stations,
+        "routes": len(routes),
+        "zip_bytes": os.path.getsize(zip_path),
+    }
+
+
+@click.command()
+@click.argument("output_directory")
+@click.option("--feed_number", default=1, show_default=True, type=int)
+@click.option("--no_schedules", default=1000, show_default=True, type=int)
+@click.option("--no_stations", default=200, show_default=True, type=int)
+@click.option("--start_date", default=None, type=str)
+@click.option("--validity_days", default=90, show_default=True, type=int)
+@click.option("--stp_mix", default=DEFAULT_STP_MIX, show_default=True, type=str)
+@click.option("--small_hours_share", default=0.05, show_default=True, type=float)
+@click.option("--seed", default=0, show_default=True, type=int)
+def main(
+    output_directory: str,
+    feed_number: int,
+    no_schedules: int,
+    no_stations: int,
+    start_date: str,
+    validity_days: int,
+    stp_mix: str,
+    small_hours_share: float,
+    seed: int,
+):
+    """
+    Writes a synthetic ATOC CIF feed and stations file, for running and
+    benchmarking the pipeline offline.
+
+    Arguments:
+        output_directory -- Directory to write `RJTTF<feed_number>.ZIP` and
+        `Stops.csv` to
+    """
+    logger = logging.getLogger(__name__)
+
+    if start_date is not None:
+        start_date = datetime.strptime(start_date, "%d%m%Y").date()
+
+    summary = generate_feed(
+        output_directory,
+        feed_number,
+        no_schedules,
+        no_stations,
+        start_date,
+        validity_days,
+        stp_mix,
+        small_hours_share,
+        seed,
+    )
+    logger.info(f"Generated synthetic feed: {summary}")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
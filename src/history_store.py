@@ -0,0 +1,443 @@
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils import REGION_BBOXES, breakout_DTD_filename, read_disruption_summary
+
+# one row per station per service day, as planned in one feed dump
+HISTORY_KEY = ["feed_number", "dump_date", "date", "TIPLOC"]
+
+HISTORY_SCHEMA = pa.schema(
+    [
+        ("feed_number", pa.int32()),
+        ("dump_date", pa.date32()),
+        ("date", pa.date32()),
+        ("TIPLOC", pa.string()),
+        ("Station_Name", pa.string()),
+        ("Latitude", pa.float64()),
+        ("Longitude", pa.float64()),
+        ("journeys_timetabled", pa.int64()),
+        ("journeys_scheduled", pa.int64()),
+        ("pct_timetabled_services_running", pa.float64()),
+    ]
+)
+
+# files are grouped into service_month=YYYY-MM folders, so date range
+# queries only open the months they cover
+HISTORY_PARTITIONING = ds.partitioning(
+    pa.schema([("service_month", pa.string())]), flavor="hive"
+)
+
+# how long files merged away by `compact` are kept for reads that listed
+# them before the merge, before they are deleted
+RETIRED_GRACE_SECONDS = 3600
+
+# rows are sorted by station within each file, so row group statistics let
+# station queries skip most of a file
+ROW_GROUP_SIZE = 16384
+
+
+def bbox_filter(bbox):
+    """
+    Returns a dataset filter for stations within `bbox`, either
+    [(lat_min, lon_min), (lat_max, lon_max)] or a `REGION_BBOXES` name.
+    """
+    if isinstance(bbox, str):
+        bbox = REGION_BBOXES[bbox]["bbox"]
+    (lat_min, lon_min), (lat_max, lon_max) = bbox
+
+    return (
+        (ds.field("Latitude") >= lat_min)
+        & (ds.field("Latitude") <= lat_max)
+        & (ds.field("Longitude") >= lon_min)
+        & (ds.field("Longitude") <= lon_max)
+    )
+
+
+class HistoryStore:
+    """
+    Append-only store of daily disruption summaries from successive feed
+    dumps, keyed by (feed number, dump date, service date, TIPLOC).
+
+    Each feed is written once per service month, to a file named after the
+    feed, and recorded in `_feeds.json` once all of its files are in place.
+    Appending a feed that is already recorded is a no-op, and re-running an
+    interrupted append overwrites the same files, so inserts are idempotent.
+    `compact` merges each month's per-feed files into one file, recording
+    the files merged away in `_retired.json` so that reads skip them.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "_feeds.json")
+        self.retired_path = os.path.join(root, "_retired.json")
+        os.makedirs(root, exist_ok=True)
+
+    def feeds(self):
+        """
+        Returns the manifest of feeds in the store, oldest first.
+        """
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def _write_manifest(self, feeds):
+        tmp_path = os.path.join(self.root, ".feeds.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(feeds, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def retired(self):
+        """
+        Returns the files merged away by `compact` but not yet deleted, as
+        {path relative to the store: when it was retired}.
+        """
+        if not os.path.exists(self.retired_path):
+            return {}
+        with open(self.retired_path, "r") as f:
+            return json.load(f)
+
+    def _write_retired(self, retired):
+        tmp_path = os.path.join(self.root, ".retired.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(retired, f, indent=2)
+        os.replace(tmp_path, self.retired_path)
+
+    def month_files(self):
+        """
+        Returns the data files of each service month that reads see, as
+        {month folder: sorted paths relative to the store}, skipping
+        retired files and files being written.
+        """
+        retired = self.retired()
+        months = {}
+        for folder in sorted(os.listdir(self.root)):
+            if not folder.startswith("service_month=") or not os.path.isdir(
+                os.path.join(self.root, folder)
+            ):
+                continue
+            months[folder] = sorted(
+                f"{folder}/{file}"
+                for file in os.listdir(os.path.join(self.root, folder))
+                if file.endswith(".parquet")
+                and not file.startswith(".")
+                and f"{folder}/{file}" not in retired
+            )
+        return months
+
+    def append(self, df, feed_number: int, dump_date):
+        """
+        Adds the `build_timetable.py` summary `df` for one feed dump, returning
+        the number of rows written (0 if the feed is already in the store).
+        """
+        logger = logging.getLogger(__name__)
+
+        feeds = self.feeds()
+        for feed in feeds:
+            if (feed["feed_number"], feed["dump_date"]) == (
+                feed_number,
+                str(dump_date),
+            ):
+                logger.info(f"Feed {feed_number} ({dump_date}) already in store.")
+                return 0
+
+        df = pd.DataFrame(
+            {
+                "feed_number": feed_number,
+                "dump_date": dump_date,
+                "date": pd.to_datetime(
+                    df["date"].astype(str), format="%Y-%m-%d"
+                ).dt.date.values,
+                "TIPLOC": df["TIPLOC"].astype(str).values,
+                "Station_Name": df["Station_Name"].astype(str).values,
+                "Latitude": df["Latitude"].values,
+                "Longitude": df["Longitude"].values,
+                "journeys_timetabled": df["journeys_timetabled"].astype("Int64").values,
+                "journeys_scheduled": df["journeys_scheduled"].astype("int64").values,
+                "pct_timetabled_services_running": df[
+                    "pct_timetabled_services_running"
+                ].values,
+            }
+        )
+        df = df.sort_values(["TIPLOC", "date"], kind="stable")
+        months = pd.to_datetime(df["date"]).dt.strftime("%Y-%m")
+
+        for month, month_df in df.groupby(months.values):
+            folder_path = os.path.join(self.root, f"service_month={month}")
+            os.makedirs(folder_path, exist_ok=True)
+            pq.write_table(
+                pa.Table.from_pandas(
+                    month_df, schema=HISTORY_SCHEMA, preserve_index=False
+                ),
+                os.path.join(
+                    folder_path, f"feed_{feed_number:05d}_{dump_date:%Y%m%d}.parquet"
+                ),
+                row_group_size=ROW_GROUP_SIZE,
+            )
+
+        feeds.append(
+            {
+                "feed_number": feed_number,
+                "dump_date": str(dump_date),
+                "start_date": str(df["date"].min()),
+                "end_date": str(df["date"].max()),
+                "rows": len(df),
+                "added_at": datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+        self._write_manifest(sorted(feeds, key=lambda f: f["feed_number"]))
+        logger.info(f"Added {len(df)} rows from feed {feed_number} ({dump_date}).")
+
+        return len(df)
+
+    def compact(self, grace_seconds=RETIRED_GRACE_SECONDS):
+        """
+        Merges the files of recorded feeds in each service month into a
+        single file sorted by station, dropping any duplicate keys. Returns
+        the number of files merged away.
+
+        Each merged file is written under a new name, then the files it
+        replaces are retired in one atomic rewrite of `_retired.json`, so
+        reads see either the old files or the merged one, never both or
+        neither. Retired files are only deleted `grace_seconds` later, by a
+        later compaction, so reads that listed them before still find them.
+        """
+        logger = logging.getLogger(__name__)
+
+        # files of feeds not (yet) in the manifest, such as from an append
+        # that was interrupted, are left to be rewritten by its re-run
+        recorded = {
+            f"feed_{feed['feed_number']:05d}_{feed['dump_date'].replace('-', '')}"
+            ".parquet"
+            for feed in self.feeds()
+        }
+
+        merged = 0
+        for folder, file_paths in self.month_files().items():
+            file_paths = [
+                path
+                for path in file_paths
+                if os.path.basename(path) in recorded
+                or os.path.basename(path).startswith("compacted")
+            ]
+            if len(file_paths) < 2:
+                continue
+
+            df = (
+                pd.concat(
+                    [
+                        pq.read_table(os.path.join(self.root, path)).to_pandas()
+                        for path in file_paths
+                    ]
+                )
+                .drop_duplicates(HISTORY_KEY, keep="last")
+                .sort_values(["TIPLOC", "date", "feed_number"], kind="stable")
+            )
+
+            # written aside, so reads never see a partial file
+            compacted_file = f"compacted_{uuid.uuid4().hex}.parquet"
+            tmp_path = os.path.join(self.root, folder, f".{compacted_file}.tmp")
+            pq.write_table(
+                pa.Table.from_pandas(df, schema=HISTORY_SCHEMA, preserve_index=False),
+                tmp_path,
+                row_group_size=ROW_GROUP_SIZE,
+            )
+            os.replace(tmp_path, os.path.join(self.root, folder, compacted_file))
+
+            retired_at = datetime.now().isoformat(timespec="seconds")
+            self._write_retired(
+                {**self.retired(), **{path: retired_at for path in file_paths}}
+            )
+
+            merged += len(file_paths) - 1
+            logger.info(f"Compacted {len(file_paths)} files in {folder}.")
+
+        self.delete_retired(grace_seconds)
+
+        return merged
+
+    def delete_retired(self, grace_seconds=RETIRED_GRACE_SECONDS):
+        """
+        Deletes the files retired by `compact` more than `grace_seconds`
+        ago, returning how many were deleted.
+        """
+        retired = self.retired()
+        cutoff = datetime.now() - timedelta(seconds=grace_seconds)
+        expired = [
+            path
+            for path, retired_at in retired.items()
+            if datetime.fromisoformat(retired_at) <= cutoff
+        ]
+        for path in expired:
+            if os.path.exists(os.path.join(self.root, path)):
+                os.remove(os.path.join(self.root, path))
+            # only forgotten once deleted, so never read again meanwhile
+            del retired[path]
+        if expired:
+            self._write_retired(retired)
+
+        return len(expired)
+
+    def _read(self, row_filter, start_date=None, end_date=None, latest_only=False):
+        """
+        Reads the rows matching `row_filter` between `start_date` and
+        `end_date`, opening only the service months in range.
+        """
+        if start_date is not None:
+            row_filter &= ds.field("date") >= start_date
+            row_filter &= ds.field("service_month") >= f"{start_date:%Y-%m}"
+        if end_date is not None:
+            row_filter &= ds.field("date") <= end_date
+            row_filter &= ds.field("service_month") <= f"{end_date:%Y-%m}"
+
+        feeds = self.feeds()
+        if not feeds:
+            return pd.DataFrame(columns=HISTORY_SCHEMA.names)
+
+        # listed explicitly, as retired files stay on disk for a while
+        dataset = ds.dataset(
+            [
+                os.path.join(self.root, path)
+                for paths in self.month_files().values()
+                for path in paths
+            ],
+            schema=HISTORY_SCHEMA.append(pa.field("service_month", pa.string())),
+            format="parquet",
+            partitioning=HISTORY_PARTITIONING,
+            partition_base_dir=self.root,
+        )
+        df = (
+            dataset.to_table(filter=row_filter, columns=HISTORY_SCHEMA.names)
+            .to_pandas()
+            .drop_duplicates(HISTORY_KEY, keep="last")
+        )
+
+        if latest_only:
+            # the most recent feed planning each service date
+            latest = {}
+            for feed in feeds:
+                for date in pd.date_range(feed["start_date"], feed["end_date"]):
+                    latest[date.date()] = feed["feed_number"]
+            df = df[df["feed_number"].values == df["date"].map(latest).values]
+
+        return df.sort_values(["date", "feed_number", "TIPLOC"]).reset_index(drop=True)
+
+    def station_series(
+        self, tiplocs, start_date=None, end_date=None, latest_only=False
+    ):
+        """
+        Returns the daily summary rows for the stations in `tiplocs` (a TIPLOC
+        or list of TIPLOCs), from every feed that planned those days, or only
+        the latest feed planning each day if `latest_only`.
+        """
+        if isinstance(tiplocs, str):
+            tiplocs = [tiplocs]
+
+        return self._read(
+            ds.field("TIPLOC").isin(tiplocs), start_date, end_date, latest_only
+        )
+
+    def day_summary(self, date, bbox=None, latest_only=True):
+        """
+        Returns the summary rows for every station on service `date`,
+        optionally only those within `bbox` (see `region_series`).
+        """
+        row_filter = ds.field("date") == date
+        if bbox is not None:
+            row_filter &= bbox_filter(bbox)
+
+        return self._read(row_filter, date, date, latest_only)
+
+    def region_series(self, bbox, start_date=None, end_date=None, latest_only=True):
+        """
+        Returns daily total journeys timetabled and scheduled, and the
+        percentage running, for stations within `bbox`
+        ([(lat_min, lon_min), (lat_max, lon_max)], or a `REGION_BBOXES` name),
+        per feed and service date.
+        """
+        df = self._read(bbox_filter(bbox), start_date, end_date, latest_only)
+
+        # only count stations with timetabled services, as the maps do
+        df = df[~df["pct_timetabled_services_running"].isna()]
+        totals = (
+            df.groupby(["feed_number", "dump_date", "date"])
+            .agg(
+                stations=("TIPLOC", "size"),
+                journeys_timetabled=("journeys_timetabled", "sum"),
+                journeys_scheduled=("journeys_scheduled", "sum"),
+            )
+            .reset_index()
+        )
+        totals["pct_timetabled_services_running"] = (
+            totals["journeys_scheduled"] / totals["journeys_timetabled"] * 100
+        ).round(2)
+
+        return totals
+
+
+@click.group()
+def main():
+    """
+    Manages the historical store of daily disruption summaries.
+    """
+
+
+@main.command()
+@click.argument("store_directory")
+@click.argument("input_path")
+@click.argument("zip_name")
+@click.argument("dump_date")
+def add(store_directory: str, input_path: str, zip_name: str, dump_date: str):
+    """
+    Adds an existing `build_timetable.py` output to the store.
+
+    Arguments:
+        store_directory -- Directory of the historical store
+        input_path -- `build_timetable.py` parquet dataset or csv export
+        zip_name -- Name of the ATOC zip the output was built from
+        dump_date -- Date the ATOC zip was "dumped", in DDMMYYYY format
+    """
+    HistoryStore(store_directory).append(
+        read_disruption_summary(input_path),
+        feed_number=breakout_DTD_filename(zip_name)["number"],
+        dump_date=datetime.strptime(dump_date, "%d%m%Y").date(),
+    )
+
+
+@main.command()
+@click.argument("store_directory")
+@click.option(
+    "--grace_seconds", default=RETIRED_GRACE_SECONDS, show_default=True, type=int
+)
+def compact(store_directory: str, grace_seconds: int):
+    """
+    Merges the per-feed files in each service month of the store, deleting
+    files merged away by earlier compactions over `grace_seconds` ago.
+
+    Arguments:
+        store_directory -- Directory of the historical store
+    """
+    HistoryStore(store_directory).compact(grace_seconds)
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
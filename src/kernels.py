@@ -0,0 +1,260 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from utils import WEEKDAYS, count_day_journeys
+
+try:
+    import numba
+except ImportError:  # optional, `count_day_journeys_jit` falls back to NumPy
+    numba = None
+
+# whether the kernels below are compiled, rather than `count_day_journeys` run
+JIT_AVAILABLE = numba is not None
+
+prange = numba.prange if JIT_AVAILABLE else range
+
+# `Flag` codes of the schedule rows
+FLAG_CODES = {"P": 1, "N": 2, "O": 3}
+PERMANENT, NEW, OVERLAY = 1, 2, 3
+
+
+def running_rows(
+    row_ids,
+    runs_on,
+    valid_from,
+    valid_to,
+    small_hours,
+    core_start,
+    small_start,
+    d1,
+    d2,
+    weekday1,
+    weekday2,
+    no_identifiers,
+):
+    """
+    Returns how many times each row runs on a day, by `filter_to_date` then
+    `filter_to_dft_time`: once for each of the core and small hours start
+    sets its Identifier is in, if the row itself runs that day.
+    """
+    today = np.zeros(len(row_ids), dtype=np.bool_)
+    core_ids = np.zeros(no_identifiers, dtype=np.bool_)
+    small_ids = np.zeros(no_identifiers, dtype=np.bool_)
+    for i in range(len(row_ids)):
+        if small_hours[i]:
+            today[i] = runs_on[i, weekday2] and valid_from[i] <= d2 <= valid_to[i]
+        else:
+            today[i] = runs_on[i, weekday1] and valid_from[i] <= d1 <= valid_to[i]
+        core_ids[row_ids[i]] |= today[i] and core_start[i]
+        small_ids[row_ids[i]] |= today[i] and small_start[i]
+
+    multiplicity = np.zeros(len(row_ids), dtype=np.int64)
+    for i in range(len(row_ids)):
+        if today[i]:
+            multiplicity[i] = core_ids[row_ids[i]] + small_ids[row_ids[i]]
+    return multiplicity
+
+
+def replaced_identifiers(
+    row_ids,
+    flags,
+    runs_on,
+    day1_start,
+    day2_start,
+    multiplicity,
+    canc_ids,
+    canc_runs_on,
+    canc_from,
+    canc_to,
+    d1,
+    d2,
+    weekday1,
+    weekday2,
+    no_identifiers,
+):
+    """
+    Returns which Identifiers have their permanent and new schedules replaced
+    on a day, by an overlay running, or by `filter_to_date(...,
+    cancellations=True)` then `filter_to_date_cancellations`.
+    """
+    day1_ids = np.zeros(no_identifiers, dtype=np.bool_)
+    day2_ids = np.zeros(no_identifiers, dtype=np.bool_)
+    replaced = np.zeros(no_identifiers, dtype=np.bool_)
+    for i in range(len(row_ids)):
+        if multiplicity[i] > 0:
+            day1_ids[row_ids[i]] |= day1_start[i] and runs_on[i, weekday1]
+            day2_ids[row_ids[i]] |= day2_start[i] and runs_on[i, weekday2]
+            replaced[row_ids[i]] |= flags[i] == OVERLAY
+
+    for j in range(len(canc_ids)):
+        runs1 = canc_runs_on[j, weekday1]
+        runs2 = canc_runs_on[j, weekday2]
+        runs_today = (runs1 and canc_from[j] <= d1 <= canc_to[j]) or (
+            runs2 and canc_from[j] <= d2 <= canc_to[j]
+        )
+        replaced[canc_ids[j]] |= runs_today and (
+            (day1_ids[canc_ids[j]] and runs1) or (day2_ids[canc_ids[j]] and runs2)
+        )
+    return replaced
+
+
+def count_stations(
+    timetabled, scheduled, row_ids, tiploc_codes, flags, multiplicity, replaced
+):
+    """
+    Adds the rows running on a day to the journeys timetabled (permanent
+    rows) and scheduled (overlays, and permanent and new rows not replaced)
+    at each TIPLOC.
+    """
+    for i in range(len(row_ids)):
+        if flags[i] == PERMANENT:
+            timetabled[tiploc_codes[i]] += multiplicity[i]
+        if flags[i] == OVERLAY or (
+            (flags[i] == PERMANENT or flags[i] == NEW) and not replaced[row_ids[i]]
+        ):
+            scheduled[tiploc_codes[i]] += multiplicity[i]
+
+
+def count_days_kernel(
+    row_ids,
+    tiploc_codes,
+    flags,
+    runs_on,
+    valid_from,
+    valid_to,
+    small_hours,
+    core_start,
+    small_start,
+    day1_start,
+    day2_start,
+    canc_ids,
+    canc_runs_on,
+    canc_from,
+    canc_to,
+    day_dates,
+    no_identifiers,
+    no_tiplocs,
+):
+    """
+    Resolves the services running on each day, by the rules of
+    `count_day_journeys`, in a few passes over the rows, returning arrays of
+    shape (len(day_dates), no_tiplocs) of the journeys timetabled and
+    scheduled at each TIPLOC. Each row of `day_dates` is a day's (YYMMDD,
+    next day's YYMMDD, weekday, next day's weekday), and days are run in
+    parallel when compiled.
+    """
+    no_days = day_dates.shape[0]
+    timetabled = np.zeros((no_days, no_tiplocs), dtype=np.int64)
+    scheduled = np.zeros((no_days, no_tiplocs), dtype=np.int64)
+
+    for day in prange(no_days):
+        d1, d2, weekday1, weekday2 = day_dates[day]
+        multiplicity = running_rows(
+            row_ids,
+            runs_on,
+            valid_from,
+            valid_to,
+            small_hours,
+            core_start,
+            small_start,
+            d1,
+            d2,
+            weekday1,
+            weekday2,
+            no_identifiers,
+        )
+        replaced = replaced_identifiers(
+            row_ids,
+            flags,
+            runs_on,
+            day1_start,
+            day2_start,
+            multiplicity,
+            canc_ids,
+            canc_runs_on,
+            canc_from,
+            canc_to,
+            d1,
+            d2,
+            weekday1,
+            weekday2,
+            no_identifiers,
+        )
+        count_stations(
+            timetabled[day],
+            scheduled[day],
+            row_ids,
+            tiploc_codes,
+            flags,
+            multiplicity,
+            replaced,
+        )
+
+    return timetabled, scheduled
+
+
+if JIT_AVAILABLE:
+    running_rows = numba.njit(cache=True)(running_rows)
+    replaced_identifiers = numba.njit(cache=True)(replaced_identifiers)
+    count_stations = numba.njit(cache=True)(count_stations)
+    count_days_kernel = numba.njit(parallel=True, cache=True)(count_days_kernel)
+
+
+def count_day_journeys_jit(calendar_df, cancelled_df, dates):
+    """
+    Returns the same counts as `count_day_journeys`, from `count_days_kernel`
+    compiled with Numba, over typed arrays of the schedules. Without Numba,
+    returns `count_day_journeys` itself. The first call compiles the kernel,
+    or loads it from the cache in `__pycache__`.
+    """
+    if not JIT_AVAILABLE:
+        return count_day_journeys(calendar_df, cancelled_df, dates)
+
+    identifier_codes, _ = pd.factorize(
+        pd.concat([calendar_df["Identifier"], cancelled_df["Identifier"]]),
+        use_na_sentinel=False,
+    )
+    tiploc_codes, tiplocs = pd.factorize(calendar_df["TIPLOC"], use_na_sentinel=False)
+
+    # start rows and their times, compared as strings like the legacy filters
+    times = calendar_df["Time"]
+    is_start = calendar_df["Stop"].to_numpy() == 1
+    core_start = is_start & (times >= "0200").to_numpy()
+    small_start = is_start & (times < "0200").to_numpy()
+
+    day_dates = np.array(
+        [
+            [
+                int(date.strftime("%y%m%d")),
+                int((date + timedelta(1)).strftime("%y%m%d")),
+                date.weekday(),
+                (date.weekday() + 1) % 7,
+            ]
+            for date in dates
+        ],
+        dtype="int64",
+    ).reshape(len(dates), 4)
+
+    timetabled, scheduled = count_days_kernel(
+        identifier_codes[: len(calendar_df)].astype("int64"),
+        tiploc_codes.astype("int64"),
+        calendar_df["Flag"].map(FLAG_CODES).fillna(0).to_numpy(dtype="int8"),
+        calendar_df[WEEKDAYS].to_numpy() == "1",
+        calendar_df["Valid_from"].to_numpy().astype("int64"),
+        calendar_df["Valid_to"].to_numpy().astype("int64"),
+        calendar_df["Small_hours"].to_numpy() == 1,
+        core_start,
+        small_start,
+        core_start & (times <= "2359").to_numpy(),
+        small_start & (times >= "0000").to_numpy(),
+        identifier_codes[len(calendar_df) :].astype("int64"),
+        cancelled_df[WEEKDAYS].to_numpy() == "1",
+        cancelled_df["Valid_from"].to_numpy().astype("int64"),
+        cancelled_df["Valid_to"].to_numpy().astype("int64"),
+        day_dates,
+        identifier_codes.max(initial=-1) + 1,
+        len(tiplocs),
+    )
+    return np.asarray(tiplocs), timetabled, scheduled
@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.request import urlopen
+
+import click
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+from query_service import make_server
+
+
+def build_request_paths(store, no_requests: int, seed: int = 0):
+    """
+    Returns `no_requests` station and day query paths, drawn from stations
+    and dates in `store`, with a skew towards a few popular stations as seen
+    by the real service.
+    """
+    rng = random.Random(seed)
+
+    feed = store.feeds()[-1]
+    sample = store.day_summary(datetime.strptime(feed["start_date"], "%Y-%m-%d").date())
+    tiplocs = sample["TIPLOC"].tolist()
+    dates = [
+        str(date.date()) for date in pd.date_range(feed["start_date"], feed["end_date"])
+    ]
+    popular = tiplocs[: max(1, len(tiplocs) // 20)]
+
+    paths = []
+    for _ in range(no_requests):
+        roll = rng.random()
+        if roll < 0.6:
+            tiploc = rng.choice(popular if rng.random() < 0.8 else tiplocs)
+            start, end = sorted(rng.sample(dates, 2)) if len(dates) > 1 else dates * 2
+            paths.append(f"/stations/{tiploc}?from={start}&to={end}")
+        elif roll < 0.9:
+            paths.append(f"/day/{rng.choice(dates)}")
+        else:
+            paths.append(f"/day/{rng.choice(dates)}?bbox=london")
+    return paths
+
+
+def time_request(url: str):
+    """Returns the latency in ms of a GET to `url`, and the response size."""
+    t0 = time.perf_counter()
+    with urlopen(url) as response:
+        size = len(response.read())
+    return (time.perf_counter() - t0) * 1000, size
+
+
+@click.command()
+@click.argument("store_directory", default=os.getenv("DIR_OUTPUTS_HISTORY"))
+@click.option("--url", default=None, type=str)
+@click.option("--no_requests", default=2000, show_default=True, type=int)
+@click.option("--concurrency", default=8, show_default=True, type=int)
+@click.option("--seed", default=0, show_default=True, type=int)
+def main(store_directory: str, url: str, no_requests: int, concurrency: int, seed: int):
+    """
+    Load tests the query service, reporting p50/p99 latency and throughput.
+
+    Arguments:
+        store_directory -- Historical store to draw query stations and dates
+        from, and to serve in-process if `--url` is not given
+    """
+    logger = logging.getLogger(__name__)
+
+    store = HistoryStore(store_directory)
+    paths = build_request_paths(store, no_requests, seed)
+
+    server = None
+    if url is None:
+        server = make_server(store_directory, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    logger.info(f"Load testing {url} with {no_requests} requests")
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda path: time_request(url + path), paths))
+    elapsed = time.perf_counter() - t0
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    latencies = np.array([latency for latency, _ in results])
+    report = {
+        "requests": no_requests,
+        "concurrency": concurrency,
+        "requests_per_s": round(no_requests / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+        "mean_bytes": int(np.mean([size for _, size in results])),
+    }
+    logger.info(f"{report}")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
@@ -1,28 +1,96 @@
+import copy
 import logging
 import os
-import re
 from datetime import datetime
 
 import click
+import numpy as np
 import pandas as pd
 from pyprojroot import here
 
+from map_features import build_compact_features
+from map_layers import add_timestamped_geojson
+from profiling import StageProfiler, profile_report_path
 from utils import (
-    add_timestamped_geojson,
-    add_folium_times,
     build_base_map,
-    build_features,
     build_macro_legend_publication,
-    convert_to_gpdf,
+    COLOUR_SCALE,
+    hourly_profile_path,
+    read_disruption_summary,
+    read_hourly_profile,
     scale_col,
 )
 
 
+def parse_batch_entry(entry: str):
+    """
+    Parses a `--batch` entry, either a single DDMMYYYY date or a
+    DDMMYYYY-DDMMYYYY range, into a (start_date, end_date) tuple. end_date is
+    None for a single day.
+    """
+    if "-" in entry:
+        start, end = entry.split("-")
+        return (
+            datetime.strptime(start, "%d%m%Y").date(),
+            datetime.strptime(end, "%d%m%Y").date(),
+        )
+    return datetime.strptime(entry, "%d%m%Y").date(), None
+
+
+def build_publication_map(
+    df: pd.DataFrame,
+    base_map,
+    colour_scale: list,
+    scale_markers_on: str,
+    single_day_date=None,
+    hourly=None,
+):
+    """
+    Builds a publication visual for `df` on a copy of `base_map`. Single day
+    visuals (`single_day_date` set) are built without the time slider. The
+    tooltips chart movements by hour if an `hourly` profile is given.
+    """
+    logger = logging.getLogger(__name__)
+
+    df = df.copy()
+    df["radius"] = scale_col(df, scale_markers_on, 2, 12)
+    logger.info(
+        f'Scaled marker radius on column "{scale_markers_on}". '
+        f'Min marker radius: {df["radius"].min()}, '
+        f'Max marker radius: {df["radius"].max()}.'
+    )
+
+    # drop missing rows with no percentage data
+    df = df[~df["pct_timetabled_services_running"].isna()]
+
+    features = build_compact_features(df, hourly=hourly)
+    logger.info("Built features.")
+
+    m = copy.deepcopy(base_map)
+    m = add_timestamped_geojson(
+        m,
+        features,
+        compact=True,
+        colour_scale=colour_scale,
+        time_control=single_day_date is None,
+    )
+    logger.info("Added TimestampedGeoJson object to map.")
+
+    macro = build_macro_legend_publication(colour_scale, single_day_date)
+    m.get_root().add_child(macro)
+    logger.info("Legend macro built and added.")
+
+    return m
+
+
 @click.command()
 @click.option("--working_directory", default=None, type=str)
-@click.option("--csv_input_filename", default=None, type=str)
+@click.option(
+    "--input_filename", "--csv_input_filename", "input_filename", default=None, type=str
+)
 @click.option("--start_date", default=None, type=str)
 @click.option("--end_date", default=None, type=str)
+@click.option("--batch", default=None, type=str, multiple=True)
 @click.option("--scale_markers_on", default="journeys_timetabled", type=str)
 @click.option(
     "--measure_control", is_flag=True, show_default=False, default=False, type=bool
@@ -34,56 +102,82 @@ from utils import (
 @click.option(
     "--add_geocoder", is_flag=True, show_default=True, default=True, type=bool
 )
+@click.option("--profile", is_flag=True, show_default=False, default=False, type=bool)
+@click.option(
+    "--trace_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--profile_stage", default=None, type=str)
 def main(
     working_directory: str,
-    csv_input_filename: str,
+    input_filename: str,
     start_date: str,
     end_date: str,
+    batch: tuple,
     scale_markers_on: str,
     measure_control: bool,
     mini_map: bool,
     full_screen: bool,
     add_geocoder: bool,
+    profile: bool,
+    trace_memory: bool,
+    profile_stage: str,
 ):
     """
     Wraps production of timeseries data, and static visualisations for reports.
 
     Args:
         working_directory (str): Optional directory to build and save the map
-        csv_input_filename (str): Data to plot
+        input_filename (str): Data to plot, the parquet dataset (or csv export)
+            from `build_timetable.py`
         start_date (str): Beginning date of timeseries to plot
         end_date (str): End date of timeseries to plot
+        batch (tuple): Optional DDMMYYYY dates or DDMMYYYY-DDMMYYYY ranges to
+            build in one run, used instead of `start_date`/`end_date`
         scale_markers_on (str): The variable by which to scale point data
         measure_control (bool): Optional folium tool for measuring distance
         mini_map (bool): Optional minimap
         full_screen (bool): Optional fullscreen button
         add_geocoder (bool): Optional location search tool
+        profile (bool): Also write the time, resident memory and rows in and
+            out of each stage of the run to a JSON report beside the visuals
+            (see `profiling.py`)
+        trace_memory (bool): Also record the peak memory Python allocates in
+            each stage, with tracemalloc, which slows the run down, implies
+            `profile`
+        profile_stage (str): Also write cProfile stats of every run of the
+            named stage (e.g. "build_map") beside the report, implies `profile`
     """
     logger = logging.getLogger(__name__)
 
+    profiler = StageProfiler(
+        trace_memory=trace_memory,
+        enabled=profile or trace_memory or profile_stage is not None,
+        profile_stage=profile_stage,
+    )
+
     today_date = datetime.now().date().strftime("%Y%m%d")
 
-    if start_date is None:
-        # add one day so pipeline starts one day after dump day
-        start_date = datetime.now().date()  # .strftime("%Y%m%d")
-        logger.info(
-            f"Setting `start_date` to {start_date} automatically since the"
-            "optional argument was not set."
-        )
+    if batch:
+        publications = [parse_batch_entry(entry) for entry in batch]
+        logger.info(f"Building {len(publications)} visuals in batch: {list(batch)}")
     else:
-        start_date = datetime.strptime(start_date, "%d%m%Y").date()
+        if start_date is None:
+            # add one day so pipeline starts one day after dump day
+            start_date = datetime.now().date()  # .strftime("%Y%m%d")
+            logger.info(
+                f"Setting `start_date` to {start_date} automatically since the"
+                "optional argument was not set."
+            )
+        else:
+            start_date = datetime.strptime(start_date, "%d%m%Y").date()
 
-    if end_date is None:
-        single_day = True
-        logger.info(
-            f"Setting `single_day` to {single_day} - generating a single day vis."
-        )
-    else:
-        single_day = False
-        logger.info(
-            f"Setting `single_day` to {single_day} - generating a multi day vis."
-        )
-        end_date = datetime.strptime(end_date, "%d%m%Y").date()
+        if end_date is None:
+            logger.info("Setting `single_day` to True - generating a single day vis.")
+        else:
+            logger.info("Setting `single_day` to False - generating a multi day vis.")
+            end_date = datetime.strptime(end_date, "%d%m%Y").date()
+
+        publications = [(start_date, end_date)]
 
     # handle working directory
     if working_directory is None:
@@ -93,30 +187,35 @@ def main(
             " since the optional argument was not set."
         )
 
-    # handle csv name
-    if csv_input_filename is None:
-        csv_input_filename = (
-            f"full_uk_disruption_summary_multiday_start_{today_date}_30days.csv"
+    # handle input name
+    if input_filename is None:
+        input_filename = (
+            f"full_uk_disruption_summary_multiday_start_{today_date}_30days.parquet"
         )
         logger.info(
-            f"Setting `csv_input_filename` to {csv_input_filename} automatically"
+            f"Setting `input_filename` to {input_filename} automatically"
             " since the optional argument was not set."
         )
 
-    # get df from the csv
-    df_directory = os.path.join(working_directory, csv_input_filename)
-    df = pd.read_csv(df_directory, index_col=0)
-    logger.info(f"Opened {df_directory}")
+    # read only the days needed across all visuals
+    df_directory = os.path.join(working_directory, input_filename)
+    with profiler.stage("read") as record:
+        df = read_disruption_summary(
+            df_directory,
+            start_date=min(start for start, _ in publications),
+            end_date=max(end or start for start, end in publications),
+        )
+        logger.info(f"Opened {df_directory}")
 
-    # filter df to provided start/end dates
-    df["date_format"] = pd.to_datetime(df["date"], format="%Y-%m-%d").dt.date
-    if single_day:
-        df = df[df.date_format == start_date].copy()
-        logger.info(f"Filtered df to {start_date} only.")
-    else:
-        df = df[(df.date_format >= start_date) & (df.date_format <= end_date)].copy()
-        logger.info(f"Filtered df between {start_date} and {end_date} inclusive.")
-    df.drop(columns=["date_format"], inplace=True)
+        # hourly profile for the tooltips, if build_timetable wrote one
+        hourly = None
+        if os.path.exists(hourly_profile_path(df_directory)):
+            hourly = read_hourly_profile(hourly_profile_path(df_directory))
+            logger.info(f"Opened {hourly_profile_path(df_directory)}")
+        record["rows_out"] = len(df)
+
+    # index row positions by date once, so each visual slices its days
+    date_index = df.groupby("date").indices
 
     # share optional params status
     logger.info(
@@ -125,39 +224,9 @@ def main(
         f"`add_geocoder`: {add_geocoder}"
     )
 
-    gp_df = convert_to_gpdf(df, lat_col="Latitude", long_col="Longitude")
-    logger.info("Converted to a GeoPandas DataFrame.")
-
-    gp_df["times"] = gp_df.apply(add_folium_times, axis=1, args=["date"])
-    logger.info("Set and built folim `times` column.")
-
-    gp_df["radius"] = scale_col(gp_df, scale_markers_on, 2, 12)
-    logger.info(
-        f'Scaled marker radius on column "{scale_markers_on}". '
-        f'Min marker radius: {gp_df["radius"].min()}, '
-        f'Max marker radius: {gp_df["radius"].max()}.'
-    )
-
-    # drop missing rows with no percentage data
-    gp_df = gp_df[~gp_df["pct_timetabled_services_running"].isna()]
-
-    # categorical, sequential colour scale - BuRd
-    colour_scale = [
-        "#000000",
-        "#8b0000",
-        "#ff0000",
-        "#ff0066",
-        "#ff00cc",
-        "#cc00ff",
-        "#6600ff",
-        "#0000ff",
-    ]
-
-    features = build_features(gp_df, colour_scale=colour_scale)
-    logger.info("Built features.")
-
-    if single_day:
-        m = build_base_map(
+    # build each base map once, copied for every visual that uses it
+    with profiler.stage("base_maps"):
+        single_day_base_map = build_base_map(
             full_screen,
             mini_map,
             add_geocoder,
@@ -165,51 +234,74 @@ def main(
             publication=True,
             default_view="OSM",
         )
-    else:
-        m = build_base_map(
+        timeseries_base_map = build_base_map(
             full_screen, mini_map, add_geocoder, measure_control, publication=True
         )
-    logger.info("Built base map")
+    logger.info("Built base maps")
 
-    m = add_timestamped_geojson(m, features)
-    logger.info("Added TimestampedGeoJson object to map.")
+    for start_date, end_date in publications:
+        start_date_out = start_date.strftime("%Y%m%d")
 
-    if single_day:
-        macro = build_macro_legend_publication(colour_scale, start_date)
-    else:
-        macro = build_macro_legend_publication(colour_scale, None)
-    m.get_root().add_child(macro)
-    logger.info("Legend macro built and added.")
+        if end_date is None:
+            day_df = df.iloc[date_index.get(start_date, [])]
+            logger.info(f"Filtered df to {start_date} only.")
 
-    start_date_out = start_date.strftime("%Y%m%d")
-    if not single_day:
-        logger.info("Saving timeseries visual...")
-        end_date_out = end_date.strftime("%Y%m%d")
-        vis_filepath = os.path.join(
-            working_directory,
-            f"publication_timeseries_{start_date_out}_to_{end_date_out}.html",
-        )
-        m.save(vis_filepath)
-        logger.info(f"Timeseries visual saved {vis_filepath}")
-    else:
-        logger.info("Saving single day visual...")
+            with profiler.stage("build_map", date=start_date, rows_in=len(day_df)):
+                m = build_publication_map(
+                    day_df,
+                    single_day_base_map,
+                    COLOUR_SCALE,
+                    scale_markers_on,
+                    single_day_date=start_date,
+                    hourly=hourly,
+                )
 
-        vis_filepath = os.path.join(
-            working_directory,
-            f"publication_singleday_{start_date_out}.html",
-        )
-        m.save(vis_filepath)
+            logger.info("Saving single day visual...")
+            vis_filepath = os.path.join(
+                working_directory,
+                f"publication_singleday_{start_date_out}.html",
+            )
+            with profiler.stage("html_save", date=start_date) as record:
+                m.save(vis_filepath)
+                record["html_bytes"] = os.path.getsize(vis_filepath)
+            logger.info(f"Single day visual saved {vis_filepath}")
+        else:
+            positions = [
+                day_positions
+                for day, day_positions in sorted(date_index.items())
+                if start_date <= day <= end_date
+            ]
+            days_df = df.iloc[np.concatenate(positions) if positions else []]
+            logger.info(f"Filtered df between {start_date} and {end_date} inclusive.")
 
-        with open(vis_filepath, "r") as f:
-            lines_in = f.readlines()
-        lines_out = [
-            re.sub(
-                r"map_[a-zA-Z0-9]+.addControl\(this.timeDimensionControl\);", "", line
+            with profiler.stage(
+                "build_map", date=start_date, end_date=end_date, rows_in=len(days_df)
+            ):
+                m = build_publication_map(
+                    days_df,
+                    timeseries_base_map,
+                    COLOUR_SCALE,
+                    scale_markers_on,
+                    hourly=hourly,
+                )
+
+            logger.info("Saving timeseries visual...")
+            end_date_out = end_date.strftime("%Y%m%d")
+            vis_filepath = os.path.join(
+                working_directory,
+                f"publication_timeseries_{start_date_out}_to_{end_date_out}.html",
             )
-            for line in lines_in
-        ]
-        with open(vis_filepath, "w") as f:
-            f.writelines(lines_out)
+            with profiler.stage("html_save", date=start_date) as record:
+                m.save(vis_filepath)
+                record["html_bytes"] = os.path.getsize(vis_filepath)
+            logger.info(f"Timeseries visual saved {vis_filepath}")
+
+    profiler.write_report(
+        profile_report_path(
+            os.path.join(working_directory, today_date), "make_publications"
+        ),
+        publications=[list(publication) for publication in publications],
+    )
 
     logger.info("Make publications complete!")
 
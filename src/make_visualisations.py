@@ -3,26 +3,223 @@ import os
 from datetime import datetime
 
 import click
-import pandas as pd
 from pyprojroot import here
 
+from map_features import build_compact_edge_features, build_compact_features
+from map_layers import add_lazy_timestamped_geojson, add_timestamped_geojson
+from profiling import StageProfiler, profile_report_path
+from raster_maps import build_raster_visuals, hash_view_tiles
+from static_maps import build_static_visuals
 from utils import (
     add_build_date,
-    add_timestamped_geojson,
-    add_folium_times,
     add_logo,
     build_base_map,
-    build_features,
     build_legend_macro,
-    build_static_visual,
-    convert_to_gpdf,
+    COLOUR_BINS,
+    COLOUR_SCALE,
+    hash_render_code,
+    hash_render_inputs,
+    hourly_profile_path,
+    read_disruption_summary,
+    read_hourly_profile,
+    REGION_BBOXES,
+    RenderCache,
     scale_col,
+    station_edges_path,
 )
 
 
+def add_map_furniture(m):
+    """
+    Adds the logo, build date and legend to a timeseries map.
+    """
+    logger = logging.getLogger(__name__)
+
+    m = add_logo(m)
+    logger.info("Added logo to map.")
+
+    m = add_build_date(m)
+    logger.info("Added build date to map.")
+
+    macro = build_legend_macro()
+    m.get_root().add_child(macro)
+    logger.info("Legend macro built and added.")
+
+    return m
+
+
+def read_inputs(df_directory, edge_layer=False):
+    """
+    Reads the `build_timetable.py` summary at `df_directory`, with the
+    hourly profile written beside it, if any, and, with `edge_layer`, the
+    station pair counts. Returns the summary, the hourly profile and the
+    station pairs, None where not read.
+    """
+    logger = logging.getLogger(__name__)
+
+    df = read_disruption_summary(df_directory)
+    logger.info(f"Opened {df_directory}")
+
+    # hourly profile for the tooltips, if build_timetable wrote one
+    hourly = None
+    if os.path.exists(hourly_profile_path(df_directory)):
+        hourly = read_hourly_profile(hourly_profile_path(df_directory))
+        logger.info(f"Opened {hourly_profile_path(df_directory)}")
+
+    # station pair counts for the edge layer
+    edges_df = None
+    if edge_layer:
+        if os.path.exists(station_edges_path(df_directory)):
+            edges_df = read_disruption_summary(station_edges_path(df_directory))
+            logger.info(f"Opened {station_edges_path(df_directory)}")
+        else:
+            logger.warning(
+                f"No station pair counts at {station_edges_path(df_directory)}, "
+                "building without the edge layer."
+            )
+
+    return df, hourly, edges_df
+
+
+def build_map_features(df, scale_markers_on, hourly=None, edges_df=None):
+    """
+    Builds the compact map features of the stations in `df` with percentage
+    data, with markers scaled on `scale_markers_on` and any `hourly`
+    profile, drawn over the lines between station pairs in `edges_df`, if
+    given. Returns the stations plotted, with their marker radius, and the
+    features.
+    """
+    logger = logging.getLogger(__name__)
+
+    df["radius"] = scale_col(df, scale_markers_on, 2, 12)
+    logger.info(
+        f'Scaled marker radius on column "{scale_markers_on}". '
+        f'Min marker radius: {df["radius"].min()}, '
+        f'Max marker radius: {df["radius"].max()}.'
+    )
+
+    # drop missing rows with no percentage data
+    df = df[~df["pct_timetabled_services_running"].isna()]
+
+    features = build_compact_features(df, hourly=hourly)
+    logger.info("Built features.")
+
+    if edges_df is not None:
+        # first, so the station markers are drawn over the lines
+        features = build_compact_edge_features(edges_df, df) + features
+        logger.info("Built station pair features.")
+
+    return df, features
+
+
+def render_static_visuals(
+    working_directory,
+    date,
+    df,
+    features,
+    m,
+    static_renderer,
+    tile_cache,
+    static_workers,
+    sidecar,
+    base_map_options,
+):
+    """
+    Saves the GB and `REGION_BBOXES` static visuals of the map `m`, drawn
+    by `static_renderer`: "raster" from the first day of `df` onto tiles
+    from `tile_cache`, or "browser" by screenshotting `m`, rebuilt from
+    `features` with `base_map_options` (see `build_base_map`) if the map
+    loads `sidecar` data. Returns the seconds taken to render each place.
+    """
+    logger = logging.getLogger(__name__)
+
+    if static_renderer == "raster":
+        logger.info(
+            f"Building GB and {', '.join(REGION_BBOXES)} static visuals from "
+            f"tile cache {tile_cache}..."
+        )
+        return build_raster_visuals(
+            working_directory,
+            date,
+            df[df["date"] == df["date"].min()],
+            tile_cache,
+            REGION_BBOXES,
+        )
+
+    if sidecar:
+        # static renders open the html from a temp file, which cannot fetch
+        # the sidecar data, so inline the first day (the day they display)
+        first_day = min(f["properties"]["times"][0] for f in features)
+        m = build_base_map(*base_map_options)
+        m = add_timestamped_geojson(
+            m,
+            [f for f in features if f["properties"]["times"][0] == first_day],
+            compact=True,
+        )
+        m = add_map_furniture(m)
+        logger.info(f"Rebuilt map with {first_day} inline for static visuals.")
+
+    logger.info(
+        f"Building GB and {', '.join(REGION_BBOXES)} static visuals with "
+        f"{static_workers} browser session(s)..."
+    )
+    return build_static_visuals(
+        working_directory, date, m, REGION_BBOXES, workers=static_workers
+    )
+
+
+def lookup_render_cache(
+    render_cache, artefacts, df, options, hourly=None, edges_df=None, tile_cache=None
+):
+    """
+    Restores the render cache entry for `df` (with its `hourly` profile and
+    `edges_df` station pairs) rendered today with `options`, the colours
+    and views, the rendering code and, for the raster renderer, the tiles in
+    `tile_cache`, copying each of `artefacts` into place on a hit.
+    Returns the `RenderCache` (None if `render_cache` is not set), the key
+    and whether it hit.
+    """
+    logger = logging.getLogger(__name__)
+
+    if render_cache is None:
+        return None, None, False
+
+    cache = RenderCache(render_cache)
+    cache_key = hash_render_inputs(
+        df,
+        {
+            **options,
+            "colour_scale": COLOUR_SCALE,
+            "colour_bins": COLOUR_BINS,
+            "bboxes": REGION_BBOXES,
+            "edges": None if edges_df is None else hash_render_inputs(edges_df, {}),
+            "code": hash_render_code(),
+            # the html and pngs carry the `add_build_date` stamp of this day
+            "build_date": str(datetime.now().date()),
+            "tiles": (
+                None
+                if tile_cache is None
+                else hash_view_tiles(tile_cache, REGION_BBOXES)
+            ),
+        },
+        hourly,
+    )
+    if cache.restore(cache_key, artefacts):
+        logger.info(
+            f"Render cache hit ({cache_key[:12]}), reused html and static "
+            f"visuals from {render_cache}."
+        )
+        return cache, cache_key, True
+
+    logger.info(f"Render cache miss ({cache_key[:12]}), building visuals.")
+    return cache, cache_key, False
+
+
 @click.command()
 @click.option("--working_directory", default=None, type=str)
-@click.option("--csv_input_filename", default=None, type=str)
+@click.option(
+    "--input_filename", "--csv_input_filename", "input_filename", default=None, type=str
+)
 @click.option("--start_date", default=None, type=str)
 @click.option("--no_days", default=30, type=int)
 @click.option("--scale_markers_on", default="journeys_timetabled", type=str)
@@ -34,9 +231,34 @@ from utils import (
 @click.option(
     "--add_geocoder", is_flag=True, show_default=True, default=True, type=bool
 )
+@click.option(
+    "--sidecar_chunks",
+    default="none",
+    show_default=True,
+    type=click.Choice(["none", "day", "week"]),
+)
+@click.option("--static_workers", default=1, show_default=True, type=int)
+@click.option(
+    "--static_renderer",
+    default="browser",
+    show_default=True,
+    type=click.Choice(["browser", "raster"]),
+)
+@click.option("--tile_cache", default=os.getenv("DIR_DATA_EXTERNAL_TILES"), type=str)
+@click.option("--render_cache", default=os.getenv("DIR_OUTPUTS_RENDER_CACHE"), type=str)
+@click.option("--render_cache_max_entries", default=30, show_default=True, type=int)
+@click.option("--render_cache_max_age_days", default=None, type=int)
+@click.option(
+    "--edge_layer", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--profile", is_flag=True, show_default=False, default=False, type=bool)
+@click.option(
+    "--trace_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--profile_stage", default=None, type=str)
 def main(
     working_directory: str,
-    csv_input_filename: str,
+    input_filename: str,
     start_date: str,
     no_days: int,
     scale_markers_on: str,
@@ -44,13 +266,25 @@ def main(
     mini_map: bool,
     full_screen: bool,
     add_geocoder: bool,
+    sidecar_chunks: str,
+    static_workers: int,
+    static_renderer: str,
+    tile_cache: str,
+    render_cache: str,
+    render_cache_max_entries: int,
+    render_cache_max_age_days: int,
+    edge_layer: bool,
+    profile: bool,
+    trace_memory: bool,
+    profile_stage: str,
 ):
     """
     Wraps the construction of the main interactive visualisation using folium.
 
     Args:
         working_directory (str): Optional directory to build and save the map
-        csv_input_filename (str): Data file to plot
+        input_filename (str): Data file to plot, the parquet dataset (or csv
+            export) from `build_timetable.py`
         start_date (str): Beginning date of timeseries to plot
         no_days (int): Number of days to plot for
         scale_markers_on (str): The variable by which to scale point data
@@ -58,9 +292,45 @@ def main(
         mini_map (bool): Optional minimap
         full_screen (bool): Optional fullscreen button
         add_geocoder (bool): Optional location search tool
+        sidecar_chunks (str): If "day" or "week", write the map data to gzipped
+            GeoJSON files alongside the html, fetched by the page as the time
+            slider reaches them, rather than inlining every day
+        static_workers (int): Number of headless browser sessions to render the
+            static images with in parallel
+        static_renderer (str): "browser" to screenshot the map in headless
+            firefox, or "raster" to draw the static images directly onto
+            basemap tiles from `tile_cache`, with no browser or network
+        tile_cache (str): XYZ tile directory or .mbtiles file for the raster
+            renderer, seeded with `raster_maps.py`
+        render_cache (str): Optional directory to cache the html and pngs in,
+            keyed by the input data and render options, and reuse them from
+            when both are unchanged
+        render_cache_max_entries (int): Most render cache entries to keep, the
+            least recently used are deleted after each run that stores one
+        render_cache_max_age_days (int): Optionally also delete render cache
+            entries not used for this many days
+        edge_layer (bool): Also draw lines between consecutive stations,
+            coloured by the percentage of services running between them, from
+            the station pair counts written by `build_timetable.py
+            --station_pairs`
+        profile (bool): Also write the time, resident memory and rows in and
+            out of each stage of the run to a JSON report beside the html
+            (see `profiling.py`)
+        trace_memory (bool): Also record the peak memory Python allocates in
+            each stage, with tracemalloc, which slows the run down, implies
+            `profile`
+        profile_stage (str): Also write cProfile stats of the named stage
+            (e.g. "features" or "static_visuals") beside the report, implies
+            `profile`
     """
     logger = logging.getLogger(__name__)
 
+    profiler = StageProfiler(
+        trace_memory=trace_memory,
+        enabled=profile or trace_memory or profile_stage is not None,
+        profile_stage=profile_stage,
+    )
+
     date = datetime.now().date().strftime("%Y%m%d")
 
     if start_date is None:
@@ -81,109 +351,128 @@ def main(
             " since the optional argument was not set."
         )
 
-    # handle csv name
-    if csv_input_filename is None:
-        csv_input_filename = (
-            f"full_uk_disruption_summary_multiday_start_{date}_{no_days}days.csv"
+    # handle input name
+    if input_filename is None:
+        input_filename = (
+            f"full_uk_disruption_summary_multiday_start_{date}_{no_days}days.parquet"
         )
         logger.info(
-            f"Setting `csv_input_filename` to {csv_input_filename} automatically"
+            f"Setting `input_filename` to {input_filename} automatically"
             " since the optional argument was not set."
         )
 
-    # get df from the csv
-    df_directory = os.path.join(working_directory, csv_input_filename)
-    df = pd.read_csv(df_directory, index_col=0)
-    logger.info(f"Opened {df_directory}")
+    # get df from the build_timetable output
+    df_directory = os.path.join(working_directory, input_filename)
+    with profiler.stage("read") as record:
+        df, hourly, edges_df = read_inputs(df_directory, edge_layer)
+        record["rows_out"] = len(df)
 
-    # share optional params status
-    logger.info(
-        f"Building with `measure_control`: {measure_control}, "
-        f"`mini_map`: {mini_map}, `full_screen`: {full_screen}, and "
-        f"`add_geocoder`: {add_geocoder}"
+    vis_filepath = os.path.join(
+        working_directory,
+        f"{os.path.splitext(input_filename)[0]}.html",
     )
+    data_folder = vis_filepath.replace(".html", "_data")
 
-    gp_df = convert_to_gpdf(df, lat_col="Latitude", long_col="Longitude")
-    logger.info("Converted to a GeoPandas DataFrame.")
+    # every artefact this run writes, by name in the render cache
+    artefacts = {"map.html": vis_filepath}
+    if sidecar_chunks != "none":
+        artefacts["map_data"] = data_folder
+    for place in ["GB", *REGION_BBOXES]:
+        artefacts[f"{place}.png"] = os.path.join(
+            working_directory, f"full_uk_disruption_summary_{date}_{place}.png"
+        )
 
-    gp_df["times"] = gp_df.apply(add_folium_times, axis=1, args=["date"])
-    logger.info("Set and built folim `times` column.")
+    cache, cache_key, cache_hit = lookup_render_cache(
+        render_cache,
+        artefacts,
+        df,
+        {
+            "scale_markers_on": scale_markers_on,
+            "measure_control": measure_control,
+            "mini_map": mini_map,
+            "full_screen": full_screen,
+            "add_geocoder": add_geocoder,
+            "sidecar_chunks": sidecar_chunks,
+            "data_url": os.path.basename(data_folder),
+            "static_renderer": static_renderer,
+        },
+        hourly,
+        edges_df,
+        tile_cache if static_renderer == "raster" else None,
+    )
+    if cache_hit:
+        profiler.write_report(
+            profile_report_path(vis_filepath, "make_visualisations"),
+            render_cache_hit=True,
+        )
+        logger.info("Make visualisations completed!")
+        return None
 
-    gp_df["radius"] = scale_col(gp_df, scale_markers_on, 2, 12)
+    # share optional params status
     logger.info(
-        f'Scaled marker radius on column "{scale_markers_on}". '
-        f'Min marker radius: {gp_df["radius"].min()}, '
-        f'Max marker radius: {gp_df["radius"].max()}.'
+        f"Building with `measure_control`: {measure_control}, "
+        f"`mini_map`: {mini_map}, `full_screen`: {full_screen}, and "
+        f"`add_geocoder`: {add_geocoder}"
     )
 
-    # drop missing rows with no percentage data
-    gp_df = gp_df[~gp_df["pct_timetabled_services_running"].isna()]
+    with profiler.stage("features", rows_in=len(df)) as record:
+        df, features = build_map_features(df, scale_markers_on, hourly, edges_df)
+        record["rows_out"] = len(features)
 
-    features = build_features(gp_df)
-    logger.info("Built features.")
-
-    m = build_base_map(full_screen, mini_map, add_geocoder, measure_control)
-    logger.info("Built base map")
+    with profiler.stage("map_build", rows_in=len(features)):
+        m = build_base_map(full_screen, mini_map, add_geocoder, measure_control)
+        logger.info("Built base map")
 
-    m = add_timestamped_geojson(m, features)
-    logger.info("Added TimestampedGeoJson object to map.")
-
-    m = add_logo(m)
-    logger.info("Added logo to map.")
-
-    m = add_build_date(m)
-    logger.info("Added build date to map.")
+        if sidecar_chunks == "none":
+            m = add_timestamped_geojson(m, features, compact=True)
+            logger.info("Added TimestampedGeoJson object to map.")
+        else:
+            m = add_lazy_timestamped_geojson(
+                m,
+                features,
+                data_folder,
+                os.path.basename(data_folder),
+                period=sidecar_chunks,
+            )
+            logger.info(
+                f"Added lazy loading GeoJSON layer, data written to {data_folder} "
+                f"in {sidecar_chunks} chunks."
+            )
 
-    macro = build_legend_macro()
-    m.get_root().add_child(macro)
-    logger.info("Legend macro built and added.")
+        m = add_map_furniture(m)
 
     logger.info("Saving timeseries visual...")
-    vis_filepath = os.path.join(
-        working_directory,
-        csv_input_filename.replace(".csv", ".html"),
-    )
-    m.save(vis_filepath)
+    with profiler.stage("html_save") as record:
+        m.save(vis_filepath)
+        record["html_bytes"] = os.path.getsize(vis_filepath)
     logger.info(f"Timeseries visual saved {vis_filepath}")
 
-    logger.info("Building GB static visual...")
-    gb_bbox_html = m.get_root().render()
-    build_static_visual(working_directory, date, "GB", m)
-    del gb_bbox_html
-    logger.info("Built GB static visual.")
+    with profiler.stage("static_visuals", renderer=static_renderer) as record:
+        render_seconds = render_static_visuals(
+            working_directory,
+            date,
+            df,
+            features,
+            m,
+            static_renderer,
+            tile_cache,
+            static_workers,
+            sidecar_chunks != "none",
+            (full_screen, mini_map, add_geocoder, measure_control),
+        )
+        record["renders"] = render_seconds
+    logger.info("Built static visuals.")
 
-    bboxes = {
-        "london": {
-            "bbox": [(51.312, -0.597), (51.659, 0.271)],
-            "padding": (-50, -50),
-        },
-        "midlands": {
-            "bbox": [(52.0564, -2.7160), (52.6369, -1.1398)],
-            "padding": (-60, -60),
-        },
-        "northwest": {
-            "bbox": [(53.1839, -3.4250), (53.9614, -1.0739)],
-            "padding": (-80, -80),
-        },
-        "northengland": {
-            "bbox": [(54.4035, -3.2326), (55.0393, 0)],
-            "padding": (-50, -50),
-        },
-        "scotland": {
-            "bbox": [(55.6800, -4.5136), (56.1745, -3.0308)],
-            "padding": (-30, -30),
-        },
-        "southwales": {
-            "bbox": [(51.196675, -4.727855), (52.001908, -2.111735)],
-            "padding": (-90, -90),
-        },
-    }
+    if cache is not None:
+        cache.store(cache_key, artefacts)
+        logger.info(f"Stored visuals in render cache ({cache_key[:12]}).")
+        pruned = cache.prune(render_cache_max_entries, render_cache_max_age_days)
+        logger.info(f"Pruned {len(pruned)} entries from the render cache.")
 
-    for place in bboxes.keys():
-        logger.info(f"Building {place} static visual...")
-        m.fit_bounds(bboxes[place]["bbox"], padding=bboxes[place]["padding"])
-        build_static_visual(working_directory, date, place, m)
-        logger.info(f"Built {place} static visual.")
+    profiler.write_report(
+        profile_report_path(vis_filepath, "make_visualisations"),
+        render_cache_hit=False,
+    )
 
     logger.info("Make visualisations completed!")
 
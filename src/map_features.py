@@ -0,0 +1,223 @@
+import json
+
+import numpy as np
+
+from utils import (
+    get_colour_indices,
+    get_colours,
+    lookup_hourly_profiles,
+    write_tooltip,
+)
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the standard library encoder
+    orjson = None
+
+
+def build_features(df, colour_scale=None, times_col="date", radius_col="radius"):
+    """
+    Utility function creates a geojson features structure out of a
+    DataFrame, working column-wise on the coordinate and value arrays rather
+    than row by row.
+    """
+    n_rows = len(df)
+    if n_rows == 0:
+        return []
+
+    times = df[times_col].astype(str).tolist()
+    lons = df["Longitude"].to_numpy(dtype="float64").tolist()
+    lats = df["Latitude"].to_numpy(dtype="float64").tolist()
+    radii = df[radius_col].to_numpy(dtype="float64").tolist()
+    pcts = df["pct_timetabled_services_running"].to_numpy(dtype="float64")
+    colours = get_colours(pcts, colour_scale=colour_scale).tolist()
+
+    tooltips = [
+        write_tooltip(name, time, tiploc, scheduled, timetabled, pct)
+        for name, time, tiploc, scheduled, timetabled, pct in zip(
+            df["Station_Name"].tolist(),
+            times,
+            df["TIPLOC"].tolist(),
+            df["journeys_scheduled"].tolist(),
+            df["journeys_timetabled"].tolist(),
+            pcts.tolist(),
+        )
+    ]
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {
+                "times": [time],
+                "popup": tooltip,
+                "style": {"color": ""},
+                "icon": "circle",
+                "iconstyle": {
+                    "fillColor": colour,
+                    "fillOpacity": 0.5,
+                    "radius": radius,
+                },
+            },
+        }
+        for lon, lat, time, tooltip, colour, radius in zip(
+            lons, lats, times, tooltips, colours, radii
+        )
+    ]
+
+    return features
+
+
+def build_compact_features(df, times_col="date", radius_col="radius", hourly=None):
+    """
+    Builds the same point features as `build_features`, but with short
+    numeric properties in place of the embedded tooltip HTML and marker
+    styles. For use with `CompactTimestampedGeoJson`, which renders both
+    client-side. If an `hourly` profile (see `read_hourly_profile`) is given,
+    each feature also carries its hourly journeys timetabled and scheduled,
+    shown as a chart in the tooltip.
+    """
+    if len(df) == 0:
+        return []
+
+    pcts = df["pct_timetabled_services_running"].to_numpy(dtype="float64")
+
+    # tooltip shows 1 d.p., colour uses the full precision value
+    colour_idx = get_colour_indices(pcts)
+
+    # property columns, in the order the client reads them
+    columns = {
+        "n": df["Station_Name"].tolist(),
+        "t": df["TIPLOC"].tolist(),
+        "s": np.rint(df["journeys_scheduled"].to_numpy(dtype="float64"))
+        .astype("int64")
+        .tolist(),
+        "tt": np.rint(df["journeys_timetabled"].to_numpy(dtype="float64"))
+        .astype("int64")
+        .tolist(),
+        "p": [float(f"{pct:.1f}") for pct in pcts.tolist()],
+        "c": colour_idx.tolist(),
+        "r": np.round(df[radius_col].to_numpy(dtype="float64"), 2).tolist(),
+    }
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"times": [time], **dict(zip(columns, values))},
+        }
+        for lon, lat, time, *values in zip(
+            df["Longitude"].to_numpy(dtype="float64").tolist(),
+            df["Latitude"].to_numpy(dtype="float64").tolist(),
+            df[times_col].astype(str).tolist(),
+            *columns.values(),
+        )
+    ]
+
+    if hourly is not None:
+        timetabled, scheduled, found = lookup_hourly_profiles(df, hourly, times_col)
+        for feature, hour_tt, hour_s, is_found in zip(
+            features, timetabled.tolist(), scheduled.tolist(), found.tolist()
+        ):
+            if is_found:
+                feature["properties"]["ht"] = hour_tt
+                feature["properties"]["hs"] = hour_s
+
+    return features
+
+
+def build_compact_edge_features(edges_df, stations_df, times_col="date"):
+    """
+    Builds line features between station pairs from a `build_edge_summary`
+    frame, for drawing beneath the station points of `build_compact_features`
+    on the same layer. Lines are coloured on the percentage of services
+    running between the pair, with the same colour indices as the points,
+    and weighted on the journeys timetabled. Station names and coordinates
+    are taken from `stations_df`, and pairs with a station missing from it
+    are dropped.
+    """
+    stations = (
+        stations_df[["TIPLOC", "Station_Name", "Latitude", "Longitude"]]
+        .drop_duplicates("TIPLOC")
+        .set_index("TIPLOC")
+    )
+    edges_df = edges_df[
+        edges_df["from_TIPLOC"].astype(str).isin(stations.index)
+        & edges_df["to_TIPLOC"].astype(str).isin(stations.index)
+        & (edges_df["journeys_timetabled"] > 0)
+    ]
+    if len(edges_df) == 0:
+        return []
+
+    ends = [
+        stations.loc[edges_df[col].astype(str).to_numpy()]
+        for col in ["from_TIPLOC", "to_TIPLOC"]
+    ]
+    pcts = edges_df["pct_timetabled_services_running"].to_numpy(dtype="float64")
+    colour_idx = get_colour_indices(pcts)
+
+    timetabled = edges_df["journeys_timetabled"].to_numpy(dtype="int64")
+    weights = 1 + 5 * np.sqrt(timetabled / timetabled.max())
+
+    lines = [
+        [[from_lon, from_lat], [to_lon, to_lat]]
+        for from_lon, from_lat, to_lon, to_lat in zip(
+            ends[0]["Longitude"].to_numpy(dtype="float64").tolist(),
+            ends[0]["Latitude"].to_numpy(dtype="float64").tolist(),
+            ends[1]["Longitude"].to_numpy(dtype="float64").tolist(),
+            ends[1]["Latitude"].to_numpy(dtype="float64").tolist(),
+        )
+    ]
+
+    # property columns, in the order the client reads them
+    columns = {
+        "e": [
+            f"{from_name} - {to_name}"
+            for from_name, to_name in zip(
+                ends[0]["Station_Name"].tolist(), ends[1]["Station_Name"].tolist()
+            )
+        ],
+        "s": edges_df["journeys_scheduled"].to_numpy(dtype="int64").tolist(),
+        "tt": timetabled.tolist(),
+        "p": [float(f"{pct:.1f}") for pct in pcts.tolist()],
+        "c": colour_idx.tolist(),
+        "w": np.round(weights, 1).tolist(),
+    }
+
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": line},
+            "properties": {"times": [time], **dict(zip(columns, values))},
+        }
+        for line, time, *values in zip(
+            lines, edges_df[times_col].astype(str).tolist(), *columns.values()
+        )
+    ]
+
+
+def dumps_json(obj):
+    """
+    Serialises `obj` to a compact JSON string, using orjson when installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def get_features_bounds(features):
+    """
+    Returns [[lat_min, lon_min], [lat_max, lon_max]] for the point features
+    in a list of features, as expected by `folium.Map.fit_bounds`.
+    """
+    coords = np.array(
+        [
+            f["geometry"]["coordinates"]
+            for f in features
+            if f["geometry"]["type"] == "Point"
+        ],
+        dtype=float,
+    )
+    lon_min, lat_min = coords.min(axis=0)
+    lon_max, lat_max = coords.max(axis=0)
+    return [[float(lat_min), float(lon_min)], [float(lat_max), float(lon_max)]]
@@ -0,0 +1,448 @@
+import gzip
+import os
+from datetime import datetime, timedelta
+
+from branca.element import Template
+from folium.plugins import TimestampedGeoJson
+
+from map_features import dumps_json, get_features_bounds
+from utils import COLOUR_SCALE
+
+
+# jinja snippets shared by the compact and lazy-loading layers below, which
+# both draw markers and tooltips from `build_compact_features` properties
+COMPACT_FEATURE_HEADER = """
+        {% macro header(this, kwargs) %}
+            <style>
+            .rr-tooltip-title {margin-bottom: 10px; width: 200px;}
+            .rr-tooltip {height: 125px; width: 300px;}
+            .rr-tooltip td.rr-key {background-color: #0F8243; color: #ffffff;}
+            .rr-tooltip td.rr-val {width: 150px; background-color: #EAEAEA;}
+            .rr-hourly {margin-top: 10px;}
+            .rr-hourly text {font-size: 9px; fill: #555555;}
+            </style>
+        {% endmacro %}
+"""
+
+
+COMPACT_FEATURE_SCRIPT = """
+            L.Control.TimeDimensionCustom = L.Control.TimeDimension.extend({
+                _getDisplayDateFormat: function(date){
+                    var newdate = new moment(date);
+                    return newdate.format({{ this.date_options|tojson }});
+                }
+            });
+            var timeDimensionControl = new L.Control.TimeDimensionCustom(
+                {{ this.control_options|tojson }}
+            );
+
+            var {{ this.get_name() }}_colours = {{ this.colour_scale|tojson }};
+
+            function {{ this.get_name() }}_tooltip(p) {
+                var row = function(key, val) {
+                    return '<tr><td class="rr-key">' + key + '</td>'
+                        + '<td class="rr-val">' + val + '</td></tr>';
+                };
+                // station pair lines, see `build_compact_edge_features`
+                if (p.e) {
+                    return '<h4 class="rr-tooltip-title">' + p.e + '</h4>'
+                        + '<table class="rr-tooltip"><tbody>'
+                        + row('Day (YYYY-MM-DD)', p.times[0])
+                        + row('No. Scheduled Services', p.s)
+                        + row('No. Timetabled Services', p.tt)
+                        + row('Proportion Scheduled', p.p.toFixed(1) + '%')
+                        + '</tbody></table>';
+                }
+                return '<h4 class="rr-tooltip-title">' + p.n + '</h4>'
+                    + '<table class="rr-tooltip"><tbody>'
+                    + row('Day (YYYY-MM-DD)', p.times[0])
+                    + row('TIPLOC Code', p.t)
+                    + row('No. Scheduled Movements', p.s)
+                    + row('No. Timetabled Movements', p.tt)
+                    + row('Proportion Scheduled', p.p.toFixed(1) + '%')
+                    + '</tbody></table>'
+                    + (p.hs ? {{ this.get_name() }}_hourly(p) : '');
+            }
+
+            // bars of movements timetabled (grey) and scheduled (green) by hour
+            function {{ this.get_name() }}_hourly(p) {
+                var max = Math.max(1, Math.max.apply(null, p.ht.concat(p.hs)));
+                var bars = '';
+                for (var h = 0; h < 24; h++) {
+                    var tt = 50 * p.ht[h] / max, s = 50 * p.hs[h] / max;
+                    bars += '<rect x="' + (h * 12 + 1) + '" y="' + (50 - tt)
+                        + '" width="10" height="' + tt + '" fill="#C8C8C8"/>'
+                        + '<rect x="' + (h * 12 + 3) + '" y="' + (50 - s)
+                        + '" width="6" height="' + s + '" fill="#0F8243"/>';
+                    if (h % 6 == 0) {
+                        bars += '<text x="' + (h * 12) + '" y="62">'
+                            + ('0' + h).slice(-2) + ':00</text>';
+                    }
+                }
+                return '<svg class="rr-hourly" width="288" height="64">'
+                    + '<title>Movements by hour, timetabled (grey) and '
+                    + 'scheduled (green)</title>' + bars + '</svg>';
+            }
+
+            var {{ this.get_name() }}_options = {
+                pointToLayer: function (feature, latLng) {
+                    var p = feature.properties;
+                    return new L.circleMarker(latLng, {
+                        fillColor: {{ this.get_name() }}_colours[p.c],
+                        fillOpacity: 0.5,
+                        radius: p.r
+                    });
+                },
+                style: function (feature) {
+                    var p = feature.properties;
+                    if (feature.geometry.type == "LineString") {
+                        return {
+                            color: {{ this.get_name() }}_colours[p.c],
+                            opacity: 0.6,
+                            weight: p.w
+                        };
+                    }
+                    return {color: ""};
+                },
+                onEachFeature: function(feature, layer) {
+                    // built on first open, not for every feature up front
+                    layer.bindPopup(function () {
+                        return {{ this.get_name() }}_tooltip(feature.properties);
+                    });
+                }
+            };
+"""
+
+
+class CompactTimestampedGeoJson(TimestampedGeoJson):
+    """
+    Variant of folium's TimestampedGeoJson for features built by
+    `build_compact_features`. Marker styles and the tooltip table are
+    rendered in the browser from one shared template, rather than being
+    embedded as HTML in every feature.
+    The tooltip content and styling match `write_tooltip`.
+    Set `time_control` False to leave out the time slider, e.g. for single
+    day maps.
+    """
+
+    _template = Template(
+        COMPACT_FEATURE_HEADER
+        + """
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}.timeDimension = L.timeDimension(
+                {
+                    period: {{ this.period|tojson }},
+                }
+            );
+"""
+        + COMPACT_FEATURE_SCRIPT
+        + """
+            {% if this.time_control %}
+            {{ this._parent.get_name() }}.addControl(this.timeDimensionControl);
+            {% endif %}
+
+            var geoJsonLayer = L.geoJson(
+                {{ this.data }}, {{ this.get_name() }}_options
+            );
+
+            var {{ this.get_name() }} = L.timeDimension.layer.geoJson(
+                geoJsonLayer,
+                {
+                    updateTimeDimension: true,
+                    addlastPoint: {{ this.add_last_point|tojson }},
+                    duration: {{ this.duration }},
+                }
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        data,
+        colour_scale=None,
+        transition_time=200,
+        auto_play=True,
+        period="P1D",
+        max_speed=10,
+        date_options="YYYY-MM-DD HH:mm:ss",
+        duration=None,
+        time_control=True,
+    ):
+        super().__init__(
+            data,
+            transition_time=transition_time,
+            auto_play=auto_play,
+            period=period,
+            max_speed=max_speed,
+            date_options=date_options,
+            duration=duration,
+        )
+        if colour_scale is None:
+            colour_scale = COLOUR_SCALE
+
+        self.time_control = time_control
+
+        # index 8 (grey) marks a missing percentage, as in `get_colours`
+        self.colour_scale = list(colour_scale[:8]) + ["#808080"]
+        self.control_options = {
+            "position": "bottomleft",
+            "minSpeed": 0.1,
+            "maxSpeed": max_speed,
+            "autoPlay": auto_play,
+            "loopButton": False,
+            "timeSliderDragUpdate": False,
+            "speedSlider": True,
+            "playerOptions": {
+                "transitionTime": int(transition_time),
+                "loop": True,
+                "startOver": True,
+            },
+        }
+
+
+class LazyTimestampedGeoJson(CompactTimestampedGeoJson):
+    """
+    Time-slider layer that fetches each day's compact features from a
+    gzipped GeoJSON sidecar file (see `write_sidecar_chunks`) only when the
+    slider reaches that day, instead of inlining every day in the page.
+    The time dimension waits for a chunk to load before moving to it.
+
+    Browsers will not `fetch` from file:// urls, so the html and its data
+    folder need to be served over http(s).
+    """
+
+    _template = Template(
+        COMPACT_FEATURE_HEADER
+        + """
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}.timeDimension = L.timeDimension(
+                {
+                    times: {{ this.days|tojson }}.map(function (d) {
+                        return Date.parse(d);
+                    }),
+                    period: {{ this.period|tojson }},
+                }
+            );
+"""
+        + COMPACT_FEATURE_SCRIPT
+        + """
+            {{ this._parent.get_name() }}.addControl(this.timeDimensionControl);
+
+            var {{ this.get_name() }}_chunks = {{ this.chunks|tojson }};
+            var {{ this.get_name() }}_requests = {};
+            var {{ this.get_name() }}_days = {};
+
+            function {{ this.get_name() }}_fetch(day) {
+                var chunk = {{ this.get_name() }}_chunks[day];
+                if (chunk === undefined) {
+                    return Promise.resolve();
+                }
+                if (!(chunk in {{ this.get_name() }}_requests)) {
+                    {{ this.get_name() }}_requests[chunk] = fetch(
+                        {{ this.data_url|tojson }} + "/" + chunk
+                    ).then(function (response) {
+                        return response.arrayBuffer();
+                    }).then(function (buffer) {
+                        var bytes = new Uint8Array(buffer);
+                        // hosts may already have decoded the gzip
+                        if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) {
+                            return new Response(buffer).json();
+                        }
+                        var stream = new Response(buffer).body.pipeThrough(
+                            new DecompressionStream("gzip")
+                        );
+                        return new Response(stream).json();
+                    }).then(function (collection) {
+                        collection.features.forEach(function (feature) {
+                            var key = feature.properties.times[0];
+                            if (!(key in {{ this.get_name() }}_days)) {
+                                {{ this.get_name() }}_days[key] = [];
+                            }
+                            {{ this.get_name() }}_days[key].push(feature);
+                        });
+                    });
+                }
+                return {{ this.get_name() }}_requests[chunk];
+            }
+
+            L.TimeDimension.Layer.LazyGeoJson = L.TimeDimension.Layer.extend({
+                _dayOf: function (time) {
+                    return new Date(time).toISOString().slice(0, 10);
+                },
+                _loadedDay: function (day) {
+                    return (
+                        !(day in {{ this.get_name() }}_chunks)
+                        || day in {{ this.get_name() }}_days
+                    );
+                },
+                isReady: function (time) {
+                    return this._loadedDay(this._dayOf(time));
+                },
+                _onNewTimeLoading: function (ev) {
+                    var layer = this;
+                    var day = this._dayOf(ev.time);
+                    if (this._loadedDay(day)) {
+                        this.fire("timeload", {time: ev.time});
+                        return;
+                    }
+                    {{ this.get_name() }}_fetch(day).then(function () {
+                        layer.fire("timeload", {time: ev.time});
+                    });
+                },
+                _update: function () {
+                    if (!this._map) {
+                        return;
+                    }
+                    var day = this._dayOf(this._timeDimension.getCurrentTime());
+                    if (!this._loadedDay(day)) {
+                        return;
+                    }
+                    if (this._currentLayer) {
+                        this._map.removeLayer(this._currentLayer);
+                    }
+                    this._currentLayer = L.geoJson(
+                        {
+                            type: "FeatureCollection",
+                            features: {{ this.get_name() }}_days[day] || [],
+                        },
+                        {{ this.get_name() }}_options
+                    ).addTo(this._map);
+                }
+            });
+
+            var {{ this.get_name() }} = new L.TimeDimension.Layer.LazyGeoJson(
+                L.layerGroup(), {}
+            ).addTo({{ this._parent.get_name() }});
+            // the time dimension set its first day before this layer was added
+            {{ this.get_name() }}_fetch(
+                {{ this.get_name() }}._dayOf(
+                    {{ this._parent.get_name() }}.timeDimension.getCurrentTime()
+                )
+            ).then(function () {
+                {{ this.get_name() }}._update();
+            });
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, days, chunks, data_url, bounds=None, **kwargs):
+        super().__init__({}, **kwargs)
+        self.days = list(days)
+        self.chunks = chunks
+        self.data_url = data_url
+        self.bounds = bounds
+
+    def _get_self_bounds(self):
+        if self.bounds is None:
+            return [[None, None], [None, None]]
+        return self.bounds
+
+
+def write_sidecar_chunks(features, folder_path, period="day"):
+    """
+    Writes compact features to gzipped GeoJSON files in `folder_path`, one
+    per day (or per week, keyed on the Monday, for `period="week"`), for
+    `LazyTimestampedGeoJson`. Returns the sorted list of days and a dict
+    mapping each day to its chunk file name.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+
+    by_chunk = {}
+    chunks = {}
+    for feature in features:
+        day = feature["properties"]["times"][0]
+        if period == "week":
+            day_date = datetime.strptime(day, "%Y-%m-%d").date()
+            week_start = day_date - timedelta(days=day_date.weekday())
+            chunk = f"{week_start.strftime('%Y-%m-%d')}.geojson.gz"
+        else:
+            chunk = f"{day}.geojson.gz"
+        chunks[day] = chunk
+        by_chunk.setdefault(chunk, []).append(feature)
+
+    for chunk, chunk_features in by_chunk.items():
+        collection = dumps_json(
+            {"type": "FeatureCollection", "features": chunk_features}
+        )
+        with gzip.open(os.path.join(folder_path, chunk), "wb", compresslevel=9) as f:
+            f.write(collection.encode("utf-8"))
+
+    return sorted(chunks), chunks
+
+
+def add_timestamped_geojson(
+    m, features, compact=False, colour_scale=None, time_control=True
+):
+    """
+    Add TimestampGeoJson to the folium map, constructed from a features dict.
+    The FeatureCollection is serialised up front with `dumps_json`, and the
+    view bounds are taken straight from the feature coordinates.
+    Set `compact` for features from `build_compact_features`, which can also
+    leave out the time slider control with `time_control=False`.
+    """
+    collection = dumps_json(
+        {
+            "type": "FeatureCollection",
+            "features": features,
+        }
+    )
+    options = dict(
+        transition_time=2000,
+        period="P1D",
+        duration="PT1s",
+        max_speed=2,
+        date_options="YYYY-MM-DD",
+        auto_play=False,
+    )
+
+    if compact:
+        layer = CompactTimestampedGeoJson(
+            collection,
+            colour_scale=colour_scale,
+            time_control=time_control,
+            **options,
+        )
+    else:
+        layer = TimestampedGeoJson(collection, **options)
+
+    # data is still inline JSON, just pre-serialised
+    layer.embed = True
+    layer.add_to(m)
+
+    # fit view to bounds
+    if features:
+        m.fit_bounds(get_features_bounds(features))
+
+    return m
+
+
+def add_lazy_timestamped_geojson(
+    m, features, folder_path, data_url, period="day", colour_scale=None
+):
+    """
+    Add a `LazyTimestampedGeoJson` to the folium map, writing the compact
+    `features` to sidecar chunks in `folder_path`, which the page will fetch
+    from the (relative) `data_url`.
+    """
+    days, chunks = write_sidecar_chunks(features, folder_path, period=period)
+    bounds = get_features_bounds(features) if features else None
+
+    LazyTimestampedGeoJson(
+        days,
+        chunks,
+        data_url,
+        bounds=bounds,
+        colour_scale=colour_scale,
+        transition_time=2000,
+        period="P1D",
+        max_speed=2,
+        date_options="YYYY-MM-DD",
+        auto_play=False,
+    ).add_to(m)
+
+    # fit view to bounds
+    if bounds is not None:
+        m.fit_bounds(bounds)
+
+    return m
@@ -0,0 +1,128 @@
+import json
+import os
+import re
+
+# name prefix of every metric, as node-exporter serves textfile metrics as is
+METRIC_PREFIX = "rail_reporter"
+
+# help text of each metric, all gauges, in the order they are written
+METRICS = {
+    "last_run_success": "Whether the last run completed every step (1) or not (0).",
+    "last_run_timestamp_seconds": "Unix time the last run finished.",
+    "last_success_timestamp_seconds": "Unix time of the last run to succeed.",
+    "step_duration_seconds": "Wall time of each step of the last run.",
+    "step_success": "Whether each step of the last run exited cleanly.",
+    "stage_duration_seconds": (
+        "Wall time of each stage of each step of the last run, summed over "
+        "repeats such as days."
+    ),
+    "max_rss_bytes": "Peak resident memory of each step of the last run.",
+    "downloaded_files": "Number of feed files downloaded by the last run.",
+    "downloaded_bytes": "Bytes of feed files downloaded by the last run.",
+    "latest_feed_number": "Number of the latest full timetable feed processed.",
+    "cif_records_parsed": "CIF records parsed from the latest feed.",
+    "schedule_rows": "Schedule and cancellation rows parsed from the latest feed.",
+    "stations_emitted": "Stations in the results of the last run.",
+    "days_emitted": "Days in the results of the last run.",
+    "published_bytes": "Bytes of the maps published by the last run, by encoding.",
+}
+
+
+def read_profile_report(path, since=None):
+    """
+    Reads a `--profile` report (see `profiling.py`), or returns None if
+    there is none at `path` written since the unix time `since`, such as
+    one left by an earlier run when a step fails.
+    """
+    if not os.path.exists(path) or (since and os.path.getmtime(path) < since):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def profile_samples(script, report):
+    """
+    Returns (name, labels, value) samples of the stage durations and peak
+    memory of one `script` run from its `--profile` report.
+    """
+    durations = {}
+    for record in report["stages"]:
+        durations[record["stage"]] = (
+            durations.get(record["stage"], 0) + record["wall_s"]
+        )
+
+    samples = [
+        ("stage_duration_seconds", {"script": script, "stage": stage}, seconds)
+        for stage, seconds in durations.items()
+    ]
+    if report.get("max_rss_mb") is not None:
+        samples.append(
+            ("max_rss_bytes", {"script": script}, report["max_rss_mb"] * 2**20)
+        )
+    return samples
+
+
+def stage_details(report, stage, key):
+    """
+    Returns the `key` detail of every run of `stage` in a `--profile`
+    report.
+    """
+    return [
+        record[key]
+        for record in report["stages"]
+        if record["stage"] == stage and key in record
+    ]
+
+
+def format_labels(labels):
+    escaped = {
+        key: str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+        for key, value in labels.items()
+    }
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+def format_textfile(samples):
+    """
+    Formats (name, labels, value) samples of the `METRICS` in the Prometheus
+    text exposition format, grouped by metric with their help and type.
+    """
+    lines = []
+    for name, help_text in METRICS.items():
+        metric_samples = [sample for sample in samples if sample[0] == name]
+        if not metric_samples:
+            continue
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for _, labels, value in metric_samples:
+            label_text = format_labels(labels) if labels else ""
+            value = float(value)
+            value_text = str(int(value)) if value.is_integer() else repr(value)
+            lines.append(f"{METRIC_PREFIX}_{name}{label_text} {value_text}")
+    return "\n".join(lines) + "\n"
+
+
+def read_textfile_value(path, name):
+    """
+    Returns the value of an unlabelled metric in a textfile written by
+    `write_textfile`, or None.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        match = re.search(
+            rf"^{METRIC_PREFIX}_{name} (\S+)$", f.read(), flags=re.MULTILINE
+        )
+    return float(match.group(1)) if match else None
+
+
+def write_textfile(path, samples):
+    """
+    Writes samples to a node-exporter textfile at `path` (ending .prom),
+    replacing it in one step so the exporter never reads it half written.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(format_textfile(samples))
+    os.replace(tmp_path, path)
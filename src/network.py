@@ -0,0 +1,299 @@
+import heapq
+import logging
+import os
+from datetime import datetime
+from functools import lru_cache
+
+import click
+import numpy as np
+import pandas as pd
+
+from utils import get_station_index
+
+# larger than any span of `service_minutes` times in a day's schedule
+MINUTES_SPAN = 10 * 1440
+
+
+def service_minutes(rows_df):
+    """
+    Returns the `Time` of each row of a long-format schedule as minutes from
+    midnight at the start of the DfT day, so services running past midnight,
+    or starting in the small hours of the next day (`Small_hours`), keep
+    increasing times. Rows without a valid time are NaN.
+    """
+    times = pd.to_numeric(rows_df["Time"], errors="coerce").to_numpy(dtype="float64")
+    minutes = (times // 100) * 60 + times % 100
+
+    identifiers = rows_df["Identifier"].to_numpy()
+    stops = rows_df["Stop"].to_numpy()
+    same_run = np.zeros(len(rows_df), dtype=bool)
+    same_run[1:] = (identifiers[1:] == identifiers[:-1]) & (stops[1:] > stops[:-1])
+
+    # count the midnights passed within each run, restarting at every run
+    wrapped = np.zeros(len(rows_df), dtype="int64")
+    wrapped[1:] = same_run[1:] & (minutes[1:] < minutes[:-1])
+    wraps = np.cumsum(wrapped)
+    run_starts = np.flatnonzero(~same_run)
+    run_lengths = np.diff(np.append(run_starts, len(rows_df)))
+    wraps -= np.repeat(wraps[run_starts], run_lengths)
+
+    small_hours = rows_df["Small_hours"].to_numpy(dtype="int64")
+    return minutes + 1440 * (wraps + small_hours)
+
+
+def format_minutes(minutes):
+    """
+    Formats minutes from `service_minutes` as HH:MM, marking times on the day
+    after with "+1".
+    """
+    minutes = int(minutes)
+    days, minutes = divmod(minutes, 1440)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}" + ("+1" if days else "")
+
+
+def parse_minutes(time: str):
+    """Parses a HHMM or HH:MM time into minutes from midnight."""
+    time = time.replace(":", "")
+    return int(time[:2]) * 60 + int(time[2:])
+
+
+class StationGraph:
+    """
+    Directed graph of the services running between consecutive station stops
+    on one day, in compressed sparse row (CSR) form.
+
+    The edges leaving station `i` (the position of its TIPLOC in
+    `station_codes`) are `indptr[i]:indptr[i + 1]`, going to stations
+    `indices[...]`. Each edge has a count of `services`, and the `earliest`
+    and `latest` departure along it, in minutes from `service_minutes`. The
+    individual departures along edge `e` are
+    `departures[conn_ptr[e]:conn_ptr[e + 1]]`, sorted, with the earliest
+    arrival at the next station by any of that or a later departure in
+    `arrivals`, for the time budget queries in `reachable`.
+    """
+
+    ARRAYS = [
+        "station_codes",
+        "indptr",
+        "indices",
+        "services",
+        "earliest",
+        "latest",
+        "conn_ptr",
+        "departures",
+        "arrivals",
+    ]
+
+    def __init__(self, **arrays):
+        for name in self.ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))
+        # fixed width strings, so the graph saves without pickling
+        self.station_codes = self.station_codes.astype(str)
+
+    @classmethod
+    def from_schedule(cls, rows_df, station_codes):
+        """
+        Builds the graph from the resolved running schedule for a day (e.g.
+        the station rows of `final_df` in `build_timetable.py`), in the order
+        parsed. `station_codes` must be sorted.
+        """
+        station_codes = np.asarray(station_codes)
+        n = len(station_codes)
+
+        station_idx, is_station = get_station_index(rows_df, station_codes)
+        minutes = service_minutes(rows_df)
+        keep = is_station & ~np.isnan(minutes)
+        rows_df = rows_df[keep]
+        station_idx = station_idx[keep]
+        minutes = minutes[keep].astype("int64")
+
+        # each stop paired with the next in the same service run
+        identifiers = rows_df["Identifier"].to_numpy()
+        stops = rows_df["Stop"].to_numpy()
+        same_run = (identifiers[1:] == identifiers[:-1]) & (stops[1:] > stops[:-1])
+        from_idx = station_idx[:-1][same_run]
+        to_idx = station_idx[1:][same_run]
+        departures = minutes[:-1][same_run]
+        arrivals = minutes[1:][same_run]
+        keep = from_idx != to_idx
+        from_idx, to_idx = from_idx[keep], to_idx[keep]
+        departures, arrivals = departures[keep], arrivals[keep]
+
+        # connections sorted by edge, then departure
+        edge_codes = from_idx * n + to_idx
+        order = np.lexsort((arrivals, departures, edge_codes))
+        edge_codes = edge_codes[order]
+        departures = departures[order]
+        arrivals = arrivals[order]
+
+        edges, conn_starts, services = np.unique(
+            edge_codes, return_index=True, return_counts=True
+        )
+        conn_ptr = np.append(conn_starts, len(edge_codes))
+
+        # earliest arrival from each departure or any later one on the edge,
+        # a reversed running minimum that restarts at each edge as every
+        # edge is offset below the ones after it
+        offsets = np.repeat(np.arange(len(edges)) * MINUTES_SPAN, services)
+        arrivals = np.minimum.accumulate((arrivals + offsets)[::-1])[::-1] - offsets
+
+        return cls(
+            station_codes=station_codes,
+            indptr=np.searchsorted(edges // n, np.arange(n + 1)),
+            indices=edges % n,
+            services=services,
+            earliest=departures[conn_starts],
+            latest=departures[conn_ptr[1:] - 1],
+            conn_ptr=conn_ptr,
+            departures=departures,
+            arrivals=arrivals,
+        )
+
+    def save(self, path):
+        """Writes the graph arrays to a compressed .npz file at `path`."""
+        np.savez_compressed(path, **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, path):
+        """Reads a graph written by `save`."""
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in cls.ARRAYS})
+
+    def _station(self, tiploc):
+        idx = np.searchsorted(self.station_codes, tiploc)
+        if idx == len(self.station_codes) or self.station_codes[idx] != tiploc:
+            raise KeyError(tiploc)
+        return idx
+
+    def neighbours(self, tiploc):
+        """
+        Returns the stations served directly after `tiploc`, with the number
+        of services and the earliest and latest departures to each.
+        """
+        idx = self._station(tiploc)
+        edges = slice(self.indptr[idx], self.indptr[idx + 1])
+
+        return pd.DataFrame(
+            {
+                "TIPLOC": self.station_codes[self.indices[edges]],
+                "services": self.services[edges],
+                "earliest": [format_minutes(m) for m in self.earliest[edges]],
+                "latest": [format_minutes(m) for m in self.latest[edges]],
+            }
+        )
+
+    def reachable(self, tiploc, depart_after="0000", budget=None):
+        """
+        Returns the stations that can be reached from `tiploc` leaving at or
+        after `depart_after` (HHMM), within `budget` minutes if given, with the
+        earliest arrival at each. Changes between services are taken as
+        instant.
+        """
+        source = self._station(tiploc)
+        start = parse_minutes(depart_after)
+        limit = np.inf if budget is None else start + budget
+
+        arrival = np.full(len(self.station_codes), np.inf)
+        arrival[source] = start
+        queue = [(start, source)]
+        while queue:
+            time, node = heapq.heappop(queue)
+            if time > arrival[node]:
+                continue
+            for edge in range(self.indptr[node], self.indptr[node + 1]):
+                conns = slice(self.conn_ptr[edge], self.conn_ptr[edge + 1])
+                first = np.searchsorted(self.departures[conns], time)
+                if first == conns.stop - conns.start:
+                    continue
+                next_time = self.arrivals[conns.start + first]
+                next_node = self.indices[edge]
+                if next_time <= limit and next_time < arrival[next_node]:
+                    arrival[next_node] = next_time
+                    heapq.heappush(queue, (next_time, next_node))
+
+        reached = np.flatnonzero(np.isfinite(arrival))
+        reached = reached[np.argsort(arrival[reached], kind="stable")]
+        return pd.DataFrame(
+            {
+                "TIPLOC": self.station_codes[reached],
+                "minutes": (arrival[reached] - start).astype("int64"),
+                "arrival": [format_minutes(m) for m in arrival[reached]],
+            }
+        )
+
+
+def station_graph_path(graph_directory, date):
+    """Returns where the graph for service `date` is kept."""
+    return os.path.join(graph_directory, f"{date:%Y-%m-%d}.npz")
+
+
+@lru_cache(maxsize=32)
+def load_station_graph(graph_directory, date):
+    """
+    Returns the `StationGraph` for service `date` from `graph_directory`,
+    keeping recently used days in memory.
+    """
+    return StationGraph.load(station_graph_path(graph_directory, date))
+
+
+@click.group()
+def main():
+    """
+    Queries the per day station graphs written by `build_timetable.py`.
+    """
+
+
+@main.command()
+@click.argument("graph_directory")
+@click.argument("date")
+@click.argument("tiploc")
+def neighbours(graph_directory: str, date: str, tiploc: str):
+    """
+    Lists the stations served directly after a station.
+
+    Arguments:
+        graph_directory -- `<...>_network` folder from `build_timetable.py`
+        date -- Service date, in DDMMYYYY format
+        tiploc -- TIPLOC of the station
+    """
+    graph = load_station_graph(
+        graph_directory, datetime.strptime(date, "%d%m%Y").date()
+    )
+    click.echo(graph.neighbours(tiploc).to_string(index=False))
+
+
+@main.command()
+@click.argument("graph_directory")
+@click.argument("date")
+@click.argument("tiploc")
+@click.option("--depart_after", default="0000", show_default=True, type=str)
+@click.option("--budget", default=None, type=int)
+def reachable(
+    graph_directory: str, date: str, tiploc: str, depart_after: str, budget: int
+):
+    """
+    Lists the stations reachable from a station, and when.
+
+    Arguments:
+        graph_directory -- `<...>_network` folder from `build_timetable.py`
+        date -- Service date, in DDMMYYYY format
+        tiploc -- TIPLOC of the station
+    """
+    graph = load_station_graph(
+        graph_directory, datetime.strptime(date, "%d%m%Y").date()
+    )
+    click.echo(graph.reachable(tiploc, depart_after, budget).to_string(index=False))
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
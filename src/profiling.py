@@ -0,0 +1,138 @@
+import cProfile
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def max_rss_mb():
+    """
+    Returns the peak resident memory of the process so far in MB, or None
+    where it cannot be read.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(max_rss / (2**20 if sys.platform == "darwin" else 2**10), 2)
+
+
+def rss_mb():
+    """
+    Returns the resident memory of the process now in MB, or its peak so far
+    where the current figure cannot be read (outside Linux).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return max_rss_mb()
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 2)
+
+
+def profile_report_path(output_path, script):
+    """
+    Returns where the stage profile of a run of `script` is written,
+    alongside its output.
+    """
+    return f"{os.path.splitext(output_path)[0]}_{script}_profile.json"
+
+
+class StageProfiler:
+    """
+    Records the wall and CPU time, and peak Python memory allocated (from
+    tracemalloc, above what was held at the start), of named pipeline
+    stages. Each `stage` yields its record,
+    a dict that callers can add details to, such as rows in and out. Records
+    also keep the peak resident memory of the process by the end of the
+    stage, which only grows, so a stage raising it is the one that used it.
+
+    Tracing memory slows allocation heavy code, so the times of runs with
+    and without `trace_memory` are not comparable, and production runs
+    should record time and resident memory alone. A profiler that is not
+    `enabled` records nothing, so entry points can wrap their stages either
+    way. Stages named `profile_stage` are also run under cProfile, every
+    time they run, for `write_report` to dump alongside the report.
+    """
+
+    def __init__(self, trace_memory=True, enabled=True, profile_stage=None):
+        self.trace_memory = trace_memory
+        self.enabled = enabled
+        self.profile_stage = profile_stage
+        self.profile = cProfile.Profile() if profile_stage is not None else None
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **details):
+        record = {"stage": name, **details}
+        if not self.enabled:
+            yield record
+            return
+
+        # tracing is left on between stages, as stopping it while library
+        # threads (e.g. pyarrow's) are still allocating can crash, and each
+        # stage measures its peak from its own starting point instead
+        if self.trace_memory:
+            gc.collect()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        profiled = self.profile is not None and name == self.profile_stage
+        if profiled:
+            self.profile.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 4)
+            if profiled:
+                self.profile.disable()
+            if self.trace_memory:
+                record["peak_mb"] = round(
+                    (tracemalloc.get_traced_memory()[1] - traced_start) / 2**20, 2
+                )
+            record["max_rss_mb"] = max_rss_mb()
+            self.stages.append(record)
+
+    def write_report(self, path, **details):
+        """
+        Writes the stage records, and any `details` of the run, to a JSON
+        report at `path`, and the cProfile stats of `profile_stage` to a
+        .prof file beside it (e.g. for `python -m pstats` or snakeviz).
+        """
+        if not self.enabled:
+            return
+        logger = logging.getLogger(__name__)
+
+        report = {
+            "run_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            **details,
+            "wall_s": round(sum(record["wall_s"] for record in self.stages), 4),
+            "max_rss_mb": max_rss_mb(),
+            "stages": self.stages,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        logger.info(f"Stage profile written to {path}")
+
+        if self.profile is not None:
+            stats_path = f"{os.path.splitext(path)[0]}_{self.profile_stage}.prof"
+            self.profile.dump_stats(stats_path)
+            logger.info(
+                f"cProfile stats of {self.profile_stage} written to {stats_path}"
+            )
@@ -0,0 +1,341 @@
+import base64
+import gzip
+import io
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+import click
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:  # optional, only .gz siblings are written without it
+    brotli = None
+
+# files served from static hosting, sidecar data chunks are gzipped already
+PUBLISHED_EXTENSIONS = (".html", ".js", ".css", ".json", ".geojson")
+
+# elements whose contents are code, or whitespace sensitive text
+RAW_ELEMENTS = re.compile(
+    r"(<(script|style|pre|textarea)\b[^>]*>)(.*?)(</\2\s*>)", flags=re.S | re.I
+)
+
+# HTML comments, but not conditional comments
+HTML_COMMENTS = re.compile(r"<!--(?!\[if).*?-->", flags=re.S)
+
+PNG_DATA_URIS = re.compile(r"data:image/png;base64,([A-Za-z0-9+/=]+)")
+
+CSS_COMMENTS = re.compile(r"/\*.*?\*/", flags=re.S)
+
+# whitespace that CSS never needs, around braces, semicolons and commas
+CSS_SPACING = re.compile(r"\s*([{};,])\s*")
+
+# where a JSON object or array literal may start, or a JavaScript string,
+# comment or regex literal, whose contents are left as they are
+JS_TOKENS = re.compile(
+    r"""(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|`(?:[^`\\]|\\.)*`)
+    |(?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<slash>/)
+    |(?P<json>[\[{])""",
+    flags=re.S | re.X,
+)
+
+# what a "/" starting a regex literal, rather than dividing, can follow
+REGEX_PRECEDERS = re.compile(
+    r"(?:^|[(,=:\[!&|?{};+\-*%<>~^]|\b(?:return|typeof|case|do|else|in|of|new"
+    r"|delete|void|throw))\s*$"
+)
+
+JSON_DECODER = json.JSONDecoder()
+
+
+def dumps_json_literal(value):
+    """
+    Serialises `value` as compact JSON that is safe to inline in a script,
+    escaping "<", ">" and "&" (which only occur inside strings) as folium
+    does.
+    """
+    return (
+        json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+        .replace("<", "\\u003c")
+        .replace(">", "\\u003e")
+        .replace("&", "\\u0026")
+    )
+
+
+def regex_literal_end(code, start):
+    """
+    Returns where the regex literal starting with the "/" at `start` in
+    `code` ends, after its flags, or None if the "/" divides instead.
+    """
+    if not REGEX_PRECEDERS.search(code, max(0, start - 32), start):
+        return None
+    in_class = False
+    position = start + 1
+    while position < len(code):
+        char = code[position]
+        if char == "\\":
+            position += 1
+        elif char == "\n":
+            return None
+        elif char in "[]":
+            in_class = char == "["
+        elif char == "/" and not in_class:
+            while position + 1 < len(code) and code[position + 1].isalpha():
+                position += 1
+            return position + 1
+        position += 1
+    return None
+
+
+def compact_json_literals(code):
+    """
+    Re-serialises every JSON object or array literal in `code` (such as the
+    data and options folium inlines in its scripts) without whitespace.
+    Only text that parses as JSON is changed, and JavaScript strings,
+    comments and regex literals are skipped, so other code is left as is.
+    """
+    parts = []
+    position = 0
+    start = 0
+    while True:
+        match = JS_TOKENS.search(code, start)
+        if match is None:
+            break
+        start = match.end()
+        if match.lastgroup == "slash":
+            start = regex_literal_end(code, match.start()) or start
+        if match.lastgroup != "json":
+            continue
+        try:
+            value, end = JSON_DECODER.raw_decode(code, match.start())
+        except ValueError:
+            continue
+        parts.append(code[position : match.start()])
+        parts.append(dumps_json_literal(value))
+        position = start = end
+    parts.append(code[position:])
+    return "".join(parts)
+
+
+def minify_code(code):
+    """
+    Minifies JavaScript, compacting JSON literals and dropping
+    indentation and blank lines. Line breaks are kept, so JavaScript that
+    relies on automatic semicolon insertion still runs.
+    """
+    lines = (line.strip() for line in compact_json_literals(code).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def minify_css(css):
+    """
+    Minifies CSS, dropping comments and the whitespace it does not need.
+    """
+    css = re.sub(r"\s+", " ", CSS_COMMENTS.sub("", css))
+    return CSS_SPACING.sub(r"\1", css).replace(";}", "}").strip()
+
+
+def minify_markup(markup):
+    """
+    Drops comments from HTML outside raw text elements, and collapses
+    whitespace between and within tags to one space, or one line break.
+    """
+    return re.sub(
+        r"\s+",
+        lambda match: "\n" if "\n" in match.group() else " ",
+        HTML_COMMENTS.sub("", markup),
+    )
+
+
+def minify_html(html):
+    """
+    Minifies an HTML page, such as a folium map saved by `m.save`: its
+    markup with `minify_markup`, its scripts with `minify_code` and its
+    styles with `minify_css`. Preformatted text is left as is.
+    """
+    parts = []
+    position = 0
+    for match in RAW_ELEMENTS.finditer(html):
+        parts.append(minify_markup(html[position : match.start()]))
+        open_tag, tag, content, close_tag = match.groups()
+        if tag.lower() == "style":
+            content = minify_css(content)
+        elif tag.lower() == "script":
+            content = minify_code(content)
+            # keep code on its own lines, away from the tags
+            content = f"\n{content}\n" if content else ""
+        parts.append(minify_markup(open_tag) + content + close_tag)
+        position = match.end()
+    parts.append(minify_markup(html[position:]))
+    return "".join(parts).strip() + "\n"
+
+
+def optimise_png_data_uri(match):
+    """
+    Returns a PNG data URI re-encoded by Pillow at its highest compression,
+    if that is smaller, such as the base64 logo added to every map.
+    """
+    png = base64.b64decode(match.group(1))
+    optimised = io.BytesIO()
+    try:
+        with Image.open(io.BytesIO(png)) as image:
+            image.save(
+                optimised,
+                format="PNG",
+                optimize=True,
+                icc_profile=image.info.get("icc_profile"),
+            )
+    except (OSError, ValueError):
+        return match.group()
+    if optimised.tell() >= len(png):
+        return match.group()
+    return "data:image/png;base64," + base64.b64encode(optimised.getvalue()).decode(
+        "ascii"
+    )
+
+
+def minify_artefact(path, text):
+    """
+    Returns the minified text of a published file, by its extension.
+    """
+    if path.endswith(".html"):
+        return PNG_DATA_URIS.sub(optimise_png_data_uri, minify_html(text))
+    if path.endswith((".json", ".geojson")):
+        return json.dumps(json.loads(text), separators=(",", ":"), ensure_ascii=False)
+    if path.endswith(".css"):
+        return minify_css(text)
+    return minify_code(text)
+
+
+def publish_artefact(path, minify=True, gzip_level=9, brotli_quality=11):
+    """
+    Minifies a file in place, then writes precompressed `.gz` and (with
+    brotli installed) `.br` siblings for static hosts to serve. Returns the
+    bytes of each version.
+    """
+    logger = logging.getLogger(__name__)
+
+    with open(path, "rb") as f:
+        original = f.read()
+    content = original
+
+    if minify:
+        try:
+            content = minify_artefact(path, original.decode("utf-8")).encode("utf-8")
+        except ValueError as e:
+            logger.warning(f"Could not minify {path}, publishing it as is: {e}")
+        if len(content) < len(original):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        else:
+            content = original
+
+    # no timestamp in the gzip header, so unchanged files compress the same
+    compressed = {"gzip": gzip.compress(content, gzip_level, mtime=0)}
+    if brotli is not None:
+        compressed["br"] = brotli.compress(content, quality=brotli_quality)
+
+    for encoding, data in compressed.items():
+        with open(f"{path}.{'gz' if encoding == 'gzip' else encoding}", "wb") as f:
+            f.write(data)
+
+    return {
+        "original": len(original),
+        "minified": len(content),
+        **{encoding: len(data) for encoding, data in compressed.items()},
+    }
+
+
+def find_artefacts(directory):
+    """
+    Returns the files under `directory` to publish, skipping `--profile`
+    reports and the publish report itself.
+    """
+    return sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(directory)
+        for file in files
+        if file.endswith(PUBLISHED_EXTENSIONS)
+        and not file.endswith("_profile.json")
+        and file != "publish_report.json"
+    )
+
+
+@click.command()
+@click.argument("directory")
+@click.option("--no_minify", is_flag=True, show_default=False, default=False, type=bool)
+@click.option("--gzip_level", default=9, type=int)
+@click.option("--brotli_quality", default=11, type=int)
+def main(directory: str, no_minify: bool, gzip_level: int, brotli_quality: int):
+    """
+    Prepares the html maps and data in `directory` (and its subfolders) for
+    static hosting, minifying them in place and writing `.gz` and `.br`
+    siblings. The bytes saved per artefact are written to
+    `publish_report.json` in `directory`.
+
+    Parameters
+    ----------
+    directory :
+        Outputs directory to publish, such as a dated folder of maps
+    no_minify : bool
+        Only write the compressed siblings, leaving files as they are
+    gzip_level : int
+        gzip compression level, 1 to 9
+    brotli_quality : int
+        brotli compression quality, 0 to 11, if brotli is installed
+    """
+    logger = logging.getLogger(__name__)
+
+    if brotli is None:
+        logger.info("brotli not installed, only writing .gz siblings.")
+
+    artefacts = []
+    for path in find_artefacts(directory):
+        sizes = publish_artefact(path, not no_minify, gzip_level, brotli_quality)
+        smallest = min(size for size in sizes.values())
+        artefacts.append(
+            {
+                "artefact": os.path.relpath(path, directory),
+                "bytes": sizes,
+                "saving_pct": round((1 - smallest / sizes["original"]) * 100, 2),
+            }
+        )
+        logger.info(
+            f"Published {path}: "
+            + ", ".join(f"{version} {size:,}" for version, size in sizes.items())
+            + f" bytes ({artefacts[-1]['saving_pct']}% saved)."
+        )
+
+    report = {
+        "directory": directory,
+        "published_at": datetime.now().isoformat(timespec="seconds"),
+        "artefacts": artefacts,
+        "total_bytes": {
+            version: sum(artefact["bytes"][version] for artefact in artefacts)
+            for version in (artefacts[0]["bytes"] if artefacts else [])
+        },
+    }
+    report_path = os.path.join(directory, "publish_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Published {len(artefacts)} artefacts, report at {report_path}")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
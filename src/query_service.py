@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+from datetime import datetime
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import click
+
+from history_store import HistoryStore
+from utils import REGION_BBOXES
+
+
+def parse_date(value: str):
+    """Parses a YYYY-MM-DD query value, or returns None if not given."""
+    if value is None:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_bbox(value: str):
+    """
+    Parses a `lat_min,lon_min,lat_max,lon_max` query value, or a
+    `REGION_BBOXES` name, or returns None if not given.
+    """
+    if value is None:
+        return None
+    if "," not in value:
+        if value not in REGION_BBOXES:
+            raise ValueError(f"unknown region {value}")
+        return value
+    lat_min, lon_min, lat_max, lon_max = [float(v) for v in value.split(",")]
+    return [(lat_min, lon_min), (lat_max, lon_max)]
+
+
+def to_json_records(df):
+    """Serialises a store query result to a JSON list of records."""
+    df = df.copy()
+    for col in ["dump_date", "date"]:
+        df[col] = df[col].astype(str)
+    return df.to_json(orient="records").encode("utf-8")
+
+
+class QueryService:
+    """
+    Answers station and day queries from a `HistoryStore` as JSON, keeping the
+    most recent `cache_size` responses in memory. Cached responses are
+    dropped whenever a feed is added to the store.
+    """
+
+    def __init__(self, store_directory, cache_size=1024):
+        self.store = HistoryStore(store_directory)
+        self._cached_query = lru_cache(maxsize=cache_size)(self._query)
+
+    def version(self):
+        """Changes whenever the store manifest is rewritten."""
+        if not os.path.exists(self.store.manifest_path):
+            return 0
+        return os.stat(self.store.manifest_path).st_mtime_ns
+
+    def _query(self, version, path, query):
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        latest_only = params.get("all_feeds", "0") not in ["1", "true"]
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+
+        if len(parts) == 2 and parts[0] == "stations":
+            df = self.store.station_series(
+                parts[1],
+                parse_date(params.get("from")),
+                parse_date(params.get("to")),
+                latest_only=latest_only,
+            )
+        elif len(parts) == 2 and parts[0] == "day":
+            df = self.store.day_summary(
+                parse_date(parts[1]),
+                bbox=parse_bbox(params.get("bbox")),
+                latest_only=latest_only,
+            )
+        else:
+            raise KeyError(path)
+
+        return to_json_records(df)
+
+    def query(self, path, query=""):
+        """
+        Returns the JSON response body for a request `path` and query string,
+        raising KeyError for unknown paths and ValueError for bad parameters.
+        """
+        return self._cached_query(self.version(), path, query)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Serves `QueryService` responses, set on the server as `service`."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            body = self.server.service.query(url.path, url.query)
+            status = 200
+        except KeyError:
+            body = json.dumps({"error": f"unknown path {url.path}"}).encode("utf-8")
+            status = 404
+        except ValueError as e:
+            body = json.dumps({"error": str(e)}).encode("utf-8")
+            status = 400
+        except Exception:
+            # such as the store being compacted under the query, the client
+            # still gets a JSON answer and the server keeps serving
+            logging.getLogger(__name__).exception(f"Query {self.path} failed.")
+            body = json.dumps({"error": "internal error"}).encode("utf-8")
+            status = 500
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+
+def make_server(store_directory, host="127.0.0.1", port=8000, cache_size=1024):
+    """
+    Returns a threaded HTTP server answering queries from the historical store
+    at `store_directory`. Use port 0 to pick a free port.
+    """
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.service = QueryService(store_directory, cache_size)
+    return server
+
+
+@click.command()
+@click.argument("store_directory", default=os.getenv("DIR_OUTPUTS_HISTORY"))
+@click.option("--host", default="127.0.0.1", show_default=True, type=str)
+@click.option("--port", default=8000, show_default=True, type=int)
+@click.option("--cache_size", default=1024, show_default=True, type=int)
+def main(store_directory: str, host: str, port: int, cache_size: int):
+    """
+    Serves station service levels from the historical store over HTTP, as JSON.
+
+    \b
+    GET /stations/<tiploc>?from=YYYY-MM-DD&to=YYYY-MM-DD
+    GET /day/<YYYY-MM-DD>?bbox=lat_min,lon_min,lat_max,lon_max
+
+    Both return the latest feed planning each day, or every feed with
+    `all_feeds=1`. `bbox` may also be a region name from `REGION_BBOXES`.
+
+    Arguments:
+        store_directory -- Directory of the historical store
+    """
+    logger = logging.getLogger(__name__)
+
+    server = make_server(store_directory, host, port, cache_size)
+    logger.info(f"Serving {store_directory} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
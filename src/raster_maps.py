@@ -0,0 +1,425 @@
+import hashlib
+import io
+import logging
+import math
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import click
+import numpy as np
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+from utils import COLOUR_SCALE, REGION_BBOXES, get_colours
+
+TILE_SIZE = 256
+
+# Leaflet's (and OSM's) spherical mercator latitude limit
+MAX_LATITUDE = 85.0511287798
+
+# view of the whole network, the GB static visual as seeded and rendered
+GB_BBOX = [(49.8, -8.7), (60.9, 1.8)]
+
+OSM_TILES = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+OSM_ATTRIBUTION = "(c) OpenStreetMap contributors"
+
+# background for any tile missing from the cache
+BACKGROUND = (242, 239, 233)
+
+
+def lonlat_to_pixels(lon, lat, zoom):
+    """
+    Projects longitude/latitude (scalars or arrays) to global web mercator
+    pixel coordinates at `zoom`, as Leaflet does for 256px tiles.
+    """
+    lat = np.clip(np.asarray(lat, dtype="float64"), -MAX_LATITUDE, MAX_LATITUDE)
+    lon = np.asarray(lon, dtype="float64")
+    scale = TILE_SIZE * 2**zoom
+
+    x = (lon + 180.0) / 360.0 * scale
+    sin_lat = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def fit_view(bbox, size, padding=(0, 0), max_zoom=18):
+    """
+    Mirrors Leaflet's `fitBounds`: returns the highest whole zoom level at
+    which `bbox` ([(lat, lon), (lat, lon)]) fits in an image of `size`
+    (width, height) less `padding` on each side, and the bbox centre in global
+    pixels at that zoom.
+    """
+    (lat1, lon1), (lat2, lon2) = bbox
+    x1, y1 = lonlat_to_pixels([lon1, lon2], [lat1, lat2], 0)
+    width0 = abs(x1[1] - x1[0])
+    height0 = abs(y1[1] - y1[0])
+
+    avail_w = size[0] - 2 * padding[0]
+    avail_h = size[1] - 2 * padding[1]
+    scale = min(
+        avail_w / width0 if width0 > 0 else float("inf"),
+        avail_h / height0 if height0 > 0 else float("inf"),
+    )
+    zoom = int(min(max_zoom, max(0, math.floor(math.log2(scale)))))
+
+    # centre on the projected bbox midpoint, not the lat/lon midpoint
+    xs, ys = lonlat_to_pixels([lon1, lon2], [lat1, lat2], zoom)
+    cx, cy = xs.mean(), ys.mean()
+    return zoom, (float(cx), float(cy))
+
+
+def static_views(bboxes=None):
+    """
+    Returns the (place, bbox, padding) of each static visual: GB over
+    `GB_BBOX`, then each place in `bboxes` (like `REGION_BBOXES`). Seeding and
+    rendering both take their views from here, so each render only needs
+    tiles that were seeded.
+    """
+    views = [("GB", GB_BBOX, (0, 0))]
+    for place, view in (bboxes or {}).items():
+        views.append((place, view["bbox"], view.get("padding", (0, 0))))
+    return views
+
+
+def view_tile_offsets(bbox, size, padding=(0, 0)):
+    """
+    Returns the zoom level of a view, and each (z, x, y) tile it covers with
+    the tile's pixel offset within the image.
+    """
+    zoom, (cx, cy) = fit_view(bbox, size, padding)
+    left, top = cx - size[0] / 2, cy - size[1] / 2
+    n_tiles = 2**zoom
+
+    x_range = range(
+        math.floor(left / TILE_SIZE), math.floor((left + size[0] - 1) / TILE_SIZE) + 1
+    )
+    y_range = range(
+        max(0, math.floor(top / TILE_SIZE)),
+        min(n_tiles, math.floor((top + size[1] - 1) / TILE_SIZE) + 1),
+    )
+    # x wraps around the antimeridian, y does not
+    tiles = [
+        (
+            (zoom, x % n_tiles, y),
+            (int(round(x * TILE_SIZE - left)), int(round(y * TILE_SIZE - top))),
+        )
+        for x in x_range
+        for y in y_range
+    ]
+    return zoom, tiles
+
+
+def tiles_for_view(bbox, size, padding=(0, 0)):
+    """
+    Returns the zoom level and the (z, x, y) tiles needed to render a view.
+    """
+    zoom, tiles = view_tile_offsets(bbox, size, padding)
+    return zoom, [tile for tile, _ in tiles]
+
+
+class XYZTileCache:
+    """
+    Tile cache laid out on disk as `<root>/<z>/<x>/<y>.png`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, z, x, y):
+        return os.path.join(self.root, str(z), str(x), f"{y}.png")
+
+    def read(self, z, x, y):
+        """Returns the tile's encoded bytes, or None if not cached."""
+        path = self.path(z, x, y)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get(self, z, x, y):
+        """Returns the tile as a PIL image, or None if not cached."""
+        data = self.read(z, x, y)
+        if data is None:
+            return None
+        return Image.open(io.BytesIO(data)).convert("RGB")
+
+    def put(self, z, x, y, data: bytes):
+        path = self.path(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def __contains__(self, tile):
+        return os.path.exists(self.path(*tile))
+
+
+class MBTilesCache:
+    """
+    Read-only tile cache in a MBTiles (sqlite) file. Rows are stored in TMS
+    order, so y is flipped relative to XYZ.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def _row(self, z, x, y):
+        return self.conn.execute(
+            "SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, 2**z - 1 - y),
+        ).fetchone()
+
+    def read(self, z, x, y):
+        """Returns the tile's encoded bytes, or None if not cached."""
+        row = self._row(z, x, y)
+        return None if row is None else bytes(row[0])
+
+    def get(self, z, x, y):
+        """Returns the tile as a PIL image, or None if not cached."""
+        data = self.read(z, x, y)
+        if data is None:
+            return None
+        return Image.open(io.BytesIO(data)).convert("RGB")
+
+    def __contains__(self, tile):
+        return self._row(*tile) is not None
+
+
+def open_tile_cache(path):
+    """
+    Opens a `.mbtiles` file as a MBTilesCache, anything else as an XYZ
+    directory.
+    """
+    if path.endswith(".mbtiles"):
+        return MBTilesCache(path)
+    return XYZTileCache(path)
+
+
+def draw_legend(img, colour_scale):
+    """
+    Draws the proportion scheduled colour legend in the bottom right corner,
+    matching `build_legend_macro`.
+    """
+    labels = [
+        "0%",
+        "(0%, 50%)",
+        "[50%, 60%)",
+        "[60%, 70%)",
+        "[70%, 80%)",
+        "[80%, 90%)",
+        "[90%, 100%)",
+        ">=100%",
+    ]
+    font = ImageFont.load_default()
+    draw = ImageDraw.Draw(img, "RGBA")
+
+    width, height = 150, 20 + 18 * len(labels)
+    x0, y0 = img.width - width - 10, img.height - height - 200
+    draw.rectangle(
+        [x0, y0, x0 + width, y0 + height],
+        fill=(255, 255, 255, 204),
+        outline=(128, 128, 128, 255),
+        width=2,
+    )
+    draw.text((x0 + 8, y0 + 5), "Proportion Scheduled", fill=(0, 0, 0), font=font)
+    for i, (label, colour) in enumerate(zip(labels, colour_scale)):
+        top = y0 + 22 + 18 * i
+        r, g, b = Image.new("RGB", (1, 1), colour).getpixel((0, 0))
+        draw.rectangle(
+            [x0 + 8, top, x0 + 38, top + 14],
+            fill=(r, g, b, 128),
+            outline=(153, 153, 153, 255),
+        )
+        draw.text((x0 + 44, top + 1), label, fill=(0, 0, 0), font=font)
+
+
+def render_static_map(
+    df,
+    tile_cache,
+    bbox=None,
+    padding=(0, 0),
+    size=(1680, 1050),
+    colour_scale=None,
+    radius_col="radius",
+    attribution=OSM_ATTRIBUTION,
+):
+    """
+    Draws one day of station markers (coloured as by `get_colours`, sized by
+    the `radius_col` pixel radii from `scale_col`) over basemap tiles read from
+    `tile_cache`, returning a PIL image. `bbox` defaults to the extent of the
+    stations, as for the interactive map. Tiles missing from the cache are
+    left as a plain background, so this never needs a network connection.
+    """
+    logger = logging.getLogger(__name__)
+
+    if colour_scale is None:
+        colour_scale = COLOUR_SCALE
+
+    if bbox is None:
+        bbox = [
+            (df["Latitude"].min(), df["Longitude"].min()),
+            (df["Latitude"].max(), df["Longitude"].max()),
+        ]
+
+    zoom, (cx, cy) = fit_view(bbox, size, padding)
+    left, top = cx - size[0] / 2, cy - size[1] / 2
+
+    img = Image.new("RGB", size, BACKGROUND)
+    _, tiles = view_tile_offsets(bbox, size, padding)
+    missing = 0
+    for (z, x, y), offset in tiles:
+        tile = tile_cache.get(z, x, y)
+        if tile is None:
+            missing += 1
+            continue
+        img.paste(tile, offset)
+    if missing:
+        logger.warning(f"{missing} of {len(tiles)} tiles at zoom {zoom} not cached.")
+
+    xs, ys = lonlat_to_pixels(df["Longitude"], df["Latitude"], zoom)
+    xs, ys = xs - left, ys - top
+    radii = df[radius_col].to_numpy(dtype="float64")
+    colours = get_colours(
+        df["pct_timetabled_services_running"], colour_scale=colour_scale
+    )
+
+    # an "RGBA" draw blends each marker onto the image, as overlapping
+    # 50% opacity markers are in the browser
+    draw = ImageDraw.Draw(img, "RGBA")
+    visible = (
+        (xs + radii >= 0)
+        & (xs - radii <= size[0])
+        & (ys + radii >= 0)
+        & (ys - radii <= size[1])
+    )
+    for x, y, r, colour in zip(
+        xs[visible], ys[visible], radii[visible], colours[visible]
+    ):
+        red, green, blue = Image.new("RGB", (1, 1), colour).getpixel((0, 0))
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(red, green, blue, 128))
+
+    draw_legend(img, colour_scale)
+    if attribution:
+        font = ImageFont.load_default()
+        _, _, w, h = draw.textbbox((0, 0), attribution, font=font)
+        draw.rectangle(
+            [size[0] - w - 8, size[1] - h - 6, size[0], size[1]],
+            fill=(255, 255, 255, 179),
+        )
+        draw.text((size[0] - w - 4, size[1] - h - 4), attribution, fill=(0, 0, 0))
+
+    return img
+
+
+def build_raster_visuals(
+    folder_path, date, df, tile_cache, bboxes=None, size=(1680, 1050)
+):
+    """
+    Browserless equivalent of `build_static_visuals`: renders the views of
+    `static_views(bboxes)` from `df` (one day of stations) and a local tile
+    cache, saving pngs under the same names. Returns the seconds taken to
+    render and save each place.
+    """
+    logger = logging.getLogger(__name__)
+
+    if isinstance(tile_cache, str):
+        tile_cache = open_tile_cache(tile_cache)
+
+    render_seconds = {}
+    for place, bbox, padding in static_views(bboxes):
+        start = time.perf_counter()
+        img = render_static_map(df, tile_cache, bbox, padding, size)
+        img.save(
+            os.path.join(folder_path, f"full_uk_disruption_summary_{date}_{place}.png")
+        )
+        render_seconds[place] = round(time.perf_counter() - start, 4)
+        logger.info(f"Built {place} static visual.")
+
+    return render_seconds
+
+
+def hash_view_tiles(tile_cache, bboxes=None, size=(1680, 1050)):
+    """
+    Returns a hex digest of the cached tiles that `build_raster_visuals`
+    draws the views of `static_views(bboxes)` on, for render cache keys, so
+    that reseeding or restyling the tiles invalidates cached renders.
+    """
+    if isinstance(tile_cache, str):
+        tile_cache = open_tile_cache(tile_cache)
+
+    digest = hashlib.sha256()
+    for _, bbox, padding in static_views(bboxes):
+        for tile in tiles_for_view(bbox, size, padding)[1]:
+            data = tile_cache.read(*tile)
+            digest.update(f"{tile}:{-1 if data is None else len(data)}".encode())
+            digest.update(data or b"")
+    return digest.hexdigest()
+
+
+def seed_tile_cache(cache, views, size=(1680, 1050), url=OSM_TILES):
+    """
+    Downloads any tiles missing from an XYZ `cache` that are needed to render
+    `views` (a list of (bbox, padding)) at `size`. Only needed once, or when
+    the views change; rendering itself never goes online.
+    """
+    logger = logging.getLogger(__name__)
+
+    needed = set()
+    for bbox, padding in views:
+        needed.update(tiles_for_view(bbox, size, padding)[1])
+    to_fetch = sorted(tile for tile in needed if tile not in cache)
+    logger.info(f"{len(needed)} tiles needed, {len(to_fetch)} not yet cached.")
+
+    with requests.Session() as session:
+        # tile servers require an identifying user agent
+        session.headers["User-Agent"] = "rail_reporter static map tile seeding"
+        for z, x, y in to_fetch:
+            r = session.get(url.format(z=z, x=x, y=y), timeout=30)
+            r.raise_for_status()
+            cache.put(z, x, y, r.content)
+
+    return len(to_fetch)
+
+
+@click.command()
+@click.argument("cache_directory")
+@click.option("--tile_url", default=OSM_TILES, type=str)
+@click.option("--width", default=1680, type=int)
+@click.option("--height", default=1050, type=int)
+def main(cache_directory: str, tile_url: str, width: int, height: int):
+    """
+    Seeds an XYZ tile cache directory with the tiles needed for the GB and
+    regional static visuals, so they can then be rendered offline with
+    `make_visualisations.py --static_renderer raster`.
+
+    Args:
+        cache_directory (str): Directory of `<z>/<x>/<y>.png` tiles
+        tile_url (str): Tile server url template
+        width (int): Width of the static images in pixels
+        height (int): Height of the static images in pixels
+    """
+    logger = logging.getLogger(__name__)
+
+    views = [(bbox, padding) for _, bbox, padding in static_views(REGION_BBOXES)]
+    fetched = seed_tile_cache(
+        XYZTileCache(cache_directory), views, (width, height), tile_url
+    )
+    logger.info(f"Fetched {fetched} tiles into {cache_directory}")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+        filemode="a",
+    )
+
+    main()
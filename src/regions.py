@@ -0,0 +1,275 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+import click
+import numpy as np
+import pandas as pd
+
+from utils import REGION_BBOXES, read_disruption_summary
+
+try:
+    import shapely
+    from shapely.geometry import box, shape
+except ImportError:  # optional, only needed for GeoJSON regions
+    shapely = None
+
+
+def bbox_regions(bboxes=None):
+    """
+    Returns {name: [(lat_min, lon_min), (lat_max, lon_max)]} regions from a
+    dict of bboxes like `REGION_BBOXES` (the default).
+    """
+    if bboxes is None:
+        bboxes = REGION_BBOXES
+    return {
+        name: [tuple(corner) for corner in region["bbox"]]
+        for name, region in bboxes.items()
+    }
+
+
+def geojson_regions(path, name_property):
+    """
+    Returns {name: geometry} regions from the (multi)polygon features of a
+    local GeoJSON file, such as ITL or NUTS boundaries in WGS84, named by
+    their `name_property`.
+    """
+    if shapely is None:
+        raise ImportError("shapely is needed for GeoJSON regions")
+
+    with open(path, "r") as f:
+        collection = json.load(f)
+
+    return {
+        feature["properties"][name_property]: shape(feature["geometry"])
+        for feature in collection["features"]
+    }
+
+
+def unique_stations(stations_df):
+    """
+    Returns each distinct station (TIPLOC, Latitude, Longitude) in
+    `stations_df` once, such as from a summary with a row per station per
+    day, sorted by TIPLOC.
+    """
+    stations_df = stations_df[["TIPLOC", "Latitude", "Longitude"]].astype(
+        {"TIPLOC": str}
+    )
+    return (
+        stations_df.drop_duplicates()
+        .sort_values(["TIPLOC", "Latitude", "Longitude"])
+        .reset_index(drop=True)
+    )
+
+
+def hash_regions(stations_df, regions):
+    """
+    Returns a hex digest identifying the assignment of the stations in
+    `stations_df` to `regions`, for the assignment cache. Only the distinct
+    stations count, so summaries of any days of the same stations share it.
+    """
+    digest = hashlib.sha256()
+    for name, region in regions.items():
+        digest.update(name.encode("utf-8"))
+        digest.update(
+            region.wkb if hasattr(region, "wkb") else json.dumps(region).encode("utf-8")
+        )
+    digest.update(
+        pd.util.hash_pandas_object(
+            unique_stations(stations_df), index=False
+        ).values.tobytes()
+    )
+    return digest.hexdigest()
+
+
+def assign_regions(stations_df, regions):
+    """
+    Assigns each station (TIPLOC, Latitude, Longitude) in `stations_df` to
+    the first of `regions` containing it, from `bbox_regions` or
+    `geojson_regions`. Returns a frame of TIPLOC and region, leaving out
+    stations in no region.
+
+    Polygons are matched through a shapely STRtree over the region
+    geometries, so each station is only tested against the regions whose
+    bounds contain it. Bboxes, without shapely, are tested in one vectorised
+    comparison of every station with every box.
+    """
+    stations_df = stations_df.drop_duplicates("TIPLOC")
+    lats = stations_df["Latitude"].to_numpy(dtype="float64")
+    lons = stations_df["Longitude"].to_numpy(dtype="float64")
+    names = list(regions)
+
+    if shapely is not None:
+        geometries = [
+            box(region[0][1], region[0][0], region[1][1], region[1][0])
+            if isinstance(region, list)
+            else region
+            for region in regions.values()
+        ]
+        tree = shapely.STRtree(geometries)
+        station_pos, region_pos = tree.query(
+            shapely.points(lons, lats), predicate="intersects"
+        )
+    else:
+        if not all(isinstance(region, list) for region in regions.values()):
+            raise ImportError("shapely is needed for GeoJSON regions")
+        corners = np.array(list(regions.values()), dtype="float64")
+        inside = (
+            (lats[:, None] >= corners[None, :, 0, 0])
+            & (lats[:, None] <= corners[None, :, 1, 0])
+            & (lons[:, None] >= corners[None, :, 0, 1])
+            & (lons[:, None] <= corners[None, :, 1, 1])
+        )
+        station_pos, region_pos = np.nonzero(inside)
+
+    # first region for stations in more than one
+    order = np.lexsort((region_pos, station_pos))
+    station_pos, region_pos = station_pos[order], region_pos[order]
+    first = np.ones(len(station_pos), dtype=bool)
+    first[1:] = station_pos[1:] != station_pos[:-1]
+
+    return pd.DataFrame(
+        {
+            "TIPLOC": stations_df["TIPLOC"].to_numpy()[station_pos[first]],
+            "region": np.asarray(names, dtype=object)[region_pos[first]],
+        }
+    )
+
+
+def cached_region_assignment(stations_df, regions, cache_directory=None):
+    """
+    Returns `assign_regions(stations_df, regions)`, reading it from
+    `cache_directory` when the same stations and regions have been assigned
+    before, and saving it there otherwise. Each distinct station is only
+    assigned once.
+    """
+    logger = logging.getLogger(__name__)
+
+    stations_df = unique_stations(stations_df)
+
+    if cache_directory is None:
+        return assign_regions(stations_df, regions)
+
+    cache_path = os.path.join(
+        cache_directory, f"regions_{hash_regions(stations_df, regions)[:16]}.csv"
+    )
+    if os.path.exists(cache_path):
+        logger.info(f"Read region assignment from {cache_path}")
+        return pd.read_csv(cache_path, dtype=str)
+
+    assignment = assign_regions(stations_df, regions)
+    os.makedirs(cache_directory, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    assignment.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Saved region assignment to {cache_path}")
+
+    return assignment
+
+
+def regional_totals(df, assignment):
+    """
+    Returns daily totals of journeys timetabled and scheduled, the number of
+    stations, and the percentage running, for each region of `assignment`
+    (from `assign_regions`), over a `build_timetable.py` summary `df`. Only
+    stations with timetabled services are counted, as on the maps.
+    """
+    df = df[~df["pct_timetabled_services_running"].isna()]
+    region_map = assignment.set_index("TIPLOC")["region"]
+    regions = df["TIPLOC"].astype(str).map(region_map)
+    df, regions = df[regions.notna().to_numpy()], regions.dropna()
+
+    region_codes, region_names = pd.factorize(regions)
+    date_codes, dates = pd.factorize(df["date"], sort=True)
+    cells = region_codes * len(dates) + date_codes
+    no_cells = len(region_names) * len(dates)
+
+    counts = {
+        "stations": np.bincount(cells, minlength=no_cells),
+        "journeys_timetabled": np.bincount(
+            cells,
+            weights=df["journeys_timetabled"].to_numpy(dtype="float64"),
+            minlength=no_cells,
+        ),
+        "journeys_scheduled": np.bincount(
+            cells,
+            weights=df["journeys_scheduled"].to_numpy(dtype="float64"),
+            minlength=no_cells,
+        ),
+    }
+
+    totals = pd.DataFrame(
+        {
+            "region": np.repeat(np.asarray(region_names), len(dates)),
+            "date": np.tile(np.asarray(dates), len(region_names)),
+            **{col: values.astype("int64") for col, values in counts.items()},
+        }
+    )
+    totals = totals[totals["stations"] > 0]
+    totals["pct_timetabled_services_running"] = (
+        totals["journeys_scheduled"] / totals["journeys_timetabled"] * 100
+    ).round(2)
+
+    return totals.sort_values(["region", "date"]).reset_index(drop=True)
+
+
+@click.command()
+@click.argument("input_path")
+@click.option("--regions_geojson", default=None, type=str)
+@click.option("--name_property", default=None, type=str)
+@click.option(
+    "--cache_directory", default=os.getenv("DIR_OUTPUTS_REGION_CACHE"), type=str
+)
+@click.option("--output_path", default=None, type=str)
+def main(
+    input_path: str,
+    regions_geojson: str,
+    name_property: str,
+    cache_directory: str,
+    output_path: str,
+):
+    """
+    Summarises a `build_timetable.py` output by region and day.
+
+    Arguments:
+        input_path -- `build_timetable.py` parquet dataset or csv export
+    """
+    logger = logging.getLogger(__name__)
+
+    if regions_geojson is None:
+        regions = bbox_regions()
+        logger.info(f"Using REGION_BBOXES regions: {', '.join(regions)}")
+    else:
+        regions = geojson_regions(regions_geojson, name_property)
+        logger.info(f"Read {len(regions)} regions from {regions_geojson}")
+
+    df = read_disruption_summary(input_path)
+    logger.info(f"Opened {input_path}")
+
+    assignment = cached_region_assignment(
+        df[["TIPLOC", "Latitude", "Longitude"]], regions, cache_directory
+    )
+    logger.info(f"Assigned {len(assignment)} stations to regions.")
+
+    totals = regional_totals(df, assignment)
+
+    if output_path is None:
+        output_path = f"{os.path.splitext(input_path)[0]}_regions.csv"
+    totals.to_csv(output_path, index=False)
+    logger.info(f"Regional totals exported to {output_path}")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
@@ -0,0 +1,173 @@
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from folium.utilities import temp_html_filepath
+from PIL import Image
+from selenium import webdriver
+
+
+# JS predicate for `StaticMapRenderer`, true once the view has settled,
+# every tile layer on the map has finished loading and fading in, and every
+# time dimension (data) layer is ready for the current time, which for
+# sidecar data (`add_lazy_timestamped_geojson`) waits on its fetch
+MAP_SETTLED_JS = """
+var map = window[arguments[0]];
+if (map === undefined || !map._loaded || map._animatingZoom) {
+    return false;
+}
+var time = map.timeDimension ? map.timeDimension.getCurrentTime() : null;
+var settled = true;
+var dataLayers = 0;
+map.eachLayer(function (layer) {
+    if (layer instanceof L.GridLayer && (layer._loading || layer._fadeFrame)) {
+        settled = false;
+    }
+    if (L.TimeDimension !== undefined && layer instanceof L.TimeDimension.Layer) {
+        dataLayers += 1;
+        if (
+            !layer.isReady(time)
+            || (layer._currentLayer && !map.hasLayer(layer._currentLayer))
+        ) {
+            settled = false;
+        }
+    }
+});
+// maps with a time dimension are settled once their data layer is added
+return settled && (time === null || dataLayers > 0);
+"""
+
+
+class StaticMapRenderer:
+    """
+    Renders static images of a folium map from one headless firefox session.
+    The map html is loaded once, then each view is set by panning/zooming in
+    JavaScript, waiting for the map's tile and data layers to report they
+    are loaded rather than sleeping for a fixed time.
+
+    Use as a context manager, so the browser is always shut down.
+
+    Attribution:
+    Built up from the Folium `_to_png` method of the `map` class, which was
+    not fit for purpose in this use case. The original code snippet can be
+    found here:
+    https://github.com/python-visualization/folium/blob/76647fed2c9f279c57825b1
+    fe01d34c129089ff8/folium/folium.py#L324-#L356
+    Within Folium's main repository:
+    https://github.com/python-visualization/folium
+    """
+
+    def __init__(self, html_path, map_name, timeout=60, window_size=(1680, 1050)):
+        self.html_path = html_path
+        self.map_name = map_name
+        self.timeout = timeout
+        self.window_size = window_size
+        self.driver = None
+
+    def __enter__(self):
+        options = webdriver.firefox.options.Options()
+        options.add_argument("--headless")
+        self.driver = webdriver.Firefox(options=options)
+        self.driver.set_window_position(0, 0)
+        self.driver.set_window_size(*self.window_size)
+        self.driver.get("file:///{path}".format(path=self.html_path))
+        self.wait_until_settled()
+
+        # remember the initial (full) view, so it can be restored
+        self.driver.execute_script(
+            "var map = window[arguments[0]];"
+            "window.__homeView = [map.getCenter(), map.getZoom()];",
+            self.map_name,
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+
+    def wait_until_settled(self):
+        """
+        Polls the page until the map has settled, logging a warning (and
+        carrying on) if that takes longer than `timeout` seconds.
+        """
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.driver.execute_script(MAP_SETTLED_JS, self.map_name):
+                return True
+            time.sleep(0.1)
+
+        logging.getLogger(__name__).warning(
+            f"Map tiles or data not loaded after {self.timeout}s, rendering anyway."
+        )
+        return False
+
+    def render(self, bbox=None, padding=(0, 0)):
+        """
+        Sets the map view to `bbox` ([(lat, lon), (lat, lon)], with `padding`
+        as in `folium.Map.fit_bounds`), or the initial view if None, and
+        returns a screenshot as a PIL image.
+        """
+        if bbox is None:
+            self.driver.execute_script(
+                "var map = window[arguments[0]];"
+                "map.setView(window.__homeView[0], window.__homeView[1],"
+                " {animate: false});",
+                self.map_name,
+            )
+        else:
+            self.driver.execute_script(
+                "window[arguments[0]].fitBounds(arguments[1],"
+                " {padding: arguments[2], animate: false});",
+                self.map_name,
+                [list(corner) for corner in bbox],
+                list(padding),
+            )
+        self.wait_until_settled()
+
+        return Image.open(io.BytesIO(self.driver.get_screenshot_as_png()))
+
+
+def build_static_visuals(folder_path, date, m, bboxes=None, workers=1, timeout=60):
+    """
+    Renders the GB (initial) view of the folium map, and a view of each
+    place in `bboxes` ({place: {"bbox": ..., "padding": ...}}), to
+    `full_uk_disruption_summary_<date>_<place>.png` pngs. The map html is
+    rendered once, and each of up to `workers` browser sessions renders its
+    share of the places.
+    Returns the seconds taken to render and save each place.
+    """
+    views = [("GB", None, (0, 0))]
+    for place, view in (bboxes or {}).items():
+        views.append((place, view["bbox"], view.get("padding", (0, 0))))
+
+    workers = max(1, min(workers, len(views)))
+    batches = [views[i::workers] for i in range(workers)]
+
+    def render_batch(html_path, batch):
+        seconds = {}
+        with StaticMapRenderer(html_path, m.get_name(), timeout=timeout) as renderer:
+            for place, bbox, padding in batch:
+                start = time.perf_counter()
+                img = renderer.render(bbox, padding)
+                img.save(
+                    os.path.join(
+                        folder_path, f"full_uk_disruption_summary_{date}_{place}.png"
+                    )
+                )
+                seconds[place] = round(time.perf_counter() - start, 4)
+                logging.getLogger(__name__).info(f"Built {place} static visual.")
+        return seconds
+
+    html = m.get_root().render()
+    render_seconds = {}
+    with temp_html_filepath(html) as fname:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # iterating re-raises any exception from the workers
+            for seconds in executor.map(
+                lambda batch: render_batch(fname, batch), batches
+            ):
+                render_seconds.update(seconds)
+    return render_seconds
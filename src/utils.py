@@ -14,14 +14,17 @@ import pandas as pd
 import calendar
 import glob
 import base64
-import io
+import hashlib
+import json
+import shutil
 import time
 from pyprojroot import here
 
 import pandas as pd
 import numpy as np
 from convertbng.util import convert_lonlat
-import geopandas as gpd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import folium
 from folium.plugins import (
     FloatImage,
@@ -29,15 +32,54 @@ from folium.plugins import (
     Geocoder,
     MeasureControl,
     MiniMap,
-    TimestampedGeoJson,
 )
-from folium.utilities import temp_html_filepath
-from selenium import webdriver
 
 from branca.element import MacroElement, Template
-from shapely.geometry import mapping
 from PIL import Image, ImageDraw, ImageFont
 
+# categorical, sequential colour scale - BuRd
+COLOUR_SCALE = [
+    "#000000",
+    "#8b0000",
+    "#ff0000",
+    "#ff0066",
+    "#ff00cc",
+    "#cc00ff",
+    "#6600ff",
+    "#0000ff",
+]
+
+# bin edges (in % of timetabled services running) between COLOUR_SCALE[1:]
+COLOUR_BINS = [50, 60, 70, 80, 90, 100]
+
+# regions rendered as static visuals, with `fit_bounds` padding in pixels
+REGION_BBOXES = {
+    "london": {
+        "bbox": [(51.312, -0.597), (51.659, 0.271)],
+        "padding": (-50, -50),
+    },
+    "midlands": {
+        "bbox": [(52.0564, -2.7160), (52.6369, -1.1398)],
+        "padding": (-60, -60),
+    },
+    "northwest": {
+        "bbox": [(53.1839, -3.4250), (53.9614, -1.0739)],
+        "padding": (-80, -80),
+    },
+    "northengland": {
+        "bbox": [(54.4035, -3.2326), (55.0393, 0)],
+        "padding": (-50, -50),
+    },
+    "scotland": {
+        "bbox": [(55.6800, -4.5136), (56.1745, -3.0308)],
+        "padding": (-30, -30),
+    },
+    "southwales": {
+        "bbox": [(51.196675, -4.727855), (52.001908, -2.111735)],
+        "padding": (-90, -90),
+    },
+}
+
 
 def request_with_fails(url, savepath):
     """
@@ -101,21 +143,41 @@ def breakout_DTD_filename(filename: str):
     }
 
 
+def read_dump_date(zip_path):
+    """
+    Returns the date an ATOC zip was "dumped", from the extract date in the
+    header record of its .MCA file, or None if it has no header.
+    """
+    with ZipFile(zip_path, "r") as zip:
+        mca_names = [name for name in zip.namelist() if name.endswith(".MCA")]
+        if not mca_names:
+            return None
+        with zip.open(mca_names[0]) as f:
+            header = f.readline().decode("ascii", errors="replace")
+
+    if header[:2] != "HD":
+        return None
+    return datetime.strptime(header[22:28], "%d%m%y").date()
+
+
 def unpack_atoc_data(folder_path, zip_name, dump_date):
     """Unpacks atoc zip file."""
     with ZipFile(os.path.join(folder_path, zip_name), "r") as zip:
         zip.extractall(os.path.join(folder_path, f"atoc_{dump_date}"))
 
 
+def mca_file_path(folder_path, zip_name, dump_date):
+    """Returns the path of the .MCA file unpacked by `unpack_atoc_data`."""
+    mca_file_name = zip_name.strip(".ZIP") + ".MCA"
+    return os.path.join(folder_path, f"atoc_{dump_date}", mca_file_name)
+
+
 def cut_mca_to_size(folder_path, zip_name, dump_date):
     """
     Reads and formats the .MCA files, detecting the first information row and
     so skipping metadata at the top of the file.
     """
-    mca_file_name = zip_name.strip(".ZIP") + ".MCA"
-    mca_file_path = os.path.join(folder_path, f"atoc_{dump_date}", mca_file_name)
-
-    with open(mca_file_path, "r") as f:
+    with open(mca_file_path(folder_path, zip_name, dump_date), "r") as f:
         lines = f.readlines()
 
     # remove leading rows and start from first timetabled journey
@@ -470,6 +532,168 @@ def filter_to_dft_time(
     return pd.concat([core_journeys, small_journeys])
 
 
+# weekday columns of the parsed schedules, in `date.weekday()` order
+WEEKDAYS = list(calendar.day_name)
+
+# columns of the daily station summaries, as built by `summarise_day`
+SUMMARY_COLUMNS = [
+    "TIPLOC",
+    "journeys_scheduled",
+    "journeys_timetabled",
+    "pct_timetabled_services_running",
+    "Station_Name",
+    "Latitude",
+    "Longitude",
+    "date",
+]
+
+
+def count_day_journeys(calendar_df, cancelled_df, dates):
+    """
+    Resolves the services running on each of `dates` from the parsed
+    schedules, by the same rules as `summarise_day`, with boolean masks over
+    integer coded rows rather than pandas filters, concats and `isin`
+    lookups on strings. Returns the TIPLOCs of `calendar_df`, and arrays of
+    shape (len(dates), len(tiplocs)) of the journeys timetabled and scheduled
+    at each, before limiting them to stations.
+
+    The legacy rules are kept as they are, including their quirks: a row is
+    counted once for each of the core (0200-2359) and small hours start
+    sets its Identifier is in, and a schedule is cancelled when any service
+    with its Identifier starts on a day its cancellation runs. Only rows with
+    the same Identifier affect each other, so counts of schedules split by
+    Identifier add up to those of the whole.
+    """
+    identifier_codes, _ = pd.factorize(
+        pd.concat([calendar_df["Identifier"], cancelled_df["Identifier"]]),
+        use_na_sentinel=False,
+    )
+    no_identifiers = identifier_codes.max(initial=-1) + 1
+    row_ids = identifier_codes[: len(calendar_df)]
+    canc_ids = identifier_codes[len(calendar_df) :]
+
+    tiploc_codes, tiplocs = pd.factorize(calendar_df["TIPLOC"], use_na_sentinel=False)
+
+    runs_on = calendar_df[WEEKDAYS].to_numpy() == "1"
+    valid_from = calendar_df["Valid_from"].to_numpy().astype("int64")
+    valid_to = calendar_df["Valid_to"].to_numpy().astype("int64")
+    small_hours = calendar_df["Small_hours"].to_numpy() == 1
+    flags = calendar_df["Flag"].to_numpy()
+    is_timetabled = flags == "P"
+    is_perm_new = (flags == "P") | (flags == "N")
+    is_overlay = flags == "O"
+
+    # start rows and their times, compared as strings like the legacy filters
+    times = calendar_df["Time"]
+    is_start = calendar_df["Stop"].to_numpy() == 1
+    core_start = is_start & (times >= "0200").to_numpy()
+    small_start = is_start & (times < "0200").to_numpy()
+    day1_start = core_start & (times <= "2359").to_numpy()
+    day2_start = small_start & (times >= "0000").to_numpy()
+
+    canc_runs_on = cancelled_df[WEEKDAYS].to_numpy() == "1"
+    canc_from = cancelled_df["Valid_from"].to_numpy().astype("int64")
+    canc_to = cancelled_df["Valid_to"].to_numpy().astype("int64")
+
+    def identifier_mask(rows):
+        mask = np.zeros(no_identifiers, dtype=bool)
+        mask[row_ids[rows]] = True
+        return mask
+
+    def canc_identifier_mask(rows):
+        mask = np.zeros(no_identifiers, dtype=bool)
+        mask[canc_ids[rows]] = True
+        return mask
+
+    timetabled = np.zeros((len(dates), len(tiplocs)), dtype="int64")
+    scheduled = np.zeros((len(dates), len(tiplocs)), dtype="int64")
+    for day, date in enumerate(dates):
+        d1 = int(date.strftime("%y%m%d"))
+        d2 = int((date + timedelta(1)).strftime("%y%m%d"))
+        weekday1 = date.weekday()
+        weekday2 = (weekday1 + 1) % 7
+
+        # `filter_to_date`, then `filter_to_dft_time`
+        today = (
+            runs_on[:, weekday1] & (valid_from <= d1) & (valid_to >= d1) & ~small_hours
+        ) | (runs_on[:, weekday2] & (valid_from <= d2) & (valid_to >= d2) & small_hours)
+        multiplicity = today * (
+            identifier_mask(today & core_start)[row_ids].astype("int64")
+            + identifier_mask(today & small_start)[row_ids]
+        )
+        running = multiplicity > 0
+
+        # `filter_to_date(..., cancellations=True)`, then
+        # `filter_to_date_cancellations`
+        day1_ids = identifier_mask(running & day1_start & runs_on[:, weekday1])
+        day2_ids = identifier_mask(running & day2_start & runs_on[:, weekday2])
+        canc_today = (
+            (canc_runs_on[:, weekday1] & (canc_from <= d1) & (canc_to >= d1))
+            | (canc_runs_on[:, weekday2] & (canc_from <= d2) & (canc_to >= d2))
+        ) & (
+            (day1_ids[canc_ids] & canc_runs_on[:, weekday1])
+            | (day2_ids[canc_ids] & canc_runs_on[:, weekday2])
+        )
+        replaced = canc_identifier_mask(canc_today) | identifier_mask(
+            running & is_overlay
+        )
+
+        scheduled_rows = np.where(
+            is_perm_new & ~replaced[row_ids], multiplicity, 0
+        ) + np.where(is_overlay, multiplicity, 0)
+
+        timetabled[day] = np.bincount(
+            tiploc_codes,
+            weights=np.where(is_timetabled, multiplicity, 0),
+            minlength=len(tiplocs),
+        )
+        scheduled[day] = np.bincount(
+            tiploc_codes, weights=scheduled_rows, minlength=len(tiplocs)
+        )
+
+    return np.asarray(tiplocs), timetabled, scheduled
+
+
+def summarise_day_journeys(tiplocs, timetabled, scheduled, station_tiplocs, dates):
+    """
+    Turns the journeys counted at each TIPLOC on each of `dates` (see
+    `count_day_journeys`) into the station summaries `summarise_day` builds,
+    for every day in one DataFrame. As there, stations listed more than once
+    in `station_tiplocs` count their scheduled stops once per listing.
+    """
+    listings = (
+        station_tiplocs["TIPLOC"]
+        .value_counts()
+        .reindex(tiplocs, fill_value=0)
+        .to_numpy()
+    )
+    stations = station_tiplocs[["TIPLOC", "Station_Name", "Latitude", "Longitude"]]
+
+    outputs = []
+    for day, date in enumerate(dates):
+        day_scheduled = scheduled[day] * listings
+
+        # the outer merge of the two counts, at stations only
+        keep = ((timetabled[day] > 0) & (listings > 0)) | (day_scheduled > 0)
+        output = pd.DataFrame(
+            {
+                "TIPLOC": tiplocs[keep],
+                "journeys_scheduled": day_scheduled[keep],
+                "journeys_timetabled": np.where(
+                    timetabled[day][keep] > 0, timetabled[day][keep], np.nan
+                ),
+            }
+        )
+        output["pct_timetabled_services_running"] = np.round(
+            output["journeys_scheduled"] / output["journeys_timetabled"] * 100, 2
+        )
+        output = output.merge(stations, on="TIPLOC", how="inner")
+        output["date"] = date.strftime("%Y-%m-%d")
+        outputs.append(output)
+
+    return pd.concat(outputs, ignore_index=True)[SUMMARY_COLUMNS]
+
+
 def get_most_recent_file(folder_path: str, file_type: str = r"/*ZIP"):
 
     # retrieve list of files matching the folder path and file type
@@ -482,15 +706,459 @@ def get_most_recent_file(folder_path: str, file_type: str = r"/*ZIP"):
     return os.path.basename(latest_file)
 
 
-def convert_to_gpdf(df, lat_col="Latitude", long_col="Longitude"):
-    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df[long_col], df[lat_col]))
+# summaries are stored as parquet datasets partitioned into date=YYYY-MM-DD
+# folders, so readers can skip days they do not need
+SUMMARY_PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.date32())]), flavor="hive"
+)
+
+
+def write_disruption_summary(df, output_path):
+    """
+    Writes a `build_timetable.py` disruption summary to a parquet dataset at
+    `output_path`, partitioned by date, with the date stored as a date, the
+    journey counts as integers and TIPLOC as a categorical. Any existing
+    partitions for the same dates are replaced.
+    """
+    df = df.reset_index(drop=True).assign(
+        TIPLOC=df["TIPLOC"].astype("category").values,
+        journeys_scheduled=df["journeys_scheduled"].astype("int64").values,
+        # stations with only STP services have no timetabled count
+        journeys_timetabled=df["journeys_timetabled"].astype("Int64").values,
+        date=pd.to_datetime(df["date"], format="%Y-%m-%d").dt.date.values,
+    )
+
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        output_path,
+        format="parquet",
+        partitioning=SUMMARY_PARTITIONING,
+        existing_data_behavior="delete_matching",
+    )
+
+
+def write_breakdown_summary(df, output_path, categorical_cols):
+    """
+    Writes a breakdown of journey counts (e.g. `build_operator_summary` or
+    `build_edge_summary`) to a parquet dataset at `output_path`, partitioned by
+    date as `write_disruption_summary`, with `categorical_cols` as
+    categoricals. It can be read back with `read_disruption_summary`.
+    """
+    df = df.reset_index(drop=True).assign(
+        **{col: df[col].astype("category").values for col in categorical_cols},
+        journeys_timetabled=df["journeys_timetabled"].astype("int64").values,
+        journeys_scheduled=df["journeys_scheduled"].astype("int64").values,
+        date=pd.to_datetime(df["date"], format="%Y-%m-%d").dt.date.values,
+    )
+
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        output_path,
+        format="parquet",
+        partitioning=SUMMARY_PARTITIONING,
+        existing_data_behavior="delete_matching",
+    )
+
 
+def read_disruption_summary(input_path, start_date=None, end_date=None):
+    """
+    Reads a disruption summary written by `build_timetable.py`, either the
+    partitioned parquet dataset or the optional csv export, keeping only
+    dates between `start_date` and `end_date` inclusive (either may be None
+    for an open range). For parquet, only the matching date partitions are
+    read. The `date` column is returned as `datetime.date` values.
+    """
+    if input_path.endswith(".csv"):
+        df = pd.read_csv(input_path)
+        # exports from before `index=False` lead with the unnamed row index
+        if df.columns[0] == "Unnamed: 0":
+            df = df.drop(columns=df.columns[0])
+        df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d").dt.date
+        if start_date is not None:
+            df = df[df["date"] >= start_date]
+        if end_date is not None:
+            df = df[df["date"] <= end_date]
+        return df.reset_index(drop=True)
+
+    date_filter = None
+    if start_date is not None:
+        date_filter = ds.field("date") >= start_date
+    if end_date is not None:
+        end_filter = ds.field("date") <= end_date
+        date_filter = end_filter if date_filter is None else date_filter & end_filter
+
+    dataset = ds.dataset(
+        input_path, format="parquet", partitioning=SUMMARY_PARTITIONING
+    )
+    return dataset.to_table(filter=date_filter).to_pandas()
 
-def add_folium_times(s: pd.Series, times_prop_name: str) -> list:
-    """Utility function to extend times_prop_name column to a list that
-    matches the geometry shape - requirement for folium timestampedGeoJSON
-    function"""
-    return [s[times_prop_name]]
+
+def get_station_index(rows_df, station_codes):
+    """
+    Returns the position of each row's TIPLOC in the sorted array
+    `station_codes`, and a mask of the rows whose TIPLOC is in it.
+    """
+    station_codes = np.asarray(station_codes)
+    tiplocs = rows_df["TIPLOC"].to_numpy()
+    station_idx = np.searchsorted(station_codes, tiplocs)
+    station_idx = np.minimum(station_idx, len(station_codes) - 1)
+    return station_idx, station_codes[station_idx] == tiplocs
+
+
+def count_station_hours(rows_df, station_codes):
+    """
+    Counts the rows of a long-format schedule by station and hour of `Time`,
+    with one 2D `bincount`, returning an array of shape
+    (len(station_codes), 24). `station_codes` must be sorted; rows at other
+    TIPLOCs, or without a valid time, are not counted.
+    """
+    station_idx, is_station = get_station_index(rows_df, station_codes)
+
+    hours = pd.to_numeric(rows_df["Time"].str[:2], errors="coerce").to_numpy()
+    keep = is_station & (hours >= 0) & (hours < 24)
+
+    counts = np.bincount(
+        station_idx[keep] * 24 + hours[keep].astype("int64"),
+        minlength=len(station_codes) * 24,
+    )
+    return counts.reshape(len(station_codes), 24)
+
+
+def count_station_operators(rows_df, station_codes, no_operators):
+    """
+    Counts the rows of a long-format schedule by station and the integer
+    `Operator_code` column (see `encode_operators`), with one 2D `bincount`,
+    returning an array of shape (len(station_codes), no_operators).
+    """
+    station_idx, is_station = get_station_index(rows_df, station_codes)
+    operator_idx = rows_df["Operator_code"].to_numpy()
+
+    counts = np.bincount(
+        station_idx[is_station] * no_operators + operator_idx[is_station],
+        minlength=len(station_codes) * no_operators,
+    )
+    return counts.reshape(len(station_codes), no_operators)
+
+
+def encode_operators(calendar_df):
+    """
+    Adds an integer `Operator_code` column to `calendar_df`, indexing the
+    sorted array of operator codes it returns alongside.
+    """
+    operators = calendar_df["Operator"].fillna("").astype(str)
+    operator_codes = np.sort(operators.unique())
+    return (
+        calendar_df.assign(Operator_code=np.searchsorted(operator_codes, operators)),
+        operator_codes,
+    )
+
+
+def build_operator_summary(station_codes, operator_codes, dates, timetabled, scheduled):
+    """
+    Turns station x operator counts per day (arrays of shape (len(dates),
+    len(station_codes), len(operator_codes))) into a long-format summary with
+    a row for each station, operator and day with any services.
+    """
+    day_idx, station_idx, operator_idx = np.nonzero((timetabled > 0) | (scheduled > 0))
+
+    df = pd.DataFrame(
+        {
+            "TIPLOC": np.asarray(station_codes)[station_idx],
+            "Operator": np.asarray(operator_codes)[operator_idx],
+            "journeys_timetabled": timetabled[day_idx, station_idx, operator_idx],
+            "journeys_scheduled": scheduled[day_idx, station_idx, operator_idx],
+            "date": np.asarray([str(date) for date in dates])[day_idx],
+        }
+    )
+    df["pct_timetabled_services_running"] = np.round(
+        df["journeys_scheduled"] / df["journeys_timetabled"].replace(0, np.nan) * 100,
+        2,
+    )
+    return df
+
+
+def count_station_edges(rows_df, station_codes):
+    """
+    Counts the services running between each pair of consecutive station
+    stops in a long-format schedule, in either direction. Rows must be in
+    schedule order, as parsed, with non-station rows (e.g. flybys) already
+    removed or outside `station_codes`. Returns a Series of counts indexed by
+    edge code, `low_idx * len(station_codes) + high_idx` for the positions of
+    the two stations in `station_codes`.
+    """
+    station_idx, is_station = get_station_index(rows_df, station_codes)
+    station_idx = station_idx[is_station]
+    identifiers = rows_df["Identifier"].to_numpy()[is_station]
+    stops = rows_df["Stop"].to_numpy()[is_station]
+
+    # each stop paired with the next, if it belongs to the same service run
+    # (`Stop` restarts from 1 at every schedule, and repeated runs)
+    same_run = (identifiers[1:] == identifiers[:-1]) & (stops[1:] > stops[:-1])
+    from_idx = station_idx[:-1][same_run]
+    to_idx = station_idx[1:][same_run]
+    keep = from_idx != to_idx
+
+    edge_codes = (
+        np.minimum(from_idx, to_idx)[keep] * len(station_codes)
+        + np.maximum(from_idx, to_idx)[keep]
+    )
+    return pd.Series(edge_codes).value_counts()
+
+
+def build_edge_summary(station_codes, dates, timetabled, scheduled):
+    """
+    Turns the per day edge counts from `count_station_edges` (lists of
+    Series, one per date) into a long-format summary, with a row for each
+    station pair and day with any services.
+    """
+    station_codes = np.asarray(station_codes)
+    days = []
+    for date, day_timetabled, day_scheduled in zip(dates, timetabled, scheduled):
+        day = pd.concat(
+            [
+                day_timetabled.rename("journeys_timetabled"),
+                day_scheduled.rename("journeys_scheduled"),
+            ],
+            axis=1,
+        ).fillna(0)
+        edge_codes = day.index.to_numpy(dtype="int64")
+        days.append(
+            pd.DataFrame(
+                {
+                    "from_TIPLOC": station_codes[edge_codes // len(station_codes)],
+                    "to_TIPLOC": station_codes[edge_codes % len(station_codes)],
+                    "journeys_timetabled": day["journeys_timetabled"]
+                    .to_numpy()
+                    .astype("int64"),
+                    "journeys_scheduled": day["journeys_scheduled"]
+                    .to_numpy()
+                    .astype("int64"),
+                    "date": str(date),
+                }
+            )
+        )
+
+    df = pd.concat(days, ignore_index=True)
+    df["pct_timetabled_services_running"] = np.round(
+        df["journeys_scheduled"] / df["journeys_timetabled"].replace(0, np.nan) * 100,
+        2,
+    )
+    return df
+
+
+def build_operator_totals(operator_df):
+    """
+    Sums an operator summary (see `build_operator_summary`) over stations,
+    giving daily totals for each operator and, as Operator "ALL", nationally.
+    """
+    per_operator = (
+        operator_df.groupby(["date", "Operator"], observed=True)[
+            ["journeys_timetabled", "journeys_scheduled"]
+        ]
+        .sum()
+        .reset_index()
+    )
+    national = (
+        per_operator.groupby("date")[["journeys_timetabled", "journeys_scheduled"]]
+        .sum()
+        .reset_index()
+        .assign(Operator="ALL")
+    )
+
+    totals = pd.concat([national, per_operator], ignore_index=True)
+    totals["pct_timetabled_services_running"] = np.round(
+        totals["journeys_scheduled"]
+        / totals["journeys_timetabled"].replace(0, np.nan)
+        * 100,
+        2,
+    )
+    return totals.sort_values(["date", "Operator"]).reset_index(drop=True)[
+        [
+            "date",
+            "Operator",
+            "journeys_timetabled",
+            "journeys_scheduled",
+            "pct_timetabled_services_running",
+        ]
+    ]
+
+
+def hourly_profile_path(summary_path):
+    """
+    Returns where the hourly profile of a disruption summary is stored,
+    alongside the summary itself.
+    """
+    return f"{os.path.splitext(summary_path)[0]}_hourly.npz"
+
+
+def write_hourly_profile(path, station_codes, dates, timetabled, scheduled):
+    """
+    Saves the station x day x hour cubes of journeys timetabled and scheduled
+    (arrays of shape (len(dates), len(station_codes), 24)) to a compressed
+    npz file, as 16 bit counts.
+    """
+    np.savez_compressed(
+        path,
+        tiplocs=np.asarray(station_codes, dtype=str),
+        dates=np.asarray([str(date) for date in dates]),
+        timetabled=np.asarray(timetabled, dtype="uint16"),
+        scheduled=np.asarray(scheduled, dtype="uint16"),
+    )
+
+
+def read_hourly_profile(path):
+    """
+    Loads an hourly profile saved by `write_hourly_profile`, as a dict of
+    `tiplocs`, `dates` (YYYY-MM-DD strings), `timetabled` and `scheduled`.
+    """
+    with np.load(path) as profile:
+        return {key: profile[key] for key in profile.files}
+
+
+def lookup_hourly_profiles(df, profile, times_col="date"):
+    """
+    Returns the hourly journeys timetabled and scheduled for each row of a
+    disruption summary, as two (len(df), 24) arrays, and a mask of the rows
+    found in `profile`.
+    """
+    day_idx = pd.Index(profile["dates"]).get_indexer(df[times_col].astype(str))
+    station_idx = pd.Index(profile["tiplocs"]).get_indexer(df["TIPLOC"].astype(str))
+    found = (day_idx >= 0) & (station_idx >= 0)
+
+    timetabled = profile["timetabled"][day_idx, station_idx]
+    scheduled = profile["scheduled"][day_idx, station_idx]
+    return timetabled, scheduled, found
+
+
+def station_edges_path(summary_path):
+    """
+    Returns where the station pair (edge) counts of a disruption summary are
+    stored, alongside the summary itself.
+    """
+    return f"{os.path.splitext(summary_path)[0]}_edges.parquet"
+
+
+# source files whose code and templates shape the rendered maps
+RENDER_SOURCES = [
+    "utils.py",
+    "map_features.py",
+    "map_layers.py",
+    "static_maps.py",
+    "raster_maps.py",
+    "make_visualisations.py",
+]
+
+
+def hash_render_code():
+    """
+    Returns a hex digest of `RENDER_SOURCES` and the folium version, so
+    that `RenderCache` entries rendered by other code are not reused.
+    """
+    digest = hashlib.sha256(folium.__version__.encode("utf-8"))
+    for file in RENDER_SOURCES:
+        with open(os.path.join(os.path.dirname(__file__), file), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def hash_render_inputs(df, options: dict, arrays: dict = None):
+    """
+    Returns a hex digest identifying the maps rendered from `df` (and any
+    other numpy `arrays` {name: array}, such as an hourly profile) with the
+    render `options` (any JSON serialisable dict), for `RenderCache` keys.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(json.dumps([str(col) for col in df.columns]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    for name, array in sorted((arrays or {}).items()):
+        digest.update(f"{name}:{array.dtype}:{array.shape}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Stores rendered map artefacts (files or folders) under `<root>/<key>/`, so
+    that a later render of the same inputs can copy them into place rather
+    than rebuilding them. Entries are pruned least recently used first.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def restore(self, key, artefacts: dict):
+        """
+        Copies each cached artefact {name: destination path} for `key` into
+        place, returning False (and copying nothing) on a cache miss.
+        """
+        entry_path = os.path.join(self.root, key)
+        manifest_path = os.path.join(entry_path, "artefacts.json")
+        if not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path, "r") as f:
+            if sorted(json.load(f)) != sorted(artefacts):
+                return False
+
+        for name, dest_path in artefacts.items():
+            src_path = os.path.join(entry_path, name)
+            if os.path.isdir(src_path):
+                shutil.copytree(src_path, dest_path, dirs_exist_ok=True)
+            else:
+                shutil.copyfile(src_path, dest_path)
+        # marks the entry as recently used, for `prune`
+        os.utime(entry_path)
+        return True
+
+    def store(self, key, artefacts: dict):
+        """
+        Caches each artefact {name: source path} under `key`, replacing any
+        existing entry. The entry is only visible once complete.
+        """
+        entry_path = os.path.join(self.root, key)
+        tmp_path = os.path.join(self.root, f".{key}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for name, src_path in artefacts.items():
+            if os.path.isdir(src_path):
+                shutil.copytree(src_path, os.path.join(tmp_path, name))
+            else:
+                shutil.copyfile(src_path, os.path.join(tmp_path, name))
+        with open(os.path.join(tmp_path, "artefacts.json"), "w") as f:
+            json.dump(sorted(artefacts), f)
+
+        shutil.rmtree(entry_path, ignore_errors=True)
+        os.replace(tmp_path, entry_path)
+
+    def prune(self, max_entries=None, max_age_days=None):
+        """
+        Deletes the entries last used over `max_age_days` ago, then the least
+        recently used entries beyond the `max_entries` most recent. Returns
+        the keys deleted.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        entries = sorted(
+            (
+                (os.stat(os.path.join(self.root, key)).st_mtime, key)
+                for key in os.listdir(self.root)
+                if not key.startswith(".")
+                and os.path.isdir(os.path.join(self.root, key))
+            ),
+            reverse=True,
+        )
+
+        expired = []
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 86400
+            expired = [key for used_at, key in entries if used_at < cutoff]
+        if max_entries is not None:
+            expired += [key for _, key in entries[max_entries:] if key not in expired]
+
+        for key in expired:
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        return expired
 
 
 def scale_col(df, col_name, min_val=2, max_val=12):
@@ -591,42 +1259,6 @@ def write_tooltip(name, time, tiploc, sheduled, timetabled, percentage):
     return html
 
 
-def get_colour(val, colour_scale: list = None):
-    """
-    Manual specification of a colour scale for plotting continuous values.
-    """
-    if colour_scale is None:
-        colour_scale = [
-            "#000000",
-            "#8b0000",
-            "#ff0000",
-            "#ff0066",
-            "#ff00cc",
-            "#cc00ff",
-            "#6600ff",
-            "#0000ff",
-        ]
-
-    if val == 0:
-        return colour_scale[0]
-    if val < 50:
-        return colour_scale[1]
-    elif (val >= 50) & (val < 60):
-        return colour_scale[2]
-    elif (val >= 60) & (val < 70):
-        return colour_scale[3]
-    elif (val >= 70) & (val < 80):
-        return colour_scale[4]
-    elif (val >= 80) & (val < 90):
-        return colour_scale[5]
-    elif (val >= 90) & (val < 100):
-        return colour_scale[6]
-    elif val >= 100:
-        return colour_scale[7]
-    else:
-        return "#808080"
-
-
 def build_legend_macro():  # noqa: E501
     """
     Manually builds our map legend for folium using HTML and JavaScript.
@@ -740,44 +1372,31 @@ def build_legend_macro():  # noqa: E501
     return macro
 
 
-def build_features(gp_df, colour_scale=None):
+def get_colour_indices(pcts):
     """
-    Utility function creates a geojson features structure out of a
-    geoPandas DataFrame.
+    Bins an array of percentages into colour indices: 0 for exactly 0%,
+    1-7 for the `COLOUR_BINS` bins (under 50% ... 100% and over), and 8 for
+    a missing percentage.
     """
-    features = [
-        {
-            "type": "Feature",
-            "geometry": {
-                "type": mapping(row["geometry"])["type"],
-                "coordinates": mapping(row["geometry"])["coordinates"],
-            },
-            "properties": {
-                "times": row["times"],
-                "popup": write_tooltip(
-                    row["Station_Name"],
-                    row["times"][0],
-                    row["TIPLOC"],
-                    row["journeys_scheduled"],
-                    row["journeys_timetabled"],
-                    row["pct_timetabled_services_running"],
-                ),
-                "style": {"color": ""},
-                "icon": "circle",
-                "iconstyle": {
-                    "fillColor": get_colour(
-                        row["pct_timetabled_services_running"],
-                        colour_scale=colour_scale,
-                    ),
-                    "fillOpacity": 0.5,
-                    "radius": row["radius"],
-                },
-            },
-        }
-        for _, row in gp_df.iterrows()
-    ]
+    pcts = np.asarray(pcts, dtype="float64")
+
+    # 0 is reserved for exactly 0%, bins [..50), [50, 60) ... [100..) follow
+    idx = np.digitize(pcts, COLOUR_BINS) + 1
+    idx[pcts == 0] = 0
+    idx[np.isnan(pcts)] = 8
+    return idx
+
 
-    return features
+def get_colours(vals, colour_scale: list = None):
+    """
+    Maps an array of percentages onto `colour_scale` by their
+    `get_colour_indices`, a missing percentage being grey.
+    """
+    if colour_scale is None:
+        colour_scale = COLOUR_SCALE
+
+    palette = np.array(list(colour_scale[:8]) + ["#808080"], dtype=object)
+    return palette[get_colour_indices(vals)]
 
 
 def build_base_map(
@@ -847,29 +1466,6 @@ def build_base_map(
     return m
 
 
-def add_timestamped_geojson(m, features):
-    """
-    Add TimestampGeoJson to the folium map, constructed from a features dict.
-    """
-    TimestampedGeoJson(
-        {
-            "type": "FeatureCollection",
-            "features": features,
-        },
-        transition_time=2000,
-        period="P1D",
-        duration="PT1s",
-        max_speed=2,
-        date_options="YYYY-MM-DD",
-        auto_play=False,
-    ).add_to(m)
-
-    # fit view to bounds
-    m.fit_bounds(m.get_bounds())
-
-    return m
-
-
 def add_logo(m):
     """
     Adds our awesome logo to the folium map.
@@ -916,42 +1512,6 @@ def add_build_date(m):
     return m
 
 
-def build_static_visual(folder_path, date, place, m):
-    """
-    Workaround; generates a static map image from our interactive folium map
-    using firefox and geckodriver in the background to open the HTML that
-    contains it.
-
-    Attribution:
-    This code snippet is a modified and refactored version of the Folium
-    `_to_png` method of the `map` class. This base method was not fit for
-    purpose in this use case, and has been modified to suit this specific
-    need. The original code snippet can be found here:
-    https://github.com/python-visualization/folium/blob/76647fed2c9f279c57825b1
-    fe01d34c129089ff8/folium/folium.py#L324-#L356
-    Within Folium's main repository:
-    https://github.com/python-visualization/folium
-    """
-
-    png_filename = f"full_uk_disruption_summary_{date}_{place}.png"
-
-    options = webdriver.firefox.options.Options()
-    options.add_argument("--headless")
-    driver = webdriver.Firefox(options=options)
-
-    html = m.get_root().render()
-    with temp_html_filepath(html) as fname:
-        driver.get("file:///{path}".format(path=fname))
-        driver.set_window_position(0, 0)
-        driver.set_window_size(1680, 1050)
-        time.sleep(5)
-        img_data = driver.get_screenshot_as_png()
-        driver.quit()
-
-    img = Image.open(io.BytesIO(img_data))
-    img.save(os.path.join(folder_path, png_filename))
-
-
 def build_template_middle_publication(colour_scale, day=None):
     """
     Used by `build_macro_legend_publication` below, to manually build a legend
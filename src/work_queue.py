@@ -0,0 +1,483 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import click
+import pandas as pd
+
+import build_timetable
+from backfill import build_feed, discover_feeds, init_worker
+from history_store import HistoryStore
+from utils import download_big_file
+
+UNITS_TABLE = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    zip_name TEXT NOT NULL,
+    feed_number INTEGER NOT NULL,
+    dump_date TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    no_days INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    finished_at TEXT,
+    UNIQUE (zip_name, dump_date, start_date, no_days)
+)
+"""
+
+
+def feed_shards(feed, no_days, shard_days):
+    """
+    Splits the `no_days` from the day after a feed was dumped into work units
+    of at most `shard_days` each.
+    """
+    first_date = feed["dump_date"] + timedelta(days=1)
+    return [
+        {
+            "zip_name": feed["zip_name"],
+            "feed_number": feed["feed_number"],
+            "dump_date": str(feed["dump_date"]),
+            "start_date": str(first_date + timedelta(days=offset)),
+            "no_days": min(shard_days, no_days - offset),
+        }
+        for offset in range(0, no_days, shard_days)
+    ]
+
+
+class WorkQueue:
+    """
+    Queue of (feed, date range) work units in a SQLite database in a shared
+    `directory`, with each unit's summary written alongside under
+    `results/`.
+
+    Workers claim a unit with a lease, which they renew while working on it.
+    A unit whose lease expires, such as when its worker dies, is claimed
+    again by the next worker to ask, up to `max_attempts` claims. Every
+    claim has its own lease token, and only the holder of the current token
+    can complete a unit, so a worker that lost its lease cannot overwrite
+    the result of the one that took it over.
+
+    Every change is one SQLite transaction, so the queue holds for local
+    workers, and for workers on other nodes where the shared file system
+    supports SQLite's file locks.
+    """
+
+    def __init__(self, directory, max_attempts=3):
+        self.directory = directory
+        self.max_attempts = max_attempts
+        self.path = os.path.join(directory, "queue.sqlite")
+        self.results_directory = os.path.join(directory, "results")
+        os.makedirs(self.results_directory, exist_ok=True)
+        connection = self.connect()
+        connection.execute(UNITS_TABLE)
+        connection.close()
+
+    def connect(self):
+        # transactions are begun explicitly, so claims can take the write lock
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def transaction(self, statements):
+        """
+        Runs `statements(connection)` in one write transaction, returning its
+        result.
+        """
+        connection = self.connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            result = statements(connection)
+            connection.execute("COMMIT")
+            return result
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def submit(self, units):
+        """
+        Adds work units, skipping any already queued. Returns the number
+        added.
+        """
+        columns = ["zip_name", "feed_number", "dump_date", "start_date", "no_days"]
+
+        def insert(connection):
+            return sum(
+                connection.execute(
+                    f"INSERT OR IGNORE INTO units ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})",
+                    [unit[column] for column in columns],
+                ).rowcount
+                for unit in units
+            )
+
+        return self.transaction(insert)
+
+    def claim(self, worker, lease_seconds):
+        """
+        Leases the next pending unit, or one whose lease has expired, to
+        `worker` for `lease_seconds`, returning it as a dict, or None if no
+        unit can be claimed. Expired units claimed `max_attempts` times
+        already are failed instead.
+        """
+        now = time.time()
+
+        def lease(connection):
+            connection.execute(
+                "UPDATE units SET status = 'failed', error = 'lease expired' "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = connection.execute(
+                "SELECT id FROM units WHERE status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE units SET status = 'leased', worker = ?, lease_token = ?, "
+                "lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, uuid.uuid4().hex, now + lease_seconds, row["id"]),
+            )
+            return dict(
+                connection.execute(
+                    "SELECT * FROM units WHERE id = ?", (row["id"],)
+                ).fetchone()
+            )
+
+        return self.transaction(lease)
+
+    def renew(self, unit, lease_seconds):
+        """
+        Extends the lease on a claimed unit, returning False if it has been
+        lost to another worker.
+        """
+        return self.transaction(
+            lambda connection: connection.execute(
+                "UPDATE units SET lease_expires = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (time.time() + lease_seconds, unit["id"], unit["lease_token"]),
+            ).rowcount
+            == 1
+        )
+
+    def complete(self, unit, out_df):
+        """
+        Writes the summary built for a claimed unit to `results/` and marks
+        the unit done, returning False, and discarding the summary, if the
+        lease has been lost to another worker.
+
+        The summary is renamed into place only once the lease is checked,
+        holding the write lock, so a worker never claims the unit in
+        between. A worker that dies between the rename and the commit can
+        leave a file behind that no unit refers to, so results are only
+        ever read through the `result` of done units (see `read_results`).
+        """
+        result_name = f"unit_{unit['id']:06d}_{unit['lease_token']}.parquet"
+        result_path = os.path.join(self.results_directory, result_name)
+
+        # written aside then renamed into place, so a result is never partial
+        tmp_path = os.path.join(self.results_directory, f".{result_name}.tmp")
+        out_df.to_parquet(tmp_path, index=False)
+
+        def finish(connection):
+            held = (
+                connection.execute(
+                    "UPDATE units SET status = 'done', result = ?, finished_at = ? "
+                    "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                    (
+                        result_name,
+                        datetime.now().isoformat(timespec="seconds"),
+                        unit["id"],
+                        unit["lease_token"],
+                    ),
+                ).rowcount
+                == 1
+            )
+            if held:
+                os.rename(tmp_path, result_path)
+            return held
+
+        try:
+            return self.transaction(finish)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def fail(self, unit, error):
+        """
+        Releases a claimed unit that could not be built, to be claimed again,
+        or fails it once claimed `max_attempts` times.
+        """
+        self.transaction(
+            lambda connection: connection.execute(
+                "UPDATE units SET status = CASE WHEN attempts >= ? "
+                "THEN 'failed' ELSE 'pending' END, error = ?, lease_expires = NULL "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (self.max_attempts, error, unit["id"], unit["lease_token"]),
+            )
+        )
+
+    def units(self):
+        """
+        Returns every unit in the queue, with its status, as a DataFrame.
+        """
+        connection = self.connect()
+        try:
+            return pd.read_sql_query("SELECT * FROM units ORDER BY id", connection)
+        finally:
+            connection.close()
+
+    def read_results(self, units):
+        """
+        Reads and joins the summaries of done `units`, oldest date first.
+        """
+        return pd.concat(
+            [
+                pd.read_parquet(os.path.join(self.results_directory, result_name))
+                for result_name in units.sort_values("start_date")["result"]
+            ],
+            ignore_index=True,
+        )
+
+
+class LeaseRenewer(threading.Thread):
+    """
+    Renews the lease on a unit every third of `lease_seconds` until
+    stopped, so long builds keep their units.
+    """
+
+    def __init__(self, queue, unit, lease_seconds):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.unit = unit
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        logger = logging.getLogger(__name__)
+        while not self.stopped.wait(self.lease_seconds / 3):
+            if not self.queue.renew(self.unit, self.lease_seconds):
+                logger.warning(f"Lost the lease on unit {self.unit['id']}.")
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def work(queue, data_directory, worker, build_options, lease_seconds, poll_seconds):
+    """
+    Claims and builds units from `queue` until none are left to claim or
+    held by other workers, returning the number of units completed.
+    """
+    logger = logging.getLogger(__name__)
+
+    completed = 0
+    while True:
+        unit = queue.claim(worker, lease_seconds)
+        if unit is None:
+            if not queue.units()["status"].isin(["pending", "leased"]).any():
+                return completed
+            # others hold the remaining units, wait in case their leases expire
+            time.sleep(poll_seconds)
+            continue
+
+        logger.info(
+            f"{worker} claimed unit {unit['id']}: {unit['zip_name']} "
+            f"from {unit['start_date']} for {unit['no_days']} days."
+        )
+        renewer = LeaseRenewer(queue, unit, lease_seconds)
+        renewer.start()
+        try:
+            entry, out_df = build_feed(
+                {
+                    "zip_name": unit["zip_name"],
+                    "feed_number": unit["feed_number"],
+                    "dump_date": datetime.strptime(
+                        unit["dump_date"], "%Y-%m-%d"
+                    ).date(),
+                },
+                data_directory,
+                unit["no_days"],
+                start_date=datetime.strptime(unit["start_date"], "%Y-%m-%d").date(),
+                **build_options,
+            )
+        finally:
+            renewer.stop()
+
+        if out_df is None:
+            queue.fail(unit, entry["error"])
+        elif queue.complete(unit, out_df):
+            completed += 1
+            logger.info(f"{worker} completed unit {unit['id']} in {entry['seconds']}s.")
+        else:
+            logger.warning(f"{worker} lost unit {unit['id']}, discarding its result.")
+
+
+@click.group()
+def main():
+    """
+    Runs backfills of the historical store across several workers, on one
+    or many nodes, through a shared work queue.
+    """
+
+
+@main.command()
+@click.argument("queue_directory")
+@click.argument("data_directory")
+@click.option("--no_days", default=30, type=int)
+@click.option("--shard_days", default=7, type=int)
+def submit(queue_directory: str, data_directory: str, no_days: int, shard_days: int):
+    """
+    Queues a unit for every `shard_days` of every archived feed.
+
+    Arguments:
+        queue_directory -- Shared directory of the work queue
+        data_directory -- Directory containing the archived ATOC zip files
+    """
+    logger = logging.getLogger(__name__)
+
+    # fetched once up front, rather than by each worker at the same time
+    download_big_file(os.getenv("URL_STOPS"), "Stops.csv", data_directory)
+
+    feeds = discover_feeds(data_directory)
+    added = WorkQueue(queue_directory).submit(
+        [unit for feed in feeds for unit in feed_shards(feed, no_days, shard_days)]
+    )
+    logger.info(f"Queued {added} units from {len(feeds)} feeds.")
+
+
+@main.command(name="work")
+@click.argument("queue_directory")
+@click.argument("data_directory")
+@click.option("--lease_seconds", default=600, type=int)
+@click.option("--poll_seconds", default=30, type=int)
+@click.option("--max_attempts", default=3, type=int)
+@click.option("--worker_id", default=None, type=str)
+@click.option("--memory_limit_mb", default=None, type=int)
+@click.option(
+    "--low_memory", is_flag=True, show_default=False, default=False, type=bool
+)
+@click.option("--memory_budget_mb", default=512, type=int)
+@click.option("--scratch_directory", default=None, type=str)
+@click.option(
+    "--engine",
+    default="legacy",
+    type=click.Choice(["legacy", *build_timetable.DAY_COUNTERS]),
+)
+def work_command(
+    queue_directory: str,
+    data_directory: str,
+    lease_seconds: int,
+    poll_seconds: int,
+    max_attempts: int,
+    worker_id: str,
+    memory_limit_mb: int,
+    low_memory: bool,
+    memory_budget_mb: int,
+    scratch_directory: str,
+    engine: str,
+):
+    """
+    Builds queued units until none are left, as one worker.
+
+    Arguments:
+        queue_directory -- Shared directory of the work queue
+        data_directory -- This node's path to the archived ATOC zip files
+    """
+    logger = logging.getLogger(__name__)
+
+    init_worker(memory_limit_mb)
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    completed = work(
+        WorkQueue(queue_directory, max_attempts),
+        data_directory,
+        worker_id,
+        {
+            "low_memory": low_memory,
+            "memory_budget_mb": memory_budget_mb,
+            "scratch_directory": scratch_directory,
+            "engine": engine,
+        },
+        lease_seconds,
+        poll_seconds,
+    )
+    logger.info(f"{worker_id} finished after completing {completed} units.")
+
+
+@main.command()
+@click.argument("queue_directory")
+@click.argument("history_directory")
+def collect(queue_directory: str, history_directory: str):
+    """
+    Adds each feed whose units are all done to the historical store.
+
+    Arguments:
+        queue_directory -- Shared directory of the work queue
+        history_directory -- Directory of the historical store
+    """
+    logger = logging.getLogger(__name__)
+
+    queue = WorkQueue(queue_directory)
+    store = HistoryStore(history_directory)
+    stored = {(feed["feed_number"], feed["dump_date"]) for feed in store.feeds()}
+    for (feed_number, dump_date), units in queue.units().groupby(
+        ["feed_number", "dump_date"]
+    ):
+        if (feed_number, dump_date) in stored:
+            continue
+        if not (units["status"] == "done").all():
+            logger.info(
+                f"Feed {feed_number} ({dump_date}) has units not done, skipping."
+            )
+            continue
+        store.append(
+            queue.read_results(units),
+            feed_number=int(feed_number),
+            dump_date=datetime.strptime(dump_date, "%Y-%m-%d").date(),
+        )
+
+
+@main.command()
+@click.argument("queue_directory")
+def status(queue_directory: str):
+    """
+    Shows the number of units in each status, and any errors.
+
+    Arguments:
+        queue_directory -- Shared directory of the work queue
+    """
+    units = WorkQueue(queue_directory).units()
+    click.echo(units["status"].value_counts().to_string())
+    failed = units[units["status"] == "failed"]
+    if len(failed):
+        click.echo(failed[["id", "zip_name", "start_date", "error"]].to_string())
+
+
+if __name__ == "__main__":
+    # Configure logging
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=log_fmt,
+        filename=os.path.join(
+            os.getenv("DIR_LOG"), f"{str(datetime.now().date())}.log"
+        ),
+    )
+
+    main()
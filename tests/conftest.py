@@ -0,0 +1,107 @@
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+import pytest
+
+# the scripts in src import each other as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+# a Monday, inside the validity of every schedule below
+DAY = date(2022, 8, 1)
+
+
+def schedule_rows(identifier, stops, flag="P"):
+    """
+    Returns the parsed rows of a schedule running every day of 2022, calling
+    at `stops`, a list of (TIPLOC, HHMM) in order.
+    """
+    return [
+        {
+            "Identifier": identifier,
+            "TIPLOC": tiploc,
+            "TIPLOC_type": "I",
+            "Time": time,
+            "Stop": stop,
+            "Flag": flag,
+            "Operator": "XX",
+            "Valid_from": 220101,
+            "Valid_to": 221231,
+            **{weekday: "1" for weekday in WEEKDAYS},
+            "Small_hours": 0,
+        }
+        for stop, (tiploc, time) in enumerate(stops, start=1)
+    ]
+
+
+@pytest.fixture
+def schedules():
+    """
+    Parsed schedules (as `build_timetable.load_schedules` returns them) of
+    three services over four stations, with every service calling at CCC
+    cancelled, and the stations as `find_station_tiplocs` returns them.
+    """
+    calendar_df = pd.DataFrame(
+        schedule_rows("A1", [("AAA", "0800"), ("BBB", "0830")])
+        + schedule_rows("B1", [("CCC", "0900"), ("BBB", "0930")])
+        + schedule_rows("C1", [("AAA", "1000"), ("DDD", "1030")])
+    )
+    cancelled_df = pd.DataFrame(
+        [
+            {
+                "Identifier": "B1",
+                "Valid_from": 220801,
+                "Valid_to": 220801,
+                **{weekday: "1" for weekday in WEEKDAYS},
+            }
+        ]
+    )
+    station_tiplocs = pd.DataFrame(
+        {
+            "TIPLOC": ["AAA", "BBB", "CCC", "DDD"],
+            "Station_Name": ["Aston", "Barton", "Carlton", "Dalton"],
+            "Latitude": [51.5, 52.5, 53.5, 54.5],
+            "Longitude": [-0.1, -1.1, -2.1, -3.1],
+        }
+    )
+    return calendar_df, cancelled_df, station_tiplocs
+
+
+@pytest.fixture(scope="session")
+def synthetic_feed(tmp_path_factory):
+    """
+    A small synthetic feed dumped on `DAY` (see `generate_synthetic_feed.py`),
+    as its data directory, zip name and dump date.
+    """
+    from generate_synthetic_feed import generate_feed
+
+    data_directory = str(tmp_path_factory.mktemp("feed"))
+    summary = generate_feed(
+        data_directory, no_schedules=400, no_stations=60, start_date=DAY
+    )
+    return data_directory, os.path.basename(summary["zip_path"]), summary["dump_date"]
+
+
+@pytest.fixture(scope="session")
+def synthetic_schedules(synthetic_feed):
+    """
+    Parsed schedules of the synthetic feed, with its stations.
+    """
+    from build_timetable import load_schedules
+    from utils import find_station_tiplocs
+
+    data_directory, zip_name, dump_date = synthetic_feed
+    calendar_df, cancelled_df = load_schedules(data_directory, zip_name, dump_date)
+    station_tiplocs = find_station_tiplocs(os.path.join(data_directory, "Stops.csv"))
+    return calendar_df, cancelled_df, station_tiplocs
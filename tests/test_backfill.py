@@ -0,0 +1,33 @@
+import multiprocessing
+import time
+
+from backfill import init_worker
+from profiling import rss_mb
+
+
+def outgrow_memory_limit():
+    """
+    Caps the process 50 MB above what it holds, then allocates past that,
+    returning how long the allocation lived before failing.
+    """
+    init_worker(rss_mb() + 50)
+    started = time.perf_counter()
+    try:
+        allocation = b"x" * 100 * 2**20
+        while time.perf_counter() - started < 10:
+            time.sleep(0.01)
+        del allocation
+    except MemoryError:
+        return time.perf_counter() - started
+    return None
+
+
+def test_worker_over_memory_limit_fails(tmp_path, monkeypatch):
+    monkeypatch.setenv("DIR_LOG", str(tmp_path))
+
+    # in a process of its own, as the pool workers are, to keep the signal
+    # handler out of the test run
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        seconds = pool.apply(outgrow_memory_limit)
+
+    assert seconds is not None and seconds < 5
@@ -0,0 +1,78 @@
+import click
+import numpy as np
+import pytest
+
+from build_timetable import check_counting_options, summarise_day, summarise_days
+from conftest import DAY
+from utils import read_disruption_summary, write_disruption_summary
+
+
+def test_summarise_day_counts_all_cancelled_station_as_zero(schedules, tmp_path):
+    calendar_df, cancelled_df, station_tiplocs = schedules
+
+    output = summarise_day(calendar_df, cancelled_df, station_tiplocs, DAY)[3]
+    counts = output.set_index("TIPLOC")
+
+    assert counts.loc["CCC", "journeys_timetabled"] == 1
+    assert counts.loc["CCC", "journeys_scheduled"] == 0
+    assert counts.loc["CCC", "pct_timetabled_services_running"] == 0.0
+    assert counts.loc["BBB", "journeys_scheduled"] == 1
+    assert counts.loc["BBB", "pct_timetabled_services_running"] == 50.0
+
+    # scheduled counts are stored as integers
+    output_path = str(tmp_path / "summary.parquet")
+    write_disruption_summary(output, output_path)
+    stored = read_disruption_summary(output_path).set_index("TIPLOC")
+    assert stored.loc["CCC", "journeys_scheduled"] == 0
+
+
+def test_summarise_days_breaks_down_only_when_asked(schedules):
+    calendar_df, cancelled_df, station_tiplocs = schedules
+    station_codes = np.sort(station_tiplocs["TIPLOC"].unique())
+
+    _, breakdowns = summarise_days(
+        calendar_df.copy(), cancelled_df.copy(), station_tiplocs, [DAY], station_codes
+    )
+    assert breakdowns == {}
+
+    _, breakdowns = summarise_days(
+        calendar_df.copy(),
+        cancelled_df.copy(),
+        station_tiplocs,
+        [DAY],
+        station_codes,
+        hourly_profile=True,
+        station_pairs=True,
+    )
+    hourly_timetabled, hourly_scheduled = breakdowns["hourly"]
+    carlton = list(station_codes).index("CCC")
+    assert hourly_timetabled[0, carlton, 9] == 1
+    assert hourly_scheduled[0, carlton].sum() == 0
+    assert hourly_timetabled[0].sum() == 6
+    assert hourly_scheduled[0].sum() == 4
+
+    edges_timetabled, edges_scheduled = breakdowns["edges"]
+    assert edges_timetabled[0].sum() == 3
+    # the service between CCC and BBB is cancelled
+    assert edges_scheduled[0].sum() == 2
+
+
+def test_csv_summary_reads_with_or_without_index(schedules, tmp_path):
+    calendar_df, cancelled_df, station_tiplocs = schedules
+    output = summarise_day(calendar_df, cancelled_df, station_tiplocs, DAY)[3]
+
+    for name, index in [("summary.csv", False), ("legacy.csv", True)]:
+        output.to_csv(tmp_path / name, index=index)
+        stored = read_disruption_summary(str(tmp_path / name))
+        assert stored.columns.tolist() == output.columns.tolist()
+        assert stored["date"].tolist() == [DAY] * len(output)
+
+
+def test_low_memory_error_names_only_the_breakdowns_asked_for():
+    breakdown_flags = {"--hourly_profile": False, "--station_pairs": True}
+    check_counting_options(False, "legacy", breakdown_flags)
+
+    with pytest.raises(click.BadParameter) as error:
+        check_counting_options(True, "legacy", breakdown_flags)
+    assert "--station_pairs need" in str(error.value)
+    assert "--hourly_profile" not in str(error.value)
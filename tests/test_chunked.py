@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from chunked import SpillStore, load_schedules_chunked, summarise_store
+from compare_engines import diff_station_days, run_engine, station_day_counts
+from conftest import DAY
+from engines import ENGINES
+
+DATES = [DAY + timedelta(days=day) for day in range(3)]
+
+# small enough that the synthetic feed is spilled many times over
+MEMORY_BUDGET_MB = 0.05
+
+
+def test_spill_store_groups_whole_identifiers(tmp_path, synthetic_schedules):
+    calendar_df, cancelled_df, _ = synthetic_schedules
+
+    with SpillStore(str(tmp_path), MEMORY_BUDGET_MB, no_buckets=16) as store:
+        for start in range(0, len(calendar_df), 500):
+            store.add(
+                calendar_df.iloc[start : start + 500],
+                cancelled_df.iloc[start : start + 500],
+            )
+        groups = list(store.groups())
+
+    assert store.no_spills > 1
+    assert len(groups) > 1
+    calendar_groups = [group_calendar for group_calendar, _ in groups]
+    assert sum(len(group) for group in calendar_groups) == len(calendar_df)
+    assert sum(len(group) for _, group in groups) == len(cancelled_df)
+
+    # every schedule (and its cancellations) lands in exactly one group
+    owners = pd.concat(
+        [
+            group[["Identifier"]].drop_duplicates().assign(group=number)
+            for number, group in enumerate(calendar_groups)
+        ]
+    )
+    assert not owners["Identifier"].duplicated().any()
+    owner = owners.set_index("Identifier")["group"]
+    for number, (_, group_cancelled) in enumerate(groups):
+        assert (group_cancelled["Identifier"].map(owner).dropna() == number).all()
+
+
+def test_spilled_counts_match_in_memory_counts(
+    tmp_path, synthetic_feed, synthetic_schedules
+):
+    station_tiplocs = synthetic_schedules[2]
+    expected, _ = run_engine(ENGINES["legacy"], *synthetic_schedules, DATES)
+
+    with SpillStore(str(tmp_path), MEMORY_BUDGET_MB) as store:
+        load_schedules_chunked(*synthetic_feed, store, chunk_size=20)
+        assert store.no_spills > 1
+        output = summarise_store(store, station_tiplocs, DATES)
+
+    expected = station_day_counts(expected)
+    assert len(expected)
+    assert diff_station_days(expected, station_day_counts(output)).empty
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from build_timetable import DAY_COUNTERS, summarise_days
+from compare_engines import diff_station_days, run_engine, station_day_counts
+from conftest import DAY
+from engines import ENGINES
+
+DATES = [DAY + timedelta(days=day) for day in range(3)]
+
+
+@pytest.mark.parametrize("engine", [name for name in ENGINES if name != "legacy"])
+def test_engine_matches_legacy(engine, schedules):
+    expected, _ = run_engine(ENGINES["legacy"], *schedules, DATES)
+    output, _ = run_engine(ENGINES[engine], *schedules, DATES)
+
+    assert diff_station_days(
+        station_day_counts(expected), station_day_counts(output)
+    ).empty
+
+    # the station with every service cancelled is counted, as 0
+    counts = station_day_counts(output).set_index(["date", "TIPLOC"])
+    assert counts.loc[(str(DAY), "CCC"), "journeys_scheduled"] == 0
+    assert counts.loc[(str(DAY), "CCC"), "pct_timetabled_services_running"] == 0.0
+
+
+@pytest.mark.parametrize("engine", [name for name in ENGINES if name != "legacy"])
+def test_engine_matches_legacy_on_synthetic_feed(engine, synthetic_schedules):
+    expected, _ = run_engine(ENGINES["legacy"], *synthetic_schedules, DATES)
+    output, _ = run_engine(ENGINES[engine], *synthetic_schedules, DATES)
+
+    expected = station_day_counts(expected)
+    assert len(expected)
+    assert diff_station_days(expected, station_day_counts(output)).empty
+
+
+@pytest.mark.parametrize("engine", DAY_COUNTERS)
+def test_summarise_days_counts_with_engine(engine, schedules):
+    calendar_df, cancelled_df, station_tiplocs = schedules
+    station_codes = np.sort(station_tiplocs["TIPLOC"].unique())
+    expected, _ = summarise_days(
+        calendar_df.copy(), cancelled_df.copy(), station_tiplocs, DATES, station_codes
+    )
+
+    output, breakdowns = summarise_days(
+        calendar_df, cancelled_df, station_tiplocs, DATES, station_codes, engine=engine
+    )
+
+    assert breakdowns == {}
+    assert diff_station_days(
+        station_day_counts(expected), station_day_counts(output)
+    ).empty
+    with pytest.raises(ValueError):
+        summarise_days(
+            calendar_df,
+            cancelled_df,
+            station_tiplocs,
+            DATES,
+            station_codes,
+            hourly_profile=True,
+            engine=engine,
+        )
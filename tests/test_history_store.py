@@ -0,0 +1,107 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from history_store import HistoryStore
+
+
+def feed_summary(journeys_scheduled, dates):
+    """Returns a `build_timetable.py` summary of two stations on `dates`."""
+    return pd.DataFrame(
+        {
+            "TIPLOC": ["AAA", "BBB"] * len(dates),
+            "journeys_scheduled": journeys_scheduled * len(dates),
+            "journeys_timetabled": [4, 2] * len(dates),
+            "pct_timetabled_services_running": [
+                scheduled / timetabled * 100
+                for scheduled, timetabled in zip(journeys_scheduled, [4, 2])
+            ]
+            * len(dates),
+            "Station_Name": ["Aston", "Barton"] * len(dates),
+            "Latitude": [51.5, 52.5] * len(dates),
+            "Longitude": [-0.1, -1.1] * len(dates),
+            "date": [day for day in dates for _ in range(2)],
+        }
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(
+        feed_summary([3, 0], [date(2022, 8, 2), date(2022, 8, 3)]),
+        feed_number=610,
+        dump_date=date(2022, 8, 1),
+    )
+    store.append(
+        feed_summary([4, 1], [date(2022, 8, 3), date(2022, 8, 4)]),
+        feed_number=611,
+        dump_date=date(2022, 8, 2),
+    )
+    return store
+
+
+def test_append_is_idempotent(store):
+    assert (
+        store.append(
+            feed_summary([3, 0], [date(2022, 8, 2)]),
+            feed_number=610,
+            dump_date=date(2022, 8, 1),
+        )
+        == 0
+    )
+    assert [feed["feed_number"] for feed in store.feeds()] == [610, 611]
+
+    # the latest feed planning each day
+    series = store.station_series("AAA", latest_only=True)
+    assert list(series["feed_number"]) == [610, 611, 611]
+    assert list(series["journeys_scheduled"]) == [3, 4, 4]
+    assert len(store.station_series("AAA")) == 4
+
+
+def test_compact_retires_files_until_grace_period(store):
+    before = store.station_series(["AAA", "BBB"])
+    files_before = store.month_files()["service_month=2022-08"]
+
+    assert store.compact() == 1
+    (compacted,) = store.month_files()["service_month=2022-08"]
+    assert os.path.basename(compacted).startswith("compacted_")
+    pd.testing.assert_frame_equal(store.station_series(["AAA", "BBB"]), before)
+
+    # retired files stay readable for reads that listed them before
+    assert sorted(store.retired()) == files_before
+    assert all(os.path.exists(os.path.join(store.root, f)) for f in files_before)
+
+    # and are deleted by a later compaction once past the grace period
+    store.append(
+        feed_summary([2, 2], [date(2022, 8, 5)]),
+        feed_number=612,
+        dump_date=date(2022, 8, 3),
+    )
+    assert store.compact(grace_seconds=0) == 1
+    assert not any(
+        os.path.exists(os.path.join(store.root, f)) for f in [*files_before, compacted]
+    )
+    assert store.retired() == {}
+    assert len(store.month_files()["service_month=2022-08"]) == 1
+    assert len(store.station_series("AAA")) == 5
+
+
+def test_compact_skips_files_of_unrecorded_feeds(store):
+    # an append interrupted before recording its feed in the manifest
+    unrecorded = os.path.join(
+        store.root, "service_month=2022-08", "feed_00612_20220803.parquet"
+    )
+    os.rename(
+        os.path.join(
+            store.root, "service_month=2022-08", "feed_00611_20220802.parquet"
+        ),
+        unrecorded,
+    )
+
+    assert store.compact() == 0
+    assert "service_month=2022-08/feed_00612_20220803.parquet" in (
+        store.month_files()["service_month=2022-08"]
+    )
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from map_features import build_compact_features
+from utils import COLOUR_SCALE, get_colour_indices, get_colours
+
+PCTS = [0.0, 49.9, 50.0, 99.9, 100.0, 120.0, np.nan]
+INDICES = [0, 1, 2, 6, 7, 7, 8]
+
+
+def test_colour_indices_at_bin_boundaries():
+    assert get_colour_indices(PCTS).tolist() == INDICES
+
+
+def test_colours_and_compact_features_share_indices():
+    assert get_colours(PCTS).tolist() == [
+        COLOUR_SCALE[idx] if idx < 8 else "#808080" for idx in INDICES
+    ]
+
+    df = pd.DataFrame(
+        {
+            "Longitude": -1.5,
+            "Latitude": 53.8,
+            "date": "2022-08-01",
+            "Station_Name": "Leeds",
+            "TIPLOC": "LEEDS",
+            "journeys_scheduled": 10.0,
+            "journeys_timetabled": 10.0,
+            "pct_timetabled_services_running": PCTS,
+            "radius": 4.0,
+        }
+    )
+    features = build_compact_features(df)
+    assert [f["properties"]["c"] for f in features] == INDICES
@@ -0,0 +1,92 @@
+import pandas as pd
+
+from conftest import schedule_rows
+from network import StationGraph
+
+STATIONS = ["AAA", "BBB", "CCC", "DDD"]
+
+
+def build_graph(*services):
+    """Returns the `StationGraph` of `services`, (identifier, stops) pairs."""
+    rows_df = pd.DataFrame(
+        [
+            row
+            for identifier, stops in services
+            for row in schedule_rows(identifier, stops)
+        ]
+    )
+    return StationGraph.from_schedule(rows_df, STATIONS)
+
+
+def test_graph_is_built_in_csr_form(schedules):
+    calendar_df, _, _ = schedules
+    graph = StationGraph.from_schedule(calendar_df, STATIONS)
+
+    # AAA -> BBB, AAA -> DDD and CCC -> BBB, one service each
+    assert graph.station_codes.tolist() == STATIONS
+    assert graph.indptr.tolist() == [0, 2, 2, 3, 3]
+    assert graph.indices.tolist() == [1, 3, 1]
+    assert graph.services.tolist() == [1, 1, 1]
+    assert graph.conn_ptr.tolist() == [0, 1, 2, 3]
+    assert graph.departures.tolist() == [480, 600, 540]
+    assert graph.arrivals.tolist() == [510, 630, 570]
+    assert graph.neighbours("AAA")["TIPLOC"].tolist() == ["BBB", "DDD"]
+
+
+def test_arrivals_are_earliest_by_any_later_departure():
+    graph = build_graph(
+        # slow, then fast, then a later arrival, with a passing point
+        ("A1", [("AAA", "0700"), ("XXX", "0800"), ("BBB", "0950")]),
+        ("A2", [("AAA", "0800"), ("BBB", "0830")]),
+        ("A3", [("AAA", "0900"), ("BBB", "0910")]),
+        # an earlier arrival on the next edge, which must not carry over
+        ("B1", [("AAA", "0600"), ("CCC", "0605")]),
+    )
+
+    assert graph.indices.tolist() == [1, 2]
+    assert graph.services.tolist() == [3, 1]
+    assert graph.earliest.tolist() == [420, 360]
+    assert graph.latest.tolist() == [540, 360]
+    assert graph.departures.tolist() == [420, 480, 540, 360]
+    assert graph.arrivals.tolist() == [510, 510, 550, 365]
+
+
+def test_services_past_midnight_keep_increasing_times():
+    graph = build_graph(("N1", [("BBB", "2350"), ("DDD", "0020")]))
+
+    assert graph.departures.tolist() == [1430]
+    assert graph.arrivals.tolist() == [1460]
+    reached = graph.reachable("BBB", depart_after="2300")
+    assert reached.to_dict("list") == {
+        "TIPLOC": ["BBB", "DDD"],
+        "minutes": [0, 80],
+        "arrival": ["23:00", "00:20+1"],
+    }
+
+
+def test_reachable_within_budget(schedules):
+    calendar_df, _, _ = schedules
+    graph = StationGraph.from_schedule(calendar_df, STATIONS)
+
+    assert graph.reachable("AAA", "0800")["TIPLOC"].tolist() == [
+        "AAA",
+        "BBB",
+        "DDD",
+    ]
+    assert graph.reachable("AAA", "0800", budget=30)["TIPLOC"].tolist() == [
+        "AAA",
+        "BBB",
+    ]
+    assert graph.reachable("AAA", "0800", budget=29)["TIPLOC"].tolist() == ["AAA"]
+
+
+def test_graph_round_trips_through_save(schedules, tmp_path):
+    calendar_df, _, _ = schedules
+    graph = StationGraph.from_schedule(calendar_df, STATIONS)
+
+    graph.save(tmp_path / "graph.npz")
+    loaded = StationGraph.load(tmp_path / "graph.npz")
+
+    for name in StationGraph.ARRAYS:
+        assert getattr(loaded, name).tolist() == getattr(graph, name).tolist()
+    assert loaded.reachable("AAA").equals(graph.reachable("AAA"))
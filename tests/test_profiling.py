@@ -0,0 +1,41 @@
+import tracemalloc
+
+from profiling import StageProfiler
+
+
+def test_profile_without_tracing_records_time_and_rss():
+    profiler = StageProfiler(trace_memory=False)
+
+    with profiler.stage("parse", rows_in=3) as record:
+        record["rows_out"] = 2
+
+    assert not tracemalloc.is_tracing()
+    (record,) = profiler.stages
+    assert record["stage"] == "parse"
+    assert (record["rows_in"], record["rows_out"]) == (3, 2)
+    assert record["wall_s"] >= 0 and record["cpu_s"] >= 0
+    assert "max_rss_mb" in record
+    assert "peak_mb" not in record
+
+
+def test_profile_tracing_memory_records_peak():
+    profiler = StageProfiler(trace_memory=True)
+    try:
+        with profiler.stage("allocate"):
+            data = bytearray(8 * 2**20)
+            del data
+    finally:
+        tracemalloc.stop()
+
+    assert profiler.stages[0]["peak_mb"] >= 8
+
+
+def test_disabled_profiler_records_nothing(tmp_path):
+    profiler = StageProfiler(enabled=False)
+
+    with profiler.stage("parse") as record:
+        record["rows_out"] = 1
+
+    profiler.write_report(str(tmp_path / "report.json"))
+    assert profiler.stages == []
+    assert not (tmp_path / "report.json").exists()
@@ -0,0 +1,79 @@
+import gzip
+import json
+
+from publish import compact_json_literals, find_artefacts, minify_html, publish_artefact
+
+SCRIPT = """
+    var geo_json = L.geoJson({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"name": "Leeds"}}
+    ]});
+    var label = '{"looks": "like json", "list": [1, 2]}';
+    var quoted = "[1, 2, 3]";
+    var template = `{"a": [1, 2]}`;
+    // {"in": "a comment"}
+    var pattern = /[{]\\s+"key": \\[/g;
+    var half = total / 2, options = {"zoom": 6, "center": [54.0, -2.0]};
+"""
+
+
+def test_compact_json_literals_only_compacts_code():
+    compacted = compact_json_literals(SCRIPT)
+
+    assert (
+        'L.geoJson({"type":"FeatureCollection","features":'
+        '[{"type":"Feature","properties":{"name":"Leeds"}}]})'
+    ) in compacted
+    assert '\'{"looks": "like json", "list": [1, 2]}\'' in compacted
+    assert '"[1, 2, 3]"' in compacted
+    assert '`{"a": [1, 2]}`' in compacted
+    assert '// {"in": "a comment"}' in compacted
+    assert '/[{]\\s+"key": \\[/g' in compacted
+    assert 'total / 2, options = {"zoom":6,"center":[54.0,-2.0]}' in compacted
+
+
+def test_compact_json_literals_escapes_markup_in_strings():
+    compacted = compact_json_literals('var data = {"html": "<b>A & B</b>"};')
+
+    assert (
+        compacted == 'var data = {"html":"\\u003cb\\u003eA \\u0026 B\\u003c/b\\u003e"};'
+    )
+
+
+def test_minify_html_keeps_preformatted_text():
+    html = (
+        "<html>\n  <head>\n    <style>\n      .a { color: red; }\n    </style>\n"
+        "  </head>\n  <body>\n    <!-- comment -->\n    <pre>  keep\n   this</pre>\n"
+        f"    <script>{SCRIPT}</script>\n  </body>\n</html>\n"
+    )
+
+    minified = minify_html(html)
+
+    assert "<style>.a{color: red}</style>" in minified
+    assert "<!--" not in minified
+    assert "<pre>  keep\n   this</pre>" in minified
+    assert 'var quoted = "[1, 2, 3]";' in minified
+    assert len(minified) < len(html)
+
+
+def test_publish_artefact_writes_compressed_siblings(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps({"stations": list(range(100))}, indent=4))
+
+    sizes = publish_artefact(str(path))
+
+    minified = path.read_bytes()
+    assert json.loads(minified) == {"stations": list(range(100))}
+    assert sizes["minified"] == len(minified) < sizes["original"]
+    assert gzip.decompress((tmp_path / "data.json.gz").read_bytes()) == minified
+    if "br" in sizes:
+        import brotli
+
+        assert brotli.decompress((tmp_path / "data.json.br").read_bytes()) == minified
+
+
+def test_find_artefacts_skips_reports(tmp_path):
+    for name in ["map.html", "map_make_visualisations_profile.json", "map.png"]:
+        (tmp_path / name).write_text("{}")
+    (tmp_path / "publish_report.json").write_text("{}")
+
+    assert find_artefacts(str(tmp_path)) == [str(tmp_path / "map.html")]
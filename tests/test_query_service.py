@@ -0,0 +1,68 @@
+import json
+import threading
+from datetime import date
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pandas as pd
+import pytest
+
+from history_store import HistoryStore
+from query_service import make_server
+
+
+@pytest.fixture
+def server(tmp_path):
+    HistoryStore(str(tmp_path)).append(
+        pd.DataFrame(
+            {
+                "TIPLOC": ["AAA", "BBB"],
+                "journeys_scheduled": [3, 0],
+                "journeys_timetabled": [4, 2],
+                "pct_timetabled_services_running": [75.0, 0.0],
+                "Station_Name": ["Aston", "Barton"],
+                "Latitude": [51.5, 52.5],
+                "Longitude": [-0.1, -1.1],
+                "date": [date(2022, 8, 2), date(2022, 8, 2)],
+            }
+        ),
+        feed_number=610,
+        dump_date=date(2022, 8, 1),
+    )
+    server = make_server(str(tmp_path), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path):
+    """Returns the status and JSON body of a GET of `path` from `server`."""
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    try:
+        with urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_query_statuses(server):
+    status, body = get(server, "/stations/AAA")
+    assert status == 200
+    assert [record["journeys_scheduled"] for record in body] == [3]
+
+    assert get(server, "/trains/AAA")[0] == 404
+    assert get(server, "/day/02-08-2022")[0] == 400
+
+
+def test_unexpected_error_is_a_json_500(server, monkeypatch):
+    def fail(path, query=""):
+        raise OSError("store unreadable")
+
+    monkeypatch.setattr(server.service, "query", fail)
+
+    assert get(server, "/stations/AAA") == (500, {"error": "internal error"})
+    # and the server carries on serving
+    monkeypatch.undo()
+    assert get(server, "/stations/AAA")[0] == 200
@@ -0,0 +1,70 @@
+import pandas as pd
+
+from raster_maps import (
+    GB_BBOX,
+    XYZTileCache,
+    build_raster_visuals,
+    hash_view_tiles,
+    static_views,
+    tiles_for_view,
+)
+from utils import REGION_BBOXES
+
+SIZE = (840, 525)
+
+
+class RecordingTileCache:
+    """Tile cache holding no tiles, recording every tile asked for."""
+
+    def __init__(self):
+        self.requested = set()
+
+    def get(self, z, x, y):
+        self.requested.add((z, x, y))
+        return None
+
+
+def test_raster_visuals_only_need_seeded_tiles(tmp_path):
+    seeded = {
+        tile
+        for _, bbox, padding in static_views(REGION_BBOXES)
+        for tile in tiles_for_view(bbox, SIZE, padding)[1]
+    }
+    # stations well inside GB, so their own extent would give another view
+    df = pd.DataFrame(
+        {
+            "Latitude": [51.5, 53.5, 55.9],
+            "Longitude": [-0.1, -2.2, -3.2],
+            "pct_timetabled_services_running": [100.0, 50.0, 0.0],
+            "radius": [5.0, 5.0, 5.0],
+        }
+    )
+    cache = RecordingTileCache()
+
+    render_seconds = build_raster_visuals(
+        str(tmp_path), "20220801", df, cache, REGION_BBOXES, SIZE
+    )
+
+    assert list(render_seconds) == ["GB", *REGION_BBOXES]
+    assert cache.requested == seeded
+    assert len(list(tmp_path.glob("*.png"))) == 1 + len(REGION_BBOXES)
+
+
+def test_view_tiles_hash_changes_with_seeded_tiles(tmp_path):
+    cache = XYZTileCache(str(tmp_path))
+    unseeded = hash_view_tiles(cache, REGION_BBOXES, SIZE)
+    assert hash_view_tiles(cache, REGION_BBOXES, SIZE) == unseeded
+
+    gb_tile = tiles_for_view(GB_BBOX, SIZE)[1][0]
+    cache.put(*gb_tile, b"tile")
+    seeded = hash_view_tiles(str(tmp_path), REGION_BBOXES, SIZE)
+    assert seeded != unseeded
+
+    # restyled tiles invalidate renders too
+    cache.put(*gb_tile, b"restyled tile")
+    restyled = hash_view_tiles(cache, REGION_BBOXES, SIZE)
+    assert restyled != seeded
+
+    # tiles no view draws on do not
+    cache.put(0, 0, 0, b"tile")
+    assert hash_view_tiles(cache, REGION_BBOXES, SIZE) == restyled
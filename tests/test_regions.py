@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+
+from regions import cached_region_assignment, hash_regions
+
+REGIONS = {
+    "north": [(53.0, -3.0), (55.0, 0.0)],
+    "south": [(50.0, -3.0), (52.0, 0.0)],
+}
+
+STATIONS = pd.DataFrame(
+    {
+        "TIPLOC": ["LEEDS", "BRSTL", "ABRDN"],
+        "Latitude": [53.79, 51.45, 57.14],
+        "Longitude": [-1.54, -2.58, -2.09],
+    }
+)
+
+
+def daily_rows(no_days):
+    """Returns `STATIONS` as in a summary of `no_days`, a row per day."""
+    return pd.concat(
+        [STATIONS.assign(date=day) for day in range(no_days)], ignore_index=True
+    )
+
+
+def test_hash_regions_depends_on_distinct_stations_only():
+    one_day = hash_regions(daily_rows(1), REGIONS)
+
+    assert hash_regions(daily_rows(30), REGIONS) == one_day
+    assert hash_regions(daily_rows(3).iloc[::-1], REGIONS) == one_day
+    assert hash_regions(STATIONS.iloc[:2], REGIONS) != one_day
+    moved = STATIONS.assign(Latitude=STATIONS["Latitude"] + 0.01)
+    assert hash_regions(moved, REGIONS) != one_day
+
+
+def test_cached_region_assignment_is_shared_across_days(tmp_path):
+    first = cached_region_assignment(daily_rows(1), REGIONS, str(tmp_path))
+    assert os.listdir(tmp_path) == [
+        f"regions_{hash_regions(STATIONS, REGIONS)[:16]}.csv"
+    ]
+
+    cached = cached_region_assignment(daily_rows(7), REGIONS, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    assert dict(zip(cached["TIPLOC"], cached["region"])) == {
+        "LEEDS": "north",
+        "BRSTL": "south",
+    }
+    assert dict(zip(first["TIPLOC"], first["region"])) == dict(
+        zip(cached["TIPLOC"], cached["region"])
+    )
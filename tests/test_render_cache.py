@@ -0,0 +1,38 @@
+import os
+import time
+
+from utils import RenderCache
+
+
+def store_entry(cache, key, tmp_path, used_at):
+    """Stores a one file entry under `key`, last used at `used_at`."""
+    artefact = tmp_path / f"{key}.html"
+    artefact.write_text(key)
+    cache.store(key, {"map.html": str(artefact)})
+    os.utime(os.path.join(cache.root, key), (used_at, used_at))
+
+
+def test_restore_copies_stored_artefacts(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    store_entry(cache, "key", tmp_path, time.time())
+
+    dest_path = tmp_path / "restored.html"
+    assert not cache.restore("other", {"map.html": str(dest_path)})
+    assert not cache.restore("key", {"other.html": str(dest_path)})
+    assert cache.restore("key", {"map.html": str(dest_path)})
+    assert dest_path.read_text() == "key"
+
+
+def test_prune_keeps_recently_used_entries(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    now = time.time()
+    for age_days, key in enumerate(["new", "old", "older", "oldest"]):
+        store_entry(cache, key, tmp_path, now - age_days * 86400 - 60)
+
+    # restoring counts as use
+    cache.restore("oldest", {"map.html": str(tmp_path / "restored.html")})
+
+    assert sorted(cache.prune(max_age_days=2)) == ["older"]
+    assert cache.prune(max_entries=2) == ["old"]
+    assert sorted(os.listdir(cache.root)) == ["new", "oldest"]
+    assert cache.prune() == []
@@ -0,0 +1,53 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from static_maps import MAP_SETTLED_JS
+
+# just enough of Leaflet and Leaflet.TimeDimension for MAP_SETTLED_JS
+FAKE_LEAFLET = """
+function GridLayer(loading) { this._loading = loading; }
+function TimeDimensionLayer(ready) { this._ready = ready; }
+TimeDimensionLayer.prototype.isReady = function (time) { return this._ready; };
+var L = {GridLayer: GridLayer, TimeDimension: {Layer: TimeDimensionLayer}};
+
+function makeMap(layers) {
+    return {
+        _loaded: true,
+        timeDimension: {getCurrentTime: function () { return 0; }},
+        eachLayer: function (f) { layers.forEach(f); },
+        hasLayer: function (layer) { return layers.indexOf(layer) >= 0; },
+    };
+}
+var window = {};
+var settled = function () {
+    %s
+};
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_map_settles_once_tiles_and_data_are_loaded():
+    cases = {
+        "tiles loading": "[new GridLayer(true), new TimeDimensionLayer(true)]",
+        "no data layer yet": "[new GridLayer(false)]",
+        "data fetching": "[new GridLayer(false), new TimeDimensionLayer(false)]",
+        "data drawn": "[new GridLayer(false), new TimeDimensionLayer(true)]",
+    }
+    script = FAKE_LEAFLET % MAP_SETTLED_JS.replace("arguments[0]", '"map"') + "".join(
+        f"window.map = makeMap({layers}); console.log(JSON.stringify(settled()));\n"
+        for layers in cases.values()
+    )
+
+    output = subprocess.run(
+        ["node", "-e", script], capture_output=True, text=True, check=True
+    ).stdout.split()
+
+    assert dict(zip(cases, map(json.loads, output))) == {
+        "tiles loading": False,
+        "no data layer yet": False,
+        "data fetching": False,
+        "data drawn": True,
+    }
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from work_queue import WorkQueue
+
+UNIT = {
+    "zip_name": "RJTTF610.ZIP",
+    "feed_number": 610,
+    "dump_date": "2022-08-01",
+    "start_date": "2022-08-02",
+    "no_days": 7,
+}
+
+
+@pytest.fixture
+def summary():
+    return pd.DataFrame(
+        {
+            "TIPLOC": ["AAA", "BBB"],
+            "journeys_scheduled": [3, 0],
+            "journeys_timetabled": [4, 2],
+            "pct_timetabled_services_running": [75.0, 0.0],
+            "Station_Name": ["Aston", "Barton"],
+            "Latitude": [51.5, 52.5],
+            "Longitude": [-0.1, -1.1],
+            "date": pd.to_datetime(["2022-08-02", "2022-08-02"]).date,
+        }
+    )
+
+
+def test_submit_skips_queued_units(tmp_path):
+    queue = WorkQueue(str(tmp_path))
+
+    assert queue.submit([UNIT]) == 1
+    assert queue.submit([UNIT]) == 0
+    assert list(queue.units()["status"]) == ["pending"]
+
+
+def test_lost_lease_cannot_complete(tmp_path, summary):
+    queue = WorkQueue(str(tmp_path))
+    queue.submit([UNIT])
+
+    # the first worker's lease runs out before it finishes
+    lost = queue.claim("worker-1", lease_seconds=0)
+    time.sleep(0.01)
+    taken = queue.claim("worker-2", lease_seconds=60)
+    assert taken["id"] == lost["id"]
+    assert taken["lease_token"] != lost["lease_token"]
+
+    assert not queue.renew(lost, lease_seconds=60)
+    assert not queue.complete(lost, summary)
+    assert os.listdir(queue.results_directory) == []
+
+    assert queue.renew(taken, lease_seconds=60)
+    assert queue.complete(taken, summary)
+    units = queue.units()
+    assert list(units["status"]) == ["done"]
+    assert os.listdir(queue.results_directory) == [units.loc[0, "result"]]
+    pd.testing.assert_frame_equal(queue.read_results(units), summary)
+
+    # the first worker cannot undo the completion either
+    assert not queue.complete(lost, summary)
+    assert list(queue.units()["status"]) == ["done"]
+
+
+def test_fail_retries_until_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path), max_attempts=2)
+    queue.submit([UNIT])
+
+    queue.fail(queue.claim("worker-1", lease_seconds=60), "error 1")
+    assert list(queue.units()["status"]) == ["pending"]
+
+    queue.fail(queue.claim("worker-1", lease_seconds=60), "error 2")
+    units = queue.units()
+    assert list(units["status"]) == ["failed"]
+    assert units.loc[0, "error"] == "error 2"
+    assert queue.claim("worker-1", lease_seconds=60) is None